@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+本地模拟的OpenAI兼容chat-completions服务
+
+根据system prompt判断是哪个agent发起的请求，返回预先写好的响应（规划、步骤代码、整合、修正、指标分析），
+响应延迟按配置的分布随机生成，支持stream=True（含stream_options.include_usage）以及按比例返回429/500错误。
+只用于离线压测，不调用真实的模型。
+
+    python benchmarks/mock_llm.py --port 8765 --latency lognormal:-1.2,0.4
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8765/v1 python server/server.py
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_PLAN = '''
+Step 1: Import the required libraries and set the random seed.
+Step 2: Load the dataset from the csv file.
+Step 3: Preprocess the features: fill missing values and scale numeric columns.
+Step 4: Split the data into training and test sets.
+Step 5: Define the random forest classifier model.
+Step 6: Train the model on the training set.
+Step 7: Evaluate the model on the test set and report the accuracy.
+'''.strip()
+
+# 按system prompt中的关键词识别agent，依次匹配
+DEFAULT_SCRIPT = {
+    'planner': {
+        'match': 'planning machine learning',
+        'content': DEFAULT_PLAN,
+    },
+    'writer': {
+        'match': 'code generation related to machine learning',
+        'content': "```python\nvalue = sum(range(100))\n```",
+    },
+    'refiner': {
+        'match': 'modifying and correcting',
+        'content': "```python\nvalue = sum(range(100))\nprint('accuracy:', 0.95)\n```",
+    },
+    'revisor': {
+        'match': 'fixing errors',
+        'content': "```python\nprint('accuracy:', 0.95)\n```",
+    },
+    'metrics': {
+        'match': '评估指标',
+        'content': json.dumps({
+            'metrics': [{'name': 'Accuracy', 'type': 'accuracy', 'description': '分类准确率',
+                         'target_value': '0.95', 'priority': 'high'}],
+            'task_type': 'classification',
+            'dataset_info': {'target_variable': 'label', 'problem_type': 'classification'},
+        }, ensure_ascii=False),
+    },
+}
+
+FALLBACK_CONTENT = "```python\nprint('ok')\n```"
+
+
+def parse_latency(spec):
+    '''
+    解析延迟分布（秒）：
+        constant:0.2
+        uniform:0.1,0.5
+        lognormal:mu,sigma   （对数正态，exp(mu)为中位数）
+    '''
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v]
+    if kind == 'constant':
+        return lambda rng: values[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+
+def _approx_tokens(text):
+    # 模拟服务只需要量级合理的usage，按4个字符一个token估算
+    return max(1, math.ceil(len(text) / 4))
+
+
+class MockLLMServer:
+    '''
+    模拟的chat-completions服务，在后台线程中运行
+
+    Params:
+        port: 监听端口，0表示随机分配
+        latency: 整个响应的延迟分布，见parse_latency
+        ttft: 流式响应中首个chunk占整个延迟的比例
+        chunks: 流式响应拆分的chunk数
+        error_rate: 返回错误的请求比例，错误交替为429（带Retry-After）和500
+        script: 覆盖DEFAULT_SCRIPT中的响应，{agent: {"match": 关键词, "content": 响应}}
+        seed: 随机数种子，固定后每次压测的延迟序列相同
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, latency='constant:0.05', ttft=0.3, chunks=8,
+                 error_rate=0.0, script=None, seed=0):
+        self.latency = parse_latency(latency)
+        self.ttft = ttft
+        self.chunks = max(1, chunks)
+        self.error_rate = error_rate
+        self.script = {**DEFAULT_SCRIPT, **(script or {})}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.errors = 0
+
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='mock-llm', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        with self._lock:
+            return {'requests': dict(self.requests), 'errors': self.errors}
+
+    def respond(self, body):
+        '''
+        根据请求体选出agent和响应内容，并抽样本次的延迟和是否返回错误
+
+        Returns:
+            (agent, content, delay, error_status)
+        '''
+        messages = body.get('messages') or []
+        system = next((m.get('content', '') for m in messages if m.get('role') == 'system'), '')
+        agent, content = 'unknown', FALLBACK_CONTENT
+        for name, entry in self.script.items():
+            if entry['match'] in system:
+                agent, content = name, entry['content']
+                break
+
+        with self._lock:
+            delay = max(0.0, self.latency(self._rng))
+            error_status = None
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.errors += 1
+                error_status = 429 if self.errors % 2 else 500
+            self.requests[agent] = self.requests.get(agent, 0) + 1
+        return agent, content, delay, error_status
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                agent, content, delay, error_status = server.respond(body)
+
+                if error_status is not None:
+                    headers = {'Retry-After': '0'} if error_status == 429 else {}
+                    self._send_json(error_status, {'error': {'message': 'mock error', 'type': 'mock'}}, headers)
+                    return
+
+                prompt = ''.join(str(m.get('content', '')) for m in body.get('messages') or [])
+                usage = {
+                    'prompt_tokens': _approx_tokens(prompt),
+                    'completion_tokens': _approx_tokens(content),
+                }
+                usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+
+                if body.get('stream'):
+                    include_usage = (body.get('stream_options') or {}).get('include_usage')
+                    self._send_stream(body.get('model'), content, delay, usage if include_usage else None)
+                else:
+                    time.sleep(delay)
+                    self._send_json(200, {
+                        'id': f'chatcmpl-{uuid.uuid4().hex}',
+                        'object': 'chat.completion',
+                        'created': int(time.time()),
+                        'model': body.get('model'),
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': content}}],
+                        'usage': usage,
+                    })
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, model, content, delay, usage):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+
+                completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+                size = math.ceil(len(content) / server.chunks) or 1
+                pieces = [content[i:i + size] for i in range(0, len(content), size)] or ['']
+                first_delay = delay * server.ttft
+                rest_delay = (delay - first_delay) / max(1, len(pieces) - 1)
+
+                def send(chunk):
+                    self.wfile.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+
+                for i, piece in enumerate(pieces):
+                    time.sleep(first_delay if i == 0 else rest_delay)
+                    send({
+                        'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                        'model': model,
+                        'choices': [{'index': 0, 'delta': {'content': piece},
+                                     'finish_reason': 'stop' if i == len(pieces) - 1 else None}],
+                    })
+                if usage is not None:
+                    send({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                          'model': model, 'choices': [], 'usage': usage})
+                self.wfile.write(b'data: [DONE]\n\n')
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local OpenAI-compatible mock LLM server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', default='constant:0.05', help='constant:S | uniform:A,B | lognormal:MU,SIGMA')
+    parser.add_argument('--ttft', type=float, default=0.3, help='fraction of the latency before the first chunk')
+    parser.add_argument('--chunks', type=int, default=8)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--script', help='JSON file overriding the scripted responses')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, 'r', encoding='utf-8') as f:
+            script = json.load(f)
+
+    server = MockLLMServer(args.host, args.port, args.latency, args.ttft, args.chunks,
+                           args.error_rate, script, args.seed)
+    print(f'Mock LLM server listening on {server.base_url}')
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+离线压测：在本地模拟的LLM服务（mock_llm.py）上运行代码生成流程，统计延迟、吞吐、内存和进程数，
+并与保存的基线比较，超出阈值时以非0状态退出。
+
+场景：
+    run       并发调用 deepseek_agent.api.run()
+    flask     通过Flask的 /api/generate-code 提交任务并轮询结果
+    sessions  模拟WebSocket会话：规划 -> 逐步流式生成并增量检查 -> 整合
+
+    python benchmarks/run_benchmarks.py                      # 运行并与baseline.json比较
+    python benchmarks/run_benchmarks.py --update-baseline    # 以本次结果作为新的基线
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from mock_llm import MockLLMServer
+
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = BENCHMARK_DIR.parent
+BASELINE_PATH = BENCHMARK_DIR / 'baseline.json'
+
+TASK_PROMPT = 'Use random forest model to classify the iris dataset. Report the accuracy on the test set.'
+
+SCENARIOS = ('run', 'flask', 'sessions')
+
+# 越小越好的指标；throughput越大越好
+LOWER_IS_BETTER = ('p50', 'p95', 'p99', 'peak_rss_mb', 'peak_processes')
+HIGHER_IS_BETTER = ('throughput',)
+# 延迟很小时相对误差没有意义，低于这个差值（秒）的变化不算退化
+LATENCY_SLACK = 0.02
+
+
+def percentile(values, q):
+    '''
+    线性插值的分位数，q取0~100
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _process_tree(root_pid):
+    # 读取/proc得到root_pid及其所有子孙进程
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat', 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(name))
+
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return 0
+
+
+class ResourceSampler:
+    '''
+    后台线程定期采样本进程及其子进程的总RSS和进程数，记录峰值；没有/proc时退化为getrusage
+    '''
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_processes = 1
+        self._stop = threading.Event()
+        self._thread = None
+        self._has_proc = os.path.isdir('/proc')
+
+    def sample(self):
+        if self._has_proc:
+            pids = _process_tree(os.getpid())
+            rss = sum(_rss_bytes(pid) for pid in pids)
+            self.peak_processes = max(self.peak_processes, len(pids))
+        else:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread = threading.Thread(target=self._loop, name='resource-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def _measure(name, func, iterations, concurrency):
+    '''
+    用concurrency个线程共执行iterations次func(i)，统计每次的耗时和整体资源占用
+    '''
+    latencies = []
+    errors = []
+
+    def one(i):
+        started = time.monotonic()
+        try:
+            func(i)
+        except Exception as e:
+            errors.append(f'{type(e).__name__}: {e}')
+            return
+        latencies.append(time.monotonic() - started)
+
+    with ResourceSampler() as sampler:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(one, range(iterations)))
+        wall_time = time.monotonic() - started
+
+    return {
+        'scenario': name,
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'errors': len(errors),
+        'error_samples': errors[:3],
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'throughput': len(latencies) / wall_time if wall_time else None,
+        'wall_time': wall_time,
+        'peak_rss_mb': sampler.peak_rss / (1024 * 1024),
+        'peak_processes': sampler.peak_processes,
+    }
+
+
+def _dataset_folder(workdir, name):
+    folder = Path(workdir) / name
+    folder.mkdir(parents=True, exist_ok=True)
+    dataset_path = folder / 'iris.csv'
+    dataset_path.write_text('sepal_length,sepal_width,petal_length,petal_width,label\n5.1,3.5,1.4,0.2,0\n')
+    return folder, dataset_path
+
+
+def bench_run(workdir, iterations, concurrency):
+    from deepseek_agent import api
+
+    def one(i):
+        folder, _ = _dataset_folder(workdir, f'run_{i}')
+        result = api.run(TASK_PROMPT, 'generated_code.py', str(folder))
+        if not result['success']:
+            raise RuntimeError(result['stderr'])
+
+    return _measure('run', one, iterations, concurrency)
+
+
+def bench_flask(workdir, iterations, concurrency, poll_interval=0.02):
+    import server
+    client = server.app.test_client()
+
+    def one(i):
+        _, dataset_path = _dataset_folder(workdir, f'flask_{i}')
+        response = client.post('/api/generate-code',
+                               json={'task_prompt': TASK_PROMPT, 'dataset_path': str(dataset_path)})
+        while response.status_code == 429:
+            time.sleep(poll_interval)
+            response = client.post('/api/generate-code',
+                                   json={'task_prompt': TASK_PROMPT, 'dataset_path': str(dataset_path)})
+        if response.status_code != 202:
+            raise RuntimeError(f'generate-code returned {response.status_code}')
+
+        result_url = response.get_json()['result_url']
+        while True:
+            response = client.get(result_url)
+            if response.status_code != 202:
+                break
+            time.sleep(poll_interval)
+        if response.status_code != 200 or not response.get_json()['success']:
+            raise RuntimeError(f'job failed with {response.status_code}')
+
+    return _measure('flask', one, iterations, concurrency)
+
+
+def bench_sessions(workdir, iterations, concurrency):
+    from deepseek_agent import api
+
+    def one(i):
+        session_id = f'benchmark_{i}'
+        plans = api.plan_for_machine_task(TASK_PROMPT)
+        previous_code = ''
+        try:
+            for step_id, step in enumerate(plans, 1):
+                stream = api.generate_current_step_code_stream(TASK_PROMPT, step, step_id, previous_code)
+                code = api._consume_stream(stream, lambda delta: None)
+                result = api.check_step_code(session_id, code, previous_code)
+                if not result['success']:
+                    raise RuntimeError(result['stderr'])
+                previous_code += '\n\n' + code
+            api._consume_stream(api.refine_all_step_code_stream(TASK_PROMPT, previous_code), lambda delta: None)
+        finally:
+            api.close_check_session(session_id)
+
+    return _measure('sessions', one, iterations, concurrency)
+
+
+BENCHMARKS = {
+    'run': bench_run,
+    'flask': bench_flask,
+    'sessions': bench_sessions,
+}
+
+
+def compare(results, baseline, threshold):
+    '''
+    与基线比较，返回退化的指标说明列表
+    '''
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['errors']:
+            regressions.append(f'{name}: {result["errors"]} failed iterations')
+        for metric in LOWER_IS_BETTER:
+            current, previous = result.get(metric), base.get(metric)
+            if current is None or previous is None:
+                continue
+            slack = LATENCY_SLACK if metric.startswith('p') and metric[1:].isdigit() else 0
+            if current > previous * (1 + threshold) + slack:
+                regressions.append(f'{name}.{metric}: {current:.3f} > baseline {previous:.3f} (+{threshold:.0%})')
+        for metric in HIGHER_IS_BETTER:
+            current, previous = result.get(metric), base.get(metric)
+            if current is None or previous is None:
+                continue
+            if current < previous * (1 - threshold):
+                regressions.append(f'{name}.{metric}: {current:.3f} < baseline {previous:.3f} (-{threshold:.0%})')
+    return regressions
+
+
+def _print_table(results):
+    columns = ('p50', 'p95', 'p99', 'throughput', 'peak_rss_mb', 'peak_processes', 'errors')
+    print(f'{"scenario":<10}' + ''.join(f'{c:>16}' for c in columns))
+    for name, result in results.items():
+        cells = []
+        for c in columns:
+            value = result.get(c)
+            cells.append(f'{value:>16.3f}' if isinstance(value, float) else f'{str(value):>16}')
+        print(f'{name:<10}' + ''.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks against a mock LLM server')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--iterations', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', default='constant:0.05', help='mock LLM latency distribution, see mock_llm.py')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=str(BASELINE_PATH))
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative regression')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--output', help='write the full report as JSON')
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    for name in scenarios:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown scenario {name}, choose from {", ".join(SCENARIOS)}')
+
+    mock = MockLLMServer(latency=args.latency, error_rate=args.error_rate, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix='ml_agent_benchmark_')
+
+    # 在导入deepseek_agent之前配置环境：指向模拟服务，关闭响应缓存，产物和检查目录放到临时目录
+    os.environ['DEEPSEEK_BASE_URL'] = mock.base_url
+    os.environ.setdefault('DEEPSEEK_API_KEY', 'benchmark')
+    os.environ.pop('DEEPSEEK_RESPONSE_CACHE', None)
+    os.environ['ARTIFACT_ROOT'] = os.path.join(workdir, 'artifacts')
+    os.environ['CHECK_SANDBOX_ROOT'] = os.path.join(workdir, 'sandboxes')
+    sys.path.insert(0, str(PROJECT_ROOT))
+    sys.path.insert(0, str(PROJECT_ROOT / 'server'))
+    os.chdir(workdir)
+
+    results = {}
+    try:
+        for name in scenarios:
+            print(f'Running {name} ({args.iterations} iterations, concurrency {args.concurrency})...', flush=True)
+            results[name] = BENCHMARKS[name](workdir, args.iterations, args.concurrency)
+    finally:
+        mock.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    _print_table(results)
+    print(f'\nMock LLM requests: {mock.stats()}')
+
+    config = {'iterations': args.iterations, 'concurrency': args.concurrency, 'latency': args.latency}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'results': results, 'mock': mock.stats()}, f, indent=2)
+
+    if args.update_baseline:
+        baseline = {
+            name: {k: round(result[k], 4) if isinstance(result[k], float) else result[k]
+                   for k in LOWER_IS_BETTER + HIGHER_IS_BETTER}
+            for name, result in results.items()
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, **baseline}, f, indent=2)
+        print(f'Baseline written to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --update-baseline to create one')
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('config') and baseline['config'] != config:
+        print(f'Warning: baseline was recorded with {baseline["config"]}, current run uses {config}')
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print('\nRegressions:')
+        for line in regressions:
+            print(f'  {line}')
+        return 1
+    print('\nNo regressions against baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
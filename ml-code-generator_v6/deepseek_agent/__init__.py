@@ -1,3 +1,10 @@
 """
 DeepSeek Agent package for ML code generation
-"""
\ No newline at end of file
+"""
+import os
+
+
+# 检查用的临时目录（数据集样本、增量检查会话、数据集画像、沙箱）的根目录。
+# 默认位于项目根目录下，与当前工作目录无关：Flask服务和Node的Python工作进程使用同一组目录，由Flask的存储清理统一管理
+CHECK_ROOT = os.path.abspath(os.getenv(
+    'CHECK_ROOT', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'temp_check')))
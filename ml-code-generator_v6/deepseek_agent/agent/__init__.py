@@ -1,5 +1,5 @@
-from .coder import WritterAgent
-from .planner import PlannerAgent
-from .refinor import RefinerAgent
-from .revisor import RevisorAgent
-from .metrics_analyzer import MetricsAnalyzerAgent
\ No newline at end of file
+from .coder import WritterAgent, AsyncWritterAgent
+from .planner import PlannerAgent, AsyncPlannerAgent
+from .refinor import RefinerAgent, AsyncRefinerAgent
+from .revisor import RevisorAgent, AsyncRevisorAgent
+from .metrics_analyzer import MetricsAnalyzerAgent, AsyncMetricsAnalyzerAgent
\ No newline at end of file
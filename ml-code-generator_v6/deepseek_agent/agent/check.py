@@ -0,0 +1,315 @@
+"""
+增量代码检查
+
+为每个会话维护一个常驻的解释器进程，保存已通过检查的步骤执行后的命名空间。
+检查新步骤时只执行该步骤的代码，不再重复执行前面所有步骤（重新加载数据、重新训练模型）。
+
+快照/回滚基于fork的写时复制：执行新步骤前先fork出子进程，在子进程中执行代码；
+执行成功则由子进程接管成为新的状态进程，失败则丢弃子进程，原进程即为上一次成功的状态。
+
+本模块在状态进程中以脚本方式运行，因此只依赖标准库。
+"""
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+import time
+
+
+STDERR_TAIL_BYTES = 8 * 1024
+STEP_FAILED = 3
+
+
+class IncrementalChecker:
+    '''
+    有状态的增量代码检查器
+
+    Params:
+        workdir: 执行代码时的工作目录
+        timeout: 单个步骤的最长执行时间（秒）
+        env: 解释器进程的环境变量，默认继承当前进程
+    '''
+
+    def __init__(self, workdir, timeout=600, env=None):
+        self.workdir = workdir
+        self.timeout = timeout
+        self.env = env
+        self.steps = 0
+        self._process = None
+        self._holder_pid = None
+        self._command_id = 0
+        self._good_code = []
+        # 已从stdout读出、尚未组成完整一行的数据
+        self._pending = b''
+        os.makedirs(workdir, exist_ok=True)
+
+    @property
+    def incremental(self):
+        return hasattr(os, 'fork')
+
+    def check(self, code):
+        '''
+        在上一次成功的状态上执行code
+
+        Returns:
+            {"success": bool, "stderr": str | None}
+        '''
+        if not self.incremental:
+            return self._check_by_replay(code)
+
+        if self._process is None:
+            self._start()
+
+        self._command_id += 1
+        self._send({'id': self._command_id, 'code': code, 'step': self.steps + 1})
+        result = self._receive(self._command_id)
+        if result['success']:
+            self.steps += 1
+        return result
+
+    def reset(self):
+        '''
+        丢弃已保存的状态，下一次检查从空的命名空间开始
+        '''
+        self.close()
+        self.steps = 0
+        self._good_code = []
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        self._kill(self._holder_pid)
+        self._process.wait()
+        self._process.stdout.close()
+        self._process = None
+        self._holder_pid = None
+        self._pending = b''
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            cwd=self.workdir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=self.env,
+            # 不使用缓冲：stdout由_read_line直接按文件描述符读取
+            bufsize=0,
+        )
+        self._holder_pid = self._process.pid
+
+    def _send(self, message):
+        data = memoryview((json.dumps(message) + '\n').encode('utf-8'))
+        # 无缓冲的管道写入可能只写了一部分
+        while data:
+            data = data[self._process.stdin.write(data):]
+
+    def _read_line(self, timeout):
+        '''
+        读取状态进程输出的一行，超时返回None，进程退出返回b''
+
+        自行维护读缓冲：select只能看到管道中未读的数据，已读进缓冲区的完整消息必须先处理，
+        否则会一直等待到超时
+        '''
+        fd = self._process.stdout.fileno()
+        deadline = time.monotonic() + timeout
+        while b'\n' not in self._pending:
+            ready, _, _ = select.select([fd], [], [], max(deadline - time.monotonic(), 0))
+            if not ready:
+                return None
+            data = os.read(fd, 65536)
+            if not data:
+                return b''
+            self._pending += data
+        line, self._pending = self._pending.split(b'\n', 1)
+        return line
+
+    def _receive(self, command_id):
+        deadline = time.monotonic() + self.timeout
+        running_pid = None
+
+        while True:
+            line = self._read_line(deadline - time.monotonic())
+            if line is None:
+                # 超时：杀掉正在执行的子进程，状态进程会自动回到上一次成功的状态
+                self._kill(running_pid)
+                return {'success': False, 'stderr': f'TimeoutError: step did not finish within {self.timeout} seconds'}
+
+            if not line:
+                self._process.wait()
+                self._process = None
+                self._pending = b''
+                return {'success': False, 'stderr': 'Checker process exited unexpectedly'}
+
+            message = json.loads(line)
+            if message.get('id') != command_id:
+                # 之前超时被杀掉的步骤遗留的消息
+                continue
+            if message.get('event') == 'started':
+                running_pid = message['pid']
+                continue
+
+            if message['success']:
+                self._holder_pid = message['pid']
+            return {'success': message['success'], 'stderr': message['stderr']}
+
+    def _kill(self, pid):
+        if pid is None:
+            return
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _check_by_replay(self, code):
+        # 不支持fork的平台：退化为重新执行全部已通过的代码
+        script = os.path.join(self.workdir, 'check_this.py')
+        with open(script, 'w', encoding='utf-8') as f:
+            f.write('\n\n'.join(self._good_code + [code]))
+        try:
+            subprocess.run(
+                [sys.executable, 'check_this.py'],
+                cwd=self.workdir,
+                env=self.env,
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=self.timeout,
+            )
+        except subprocess.CalledProcessError as e:
+            return {'success': False, 'stderr': e.stderr}
+        except subprocess.TimeoutExpired:
+            return {'success': False, 'stderr': f'TimeoutError: step did not finish within {self.timeout} seconds'}
+
+        self._good_code.append(code)
+        self.steps += 1
+        return {'success': True, 'stderr': None}
+
+
+def _run_step(namespace, code, step):
+    '''
+    在namespace中执行一个步骤的代码，返回 (success, stderr)
+    '''
+    import linecache
+    import traceback
+
+    filename = f'step_{step}.py'
+    linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+
+    try:
+        exec(compile(code, filename, 'exec'), namespace)
+        return True, None
+    except SystemExit as e:
+        if e.code in (None, 0):
+            return True, None
+        return False, f'SystemExit: {e.code}\n'
+    except BaseException as e:
+        tb = traceback.TracebackException.from_exception(e)
+        # 去掉本模块exec所在的栈帧，只保留生成代码内部的调用栈
+        tb.stack = traceback.StackSummary.from_list(
+            [frame for frame in tb.stack if frame.filename != __file__]
+        )
+        return False, ''.join(tb.format())
+
+
+def _read_stderr_tail(path):
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - STDERR_TAIL_BYTES, 0))
+        return f.read().decode('utf-8', errors='replace')
+
+
+def _serve():
+    '''
+    状态进程主循环：从stdin逐行读取要执行的步骤，结果以JSON行写回原始stdout
+    '''
+    import builtins
+
+    # 协议使用私有的文件描述符，生成代码中的print/input/exit()不会影响通信
+    channel = os.dup(1)
+    stdin = os.fdopen(os.dup(0), 'rb')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+
+    def send(message):
+        try:
+            os.write(channel, (json.dumps(message) + '\n').encode('utf-8'))
+        except BrokenPipeError:
+            # 检查器已经关闭
+            os._exit(0)
+
+    os.setpgid(0, 0)
+    namespace = {'__name__': '__main__', '__builtins__': builtins}
+
+    while True:
+        line = stdin.readline()
+        if not line:
+            os._exit(0)
+        command = json.loads(line)
+        command_id = command['id']
+        step = command['step']
+        log_path = f'step_{step}.stderr.log'
+
+        takeover_r, takeover_w = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            os.close(takeover_r)
+            os.setpgid(0, 0)
+            send({'id': command_id, 'event': 'started', 'pid': os.getpid()})
+
+            log = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            saved_stderr = os.dup(2)
+            os.dup2(devnull, 1)
+            os.dup2(log, 2)
+
+            success, error = _run_step(namespace, command['code'], step)
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_stderr, 2)
+            os.close(saved_stderr)
+            os.close(log)
+
+            if success:
+                os.remove(log_path)
+                # 先通知原状态进程由本进程接管成为新的状态，再返回结果
+                os.write(takeover_w, b'1')
+                os.close(takeover_w)
+                send({'id': command_id, 'success': True, 'stderr': None, 'pid': os.getpid()})
+                continue
+
+            stderr = _read_stderr_tail(log_path)
+            os.remove(log_path)
+            send({'id': command_id, 'success': False, 'stderr': stderr + error, 'pid': os.getpid()})
+            os._exit(STEP_FAILED)
+
+        os.close(takeover_w)
+        took_over = os.read(takeover_r, 1) == b'1'
+        os.close(takeover_r)
+        if took_over:
+            os._exit(0)
+
+        _, status = os.waitpid(pid, 0)
+        if not (os.WIFEXITED(status) and os.WEXITSTATUS(status) == STEP_FAILED):
+            # 子进程异常退出（段错误、被OOM杀掉等），没有来得及返回结果
+            stderr = _read_stderr_tail(log_path) if os.path.exists(log_path) else ''
+            if os.WIFSIGNALED(status):
+                reason = f'Step process was killed by signal {os.WTERMSIG(status)}'
+            else:
+                reason = f'Step process exited with code {os.WEXITSTATUS(status)}'
+            send({'id': command_id, 'success': False, 'stderr': stderr + reason + '\n', 'pid': pid})
+        if os.path.exists(log_path):
+            os.remove(log_path)
+
+
+if __name__ == '__main__':
+    _serve()
@@ -1,4 +1,5 @@
-from .deepseek_api import BaseAgent
+from .deepseek_api import BaseAgent, AsyncBaseAgent
+from .context import PreviousCodeContext
 import re
 
 Problem_Template = '''
@@ -23,6 +24,8 @@ class WritterAgent(BaseAgent):
         
         super().__init__(url, key, model_name, sys_prompt, temperature, top_p)
         
+        self.context_stats = None
+        
         
         
     def __extract_code(self, response):
@@ -35,23 +38,60 @@ class WritterAgent(BaseAgent):
         return code 
             
         
-    def write_code(self, task_prompt, current_step, step_id, previous_code):
+    def _build_prompt(self, task_prompt, current_step, step_id, previous_code, schema=None):
         step = f'Step {step_id}: ' + current_step
         step = ['# ' + item for item in step.split('\n')]
         step = '\n'.join(step)
 
+        # 超出token预算时，较早步骤的代码被压缩为摘要
+        previous_code, self.context_stats = PreviousCodeContext().build(previous_code)
         previous_code += '\n\n' + step + '\n\n' + '# Insert your code for the current step here.'
 
+        # schema为数据集结构摘要（见schema.py），附在任务描述之后
+        if schema:
+            task_prompt = task_prompt + '\n\n' + schema
         prompt = Problem_Template.format(task_prompt, previous_code)
 
-        reponse = super().generate(prompt)
-        super().clean_message()
+        return step, prompt
 
+
+    def _finish_code(self, reponse, step, step_id):
         code = self.__extract_code(reponse)
         if f'Step {step_id}' not in code:
             code = step + '\n\n' + code
 
         return code
 
-    
 
+    def write_code(self, task_prompt, current_step, step_id, previous_code, schema=None):
+        step, prompt = self._build_prompt(task_prompt, current_step, step_id, previous_code, schema)
+
+        reponse = super().generate(prompt)
+        super().clean_message()
+
+        return self._finish_code(reponse, step, step_id)
+
+
+    def write_code_stream(self, task_prompt, current_step, step_id, previous_code, schema=None):
+        '''
+        write_code的流式版本：逐段yield模型输出，结束后返回当前步骤的代码
+        '''
+        step, prompt = self._build_prompt(task_prompt, current_step, step_id, previous_code, schema)
+
+        reponse = yield from super().generate_stream(prompt)
+        super().clean_message()
+
+        return self._finish_code(reponse, step, step_id)
+
+
+class AsyncWritterAgent(WritterAgent, AsyncBaseAgent):
+    '''
+    WritterAgent的异步版本
+    '''
+    async def write_code(self, task_prompt, current_step, step_id, previous_code, schema=None):
+        step, prompt = self._build_prompt(task_prompt, current_step, step_id, previous_code, schema)
+
+        reponse = await self.generate(prompt)
+        self.clean_message()
+
+        return self._finish_code(reponse, step, step_id)
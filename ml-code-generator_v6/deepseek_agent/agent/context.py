@@ -0,0 +1,175 @@
+"""
+控制WritterAgent提示词中previous_code的长度
+
+previous_code由每个步骤的代码依次拼接而成（每步以 "# Step N: ..." 注释开头）。
+超出token预算时，只保留最后若干步的完整代码，更早的步骤压缩为摘要：
+import语句、函数/类的签名、顶层变量的赋值目标，足以让模型知道哪些名字已经定义。
+"""
+import ast
+import logging
+import os
+import re
+
+from .deepseek_api import get_encoding
+
+
+logger = logging.getLogger(__name__)
+
+PREVIOUS_CODE_TOKEN_BUDGET = int(os.getenv('PREVIOUS_CODE_TOKEN_BUDGET', '6000'))
+PREVIOUS_CODE_KEEP_STEPS = int(os.getenv('PREVIOUS_CODE_KEEP_STEPS', '2'))
+
+STEP_HEADER = re.compile(r'^# Step \d+:', re.M)
+MAX_VALUE_LENGTH = 60
+
+
+def split_steps(code):
+    '''
+    按 "# Step N:" 注释把代码拆分为各个步骤，第一个步骤之前的内容单独作为一段
+    '''
+    starts = [match.start() for match in STEP_HEADER.finditer(code)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = starts + [len(code)]
+    steps = [code[bounds[i]:bounds[i + 1]].strip() for i in range(len(starts))]
+    return [step for step in steps if step]
+
+
+def _signature(node):
+    if isinstance(node, ast.ClassDef):
+        bases = [ast.unparse(base) for base in node.bases] + [ast.unparse(keyword) for keyword in node.keywords]
+        return f'class {node.name}({", ".join(bases)}):' if bases else f'class {node.name}:'
+
+    prefix = 'async def' if isinstance(node, ast.AsyncFunctionDef) else 'def'
+    returns = f' -> {ast.unparse(node.returns)}' if node.returns else ''
+    return f'{prefix} {node.name}({ast.unparse(node.args)}){returns}:'
+
+
+def _summarize_node(node, source, indent=''):
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return [indent + ast.get_source_segment(source, node)]
+
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        lines = [indent + _signature(node)]
+        docstring = ast.get_docstring(node)
+        if docstring:
+            lines.append(f'{indent}    """{docstring.strip().splitlines()[0]}"""')
+        lines.append(indent + '    ...')
+        return lines
+
+    if isinstance(node, ast.ClassDef):
+        lines = [indent + _signature(node)]
+        for child in node.body:
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Assign, ast.AnnAssign)):
+                lines.extend(_summarize_node(child, source, indent + '    '))
+        if len(lines) == 1:
+            lines.append(indent + '    ...')
+        return lines
+
+    if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+        segment = ast.get_source_segment(source, node)
+        if '\n' not in segment and len(segment) <= MAX_VALUE_LENGTH:
+            return [indent + segment]
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        names = ' = '.join(ast.get_source_segment(source, target) for target in targets)
+        return [f'{indent}{names} = ...']
+
+    # 其他顶层语句（循环、with、if等）只记录其中定义的名字
+    names = sorted({
+        child.id for child in ast.walk(node)
+        if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store)
+    })
+    if names:
+        return [f'{indent}# defines: {", ".join(names)}']
+    return []
+
+
+def summarize_step(step_code, seen=None):
+    '''
+    把一个步骤的代码压缩为摘要，保留步骤注释、import、函数/类签名和顶层变量；无法解析时原样返回
+
+    Params:
+        seen: 已经出现在之前摘要中的单行语句（import、赋值），重复的不再输出
+    '''
+    try:
+        tree = ast.parse(step_code)
+    except SyntaxError:
+        return step_code
+
+    seen = set() if seen is None else seen
+
+    header = []
+    for line in step_code.split('\n'):
+        if not line.startswith('#'):
+            break
+        header.append(line)
+
+    lines = header + ['# (summarized)']
+    for node in tree.body:
+        summary = _summarize_node(node, step_code)
+        if len(summary) == 1:
+            if summary[0] in seen:
+                continue
+            seen.add(summary[0])
+        lines.extend(summary)
+    return '\n'.join(lines)
+
+
+class PreviousCodeContext:
+    '''
+    在token预算内构造previous_code
+
+    Params:
+        encoding: 计算token数用的编码，默认与agent.encoding相同，只在需要计数时才加载
+        budget: previous_code最多占用的token数
+        keep_steps: 最多保留完整代码的最近步骤数，超出预算时会继续减少
+    '''
+
+    def __init__(self, encoding=None, budget=PREVIOUS_CODE_TOKEN_BUDGET, keep_steps=PREVIOUS_CODE_KEEP_STEPS):
+        self.encoding = encoding
+        self.budget = budget
+        self.keep_steps = keep_steps
+
+    def count(self, text):
+        if self.encoding is None:
+            self.encoding = get_encoding()
+        return len(self.encoding.encode(text))
+
+    def build(self, previous_code):
+        '''
+        Returns:
+            code: 压缩后的previous_code
+            stats: {"original_tokens", "tokens", "saved_tokens", "summarized_steps"}
+        '''
+        previous_code = previous_code or ''
+        stats = {'original_tokens': None, 'tokens': None, 'saved_tokens': 0, 'summarized_steps': 0}
+
+        # 字节级BPE的每个token至少对应一个UTF-8字节，字节数在预算内时无需编码；
+        # 按字符数判断不成立，部分CJK和罕见Unicode字符会被编码为多个token
+        if len(previous_code.encode('utf-8')) <= self.budget:
+            return previous_code, stats
+
+        original_tokens = self.count(previous_code)
+        stats.update(original_tokens=original_tokens, tokens=original_tokens)
+        if original_tokens <= self.budget:
+            return previous_code, stats
+
+        steps = split_steps(previous_code)
+        summaries = {}
+        seen = set()
+        code, tokens = previous_code, original_tokens
+
+        for keep in range(min(self.keep_steps, len(steps)), -1, -1):
+            summarized = len(steps) - keep
+            for i in range(summarized):
+                if i not in summaries:
+                    summaries[i] = summarize_step(steps[i], seen)
+            code = '\n\n'.join([summaries[i] for i in range(summarized)] + steps[summarized:])
+            tokens = self.count(code)
+            stats['summarized_steps'] = summarized
+            if tokens <= self.budget:
+                break
+
+        stats.update(tokens=tokens, saved_tokens=original_tokens - tokens)
+        logger.info('previous_code: %d -> %d tokens (saved %d, summarized %d of %d steps)',
+                    original_tokens, tokens, stats['saved_tokens'], stats['summarized_steps'], len(steps))
+        return code, stats
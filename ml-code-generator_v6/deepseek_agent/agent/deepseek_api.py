@@ -1,5 +1,127 @@
-from openai import OpenAI
-import tiktoken
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+import httpx
+import threading
+import asyncio
+import weakref
+import logging
+import time
+import os
+
+from .response_cache import get_response_cache
+from . import rate_limit
+from .. import telemetry
+
+
+logger = logging.getLogger(__name__)
+
+
+# 进程内共享的OpenAI客户端，按 (base_url, api_key) 复用，以便复用HTTP keep-alive连接
+POOL_MAX_CONNECTIONS = int(os.getenv('DEEPSEEK_POOL_MAX_CONNECTIONS', '20'))
+POOL_MAX_KEEPALIVE = int(os.getenv('DEEPSEEK_POOL_MAX_KEEPALIVE', '10'))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv('DEEPSEEK_POOL_KEEPALIVE_EXPIRY', '30'))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# 异步客户端的连接绑定在事件循环上，因此按事件循环分别缓存
+_async_clients = weakref.WeakKeyDictionary()
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def configure_client_pool(max_connections=None, max_keepalive=None, keepalive_expiry=None):
+    '''
+    调整共享客户端的连接池参数，之后新建的agent使用按新参数创建的客户端
+
+    已创建的客户端不主动关闭：现有agent仍通过self.api持有它们，可能有请求正在进行，
+    等没有agent引用后由垃圾回收关闭连接
+    '''
+    global POOL_MAX_CONNECTIONS, POOL_MAX_KEEPALIVE, POOL_KEEPALIVE_EXPIRY
+
+    with _clients_lock:
+        if max_connections is not None:
+            POOL_MAX_CONNECTIONS = max_connections
+        if max_keepalive is not None:
+            POOL_MAX_KEEPALIVE = max_keepalive
+        if keepalive_expiry is not None:
+            POOL_KEEPALIVE_EXPIRY = keepalive_expiry
+
+        _clients.clear()
+        _async_clients.clear()
+
+
+def get_client(base_url, api_key):
+    '''
+    获取 (base_url, api_key) 对应的共享OpenAI客户端，不存在时创建
+    '''
+    key = (base_url, api_key)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # 重试由BaseAgent按限流器和退避策略处理，客户端自身不再重试
+            client = OpenAI(base_url=base_url, api_key=api_key, max_retries=0,
+                            http_client=DefaultHttpxClient(
+                                limits=_pool_limits(),
+                                event_hooks={'request': [telemetry.on_http_request]},
+                            ))
+            _clients[key] = client
+    return client
+
+
+def get_async_client(base_url, api_key):
+    '''
+    获取当前事件循环中 (base_url, api_key) 对应的共享AsyncOpenAI客户端，必须在协程中调用
+    '''
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+
+    key = (base_url, api_key)
+    client = clients.get(key)
+    if client is None:
+        client = AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0,
+                             http_client=DefaultAsyncHttpxClient(
+                                 limits=_pool_limits(),
+                                 event_hooks={'request': [telemetry.on_async_http_request]},
+                             ))
+        clients[key] = client
+    return client
+
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_encoding():
+    '''
+    懒加载并缓存tiktoken编码，整个进程只加载一次BPE表
+    '''
+    global _encoding
+
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                import tiktoken
+                _encoding = tiktoken.encoding_for_model('gpt-4o')
+    return _encoding
+
+
+def count_tokens(text):
+    '''
+    用共享编码统计文本的token数，编码无法加载时返回None
+    '''
+    try:
+        return len(get_encoding().encode(text))
+    except Exception:
+        return None
 
 
 
@@ -10,15 +132,19 @@ class BaseAgent:
         self.top_p = top_p
         self.sys_prompt = sys_prompt
 
-        self.api = OpenAI(base_url=base_url, api_key=api_key)
+        self.base_url = base_url
+        self.api = get_client(base_url, api_key)
         
         self.messages = []
         self.response_record = []
         
-        self.encoding = tiktoken.encoding_for_model('gpt-4o')
+        
+    @property
+    def encoding(self):
+        return get_encoding()
         
         
-    def generate(self, prompt):
+    def _add_prompt(self, prompt):
         if not self.messages:
             self.messages = [
                     {"role": "system", "content": self.sys_prompt},
@@ -27,14 +153,162 @@ class BaseAgent:
         else: 
             self.messages.append({'role': 'user', 'content': prompt})
         
-        completion = self.api.chat.completions.create(
-            model=self.model_name,
-            messages=self.messages,
-            temperature=self.temperature,
-            top_p=self.top_p,
+        
+    def _cache_key(self, cache):
+        return cache.make_key(self.model_name, self.sys_prompt, self.messages, self.temperature, self.top_p)
+        
+        
+    @property
+    def rate_limiter(self):
+        return rate_limit.get_rate_limiter(self.base_url, self.model_name)
+        
+        
+    def _before_retry(self, error, attempt, reserved):
+        # 失败的请求没有消耗token，退回预约的额度；服务端给出Retry-After时同一限流器上的请求都暂停
+        limiter = self.rate_limiter
+        limiter.settle(reserved, 0)
+        delay = rate_limit.backoff_delay(attempt, error)
+        if rate_limit.retry_after(error) is not None:
+            limiter.pause(delay)
+        logger.warning('%s request failed (%s), retrying in %.1fs (%d/%d)',
+                       type(self).__name__, error, delay, attempt + 1, rate_limit.MAX_RETRIES)
+        return delay
+        
+        
+    def _create(self, **kwargs):
+        '''
+        经过限流调用chat.completions.create，429、5xx和连接错误按退避策略重试
+        
+        Returns:
+            (completion 或 stream, 预约的token数)
+        '''
+        reserved = rate_limit.estimate_tokens(self.messages)
+        for attempt in range(rate_limit.MAX_RETRIES + 1):
+            self._record_wait(self.rate_limiter.acquire(reserved))
+            try:
+                return self.api.chat.completions.create(
+                    model=self.model_name,
+                    messages=self.messages,
+                    temperature=self.temperature,
+                    top_p=self.top_p,
+                    **kwargs,
+                    ), reserved
+            except Exception as e:
+                if attempt >= rate_limit.MAX_RETRIES or not rate_limit.is_retryable(e):
+                    self.rate_limiter.settle(reserved, 0)
+                    raise
+                time.sleep(self._before_retry(e, attempt, reserved))
+        
+        
+    def _record_wait(self, waited):
+        if waited > 0:
+            telemetry.registry.observe('deepseek_llm_rate_limit_wait_seconds', waited,
+                                       help='Time spent waiting for the rate limiter', agent=type(self).__name__)
+        
+        
+    def _settle(self, reserved, usage):
+        self.rate_limiter.settle(reserved, usage.total_tokens if usage is not None else None)
+        
+        
+    def _record_call(self, started, status='ok', response=None, usage=None, ttft=None, attempts=1, stream=False):
+        '''
+        记录一次模型调用的耗时、token用量和重试次数，接口没有返回usage时用本地编码估算token数
+        '''
+        prompt_tokens = completion_tokens = None
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        elif status == 'ok':
+            prompt_tokens = count_tokens('\n'.join(message['content'] for message in self.messages))
+            completion_tokens = count_tokens(response or '')
+        
+        telemetry.record_llm_call(
+            type(self).__name__, self.model_name, time.monotonic() - started,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            ttft=ttft, retries=max(attempts - 1, 0), status=status, stream=stream,
             )
         
+        
+    def generate(self, prompt):
+        self._add_prompt(prompt)
+        started = time.monotonic()
+        
+        cache = get_response_cache()
+        if cache is not None:
+            cache_key = self._cache_key(cache)
+            response = cache.get(cache_key)
+            if response is not None:
+                self.response_record.append(response)
+                self._record_call(started, status='cache_hit')
+                return response
+        
+        with telemetry.count_attempts() as attempts:
+            try:
+                completion, reserved = self._create()
+            except Exception:
+                self._record_call(started, status='error', attempts=attempts[0])
+                raise
+        
         response = completion.choices[0].message.content
+        self._settle(reserved, completion.usage)
+        self._record_call(started, response=response, usage=completion.usage, attempts=attempts[0])
+        
+        if cache is not None and response is not None:
+            cache.set(cache_key, response)
+        
+        self.response_record.append(response)
+        
+        return response
+    
+    
+    def generate_stream(self, prompt):
+        '''
+        流式生成：逐段yield模型输出的文本增量，生成结束后返回完整响应
+        '''
+        self._add_prompt(prompt)
+        started = time.monotonic()
+        
+        cache = get_response_cache()
+        if cache is not None:
+            cache_key = self._cache_key(cache)
+            response = cache.get(cache_key)
+            if response is not None:
+                self.response_record.append(response)
+                self._record_call(started, status='cache_hit', stream=True)
+                yield response
+                return response
+        
+        # 只统计建立流式请求时的重试，不能把ContextVar的作用范围跨过yield
+        with telemetry.count_attempts() as attempts:
+            try:
+                stream, reserved = self._create(stream=True, stream_options={'include_usage': True})
+            except Exception:
+                self._record_call(started, status='error', attempts=attempts[0], stream=True)
+                raise
+        
+        chunks = []
+        usage = ttft = None
+        try:
+            for chunk in stream:
+                # 开启include_usage后，最后一个chunk的choices为空，带有整次调用的usage
+                usage = getattr(chunk, 'usage', None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if ttft is None:
+                        ttft = time.monotonic() - started
+                    chunks.append(delta)
+                    yield delta
+        except Exception:
+            self._record_call(started, status='error', ttft=ttft, attempts=attempts[0], stream=True)
+            raise
+        
+        response = ''.join(chunks)
+        self._settle(reserved, usage)
+        self._record_call(started, response=response, usage=usage, ttft=ttft, attempts=attempts[0], stream=True)
+        
+        if cache is not None:
+            cache.set(cache_key, response)
         
         self.response_record.append(response)
         
@@ -47,4 +321,140 @@ class BaseAgent:
         
     @property
     def token_lens(self,):
-        return len(self.encoding.encode('\n'.join(self.response_record)))
\ No newline at end of file
+        # 每条响应只编码一次，结果按顺序缓存；各条响应之间原本用换行拼接，每个换行计为一个token
+        counts = self.__dict__.setdefault('_response_token_counts', [])
+        for response in self.response_record[len(counts):]:
+            counts.append(len(self.encoding.encode(response or '')))
+        return sum(counts) + max(len(counts) - 1, 0)
+
+
+
+class AsyncBaseAgent(BaseAgent):
+    '''
+    BaseAgent的asyncio版本：generate为协程，generate_stream为异步生成器，底层使用AsyncOpenAI
+    '''
+    def __init__(self, base_url, api_key, model_name, sys_prompt, temperature, top_p):
+        self.model_name = model_name
+        self.temperature = temperature
+        self.top_p = top_p
+        self.sys_prompt = sys_prompt
+
+        # 异步客户端与事件循环绑定，在调用时通过async_api按当前事件循环获取
+        self.base_url = base_url
+        self.api_key = api_key
+        
+        self.messages = []
+        self.response_record = []
+        
+        
+    @property
+    def async_api(self):
+        return get_async_client(self.base_url, self.api_key)
+        
+        
+    async def _create(self, **kwargs):
+        '''
+        BaseAgent._create的异步版本，等待限流和退避时不阻塞事件循环
+        '''
+        reserved = rate_limit.estimate_tokens(self.messages)
+        for attempt in range(rate_limit.MAX_RETRIES + 1):
+            delay = self.rate_limiter.reserve(reserved)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._record_wait(delay)
+            try:
+                return await self.async_api.chat.completions.create(
+                    model=self.model_name,
+                    messages=self.messages,
+                    temperature=self.temperature,
+                    top_p=self.top_p,
+                    **kwargs,
+                    ), reserved
+            except Exception as e:
+                if attempt >= rate_limit.MAX_RETRIES or not rate_limit.is_retryable(e):
+                    self.rate_limiter.settle(reserved, 0)
+                    raise
+                await asyncio.sleep(self._before_retry(e, attempt, reserved))
+        
+        
+    async def generate(self, prompt):
+        self._add_prompt(prompt)
+        started = time.monotonic()
+        
+        cache = get_response_cache()
+        if cache is not None:
+            cache_key = self._cache_key(cache)
+            response = cache.get(cache_key)
+            if response is not None:
+                self.response_record.append(response)
+                self._record_call(started, status='cache_hit')
+                return response
+        
+        with telemetry.count_attempts() as attempts:
+            try:
+                completion, reserved = await self._create()
+            except Exception:
+                self._record_call(started, status='error', attempts=attempts[0])
+                raise
+        
+        response = completion.choices[0].message.content
+        self._settle(reserved, completion.usage)
+        self._record_call(started, response=response, usage=completion.usage, attempts=attempts[0])
+        
+        if cache is not None and response is not None:
+            cache.set(cache_key, response)
+        
+        self.response_record.append(response)
+        
+        return response
+    
+    
+    async def generate_stream(self, prompt):
+        '''
+        逐段yield模型输出的文本增量，结束后完整响应记录在response_record[-1]中
+        '''
+        self._add_prompt(prompt)
+        started = time.monotonic()
+        
+        cache = get_response_cache()
+        if cache is not None:
+            cache_key = self._cache_key(cache)
+            response = cache.get(cache_key)
+            if response is not None:
+                self.response_record.append(response)
+                self._record_call(started, status='cache_hit', stream=True)
+                yield response
+                return
+        
+        with telemetry.count_attempts() as attempts:
+            try:
+                stream, reserved = await self._create(stream=True, stream_options={'include_usage': True})
+            except Exception:
+                self._record_call(started, status='error', attempts=attempts[0], stream=True)
+                raise
+        
+        chunks = []
+        usage = ttft = None
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, 'usage', None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if ttft is None:
+                        ttft = time.monotonic() - started
+                    chunks.append(delta)
+                    yield delta
+        except Exception:
+            self._record_call(started, status='error', ttft=ttft, attempts=attempts[0], stream=True)
+            raise
+        
+        response = ''.join(chunks)
+        self._settle(reserved, usage)
+        self._record_call(started, response=response, usage=usage, ttft=ttft, attempts=attempts[0], stream=True)
+        
+        if cache is not None:
+            cache.set(cache_key, response)
+        
+        self.response_record.append(response)
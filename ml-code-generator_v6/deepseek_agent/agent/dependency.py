@@ -0,0 +1,105 @@
+"""
+规划步骤之间的依赖分析
+
+根据步骤描述中的关键词把每个步骤归入机器学习流程中的一个阶段（导入、读取数据、预处理、划分数据集、
+定义模型、训练、评估、预测、可视化），再按阶段之间的先后关系确定每个步骤依赖哪些之前的步骤。
+没有依赖关系的步骤可以并发生成。无法归类的步骤视为屏障：它依赖之前的所有步骤，之后的步骤也都依赖它。
+"""
+import re
+
+
+SETUP = 'setup'
+LOAD = 'load'
+PREPROCESS = 'preprocess'
+SPLIT = 'split'
+MODEL = 'model'
+TRAIN = 'train'
+EVALUATE = 'evaluate'
+PREDICT = 'predict'
+VISUALIZE = 'visualize'
+UNKNOWN = 'unknown'
+
+# 按优先级排列：一个步骤同时命中多个阶段时取最靠前的（依赖更多的）阶段
+STAGE_PATTERNS = [
+    (PREDICT, r'predict|inference|submission|save|export'),
+    (VISUALIZE, r'plot|visuali[sz]|chart|figure'),
+    (EVALUATE, r'evaluat|metric|score|accuracy|confusion|classification report'),
+    (SPLIT, r'split|train[- ]test|hold[- ]?out'),
+    (TRAIN, r'train|fit|tun(e|ing)|grid ?search|cross[- ]?validat'),
+    (MODEL, r'(defin|initiali[sz]|instantiat|build|construct|creat|set ?up|configur).*(model|classifier|regressor|estimator|pipeline|network)|hyper[- ]?param'),
+    (PREPROCESS, r'preprocess|clean|missing|imput|encod|normali[sz]|standardi[sz]|scal|feature|transform|outlier|drop'),
+    (LOAD, r'load|read|dataset|csv'),
+    (SETUP, r'import|librar|packag|random seed'),
+]
+
+# 每个阶段依赖这些阶段中各自最近的那个步骤（同阶段的步骤依次串联）
+STAGE_DEPENDENCIES = {
+    SETUP: [SETUP],
+    LOAD: [SETUP, LOAD],
+    PREPROCESS: [SETUP, LOAD, PREPROCESS],
+    SPLIT: [SETUP, LOAD, PREPROCESS, SPLIT],
+    # 模型的输入维度、类别数等通常取自处理后的数据，定义模型时需要看到之前的数据代码
+    MODEL: [SETUP, LOAD, PREPROCESS, SPLIT, MODEL],
+    TRAIN: [SETUP, LOAD, PREPROCESS, SPLIT, MODEL, TRAIN],
+    EVALUATE: [SETUP, LOAD, PREPROCESS, SPLIT, MODEL, TRAIN],
+    PREDICT: [SETUP, LOAD, PREPROCESS, SPLIT, MODEL, TRAIN],
+    VISUALIZE: [SETUP, LOAD, PREPROCESS, SPLIT, MODEL, TRAIN, EVALUATE],
+}
+
+
+def classify_step(step):
+    '''
+    返回步骤描述所属的阶段，无法归类时返回UNKNOWN
+    '''
+    # 只看步骤的第一行（标题），后面的细节描述中经常顺带提到其他阶段
+    title = step.strip().split('\n')[0].lower()
+    for stage, pattern in STAGE_PATTERNS:
+        if re.search(pattern, title):
+            return stage
+    return UNKNOWN
+
+
+def analyze_step_dependencies(plans):
+    '''
+    分析规划步骤之间的依赖关系
+
+    Params:
+        plans: PlannerAgent.plan返回的步骤列表
+
+    Returns:
+        dependencies: 与plans等长的列表，第i项为第i+1步直接依赖的步骤编号（从1开始）
+    '''
+    stages = [classify_step(step) for step in plans]
+    latest = {}
+    barrier = None
+    dependencies = []
+
+    for index, stage in enumerate(stages):
+        step_id = index + 1
+        if stage == UNKNOWN:
+            deps = set(range(1, step_id))
+        else:
+            deps = {latest[s] for s in STAGE_DEPENDENCIES[stage] if s in latest}
+            if barrier is not None:
+                deps.add(barrier)
+
+        dependencies.append(sorted(deps))
+        latest[stage] = step_id
+        if stage == UNKNOWN:
+            barrier = step_id
+
+    return dependencies
+
+
+def dependency_closure(dependencies, step_id):
+    '''
+    step_id直接和间接依赖的所有步骤编号（升序）
+    '''
+    closure = set()
+    stack = list(dependencies[step_id - 1])
+    while stack:
+        dep = stack.pop()
+        if dep not in closure:
+            closure.add(dep)
+            stack.extend(dependencies[dep - 1])
+    return sorted(closure)
@@ -0,0 +1,297 @@
+"""
+基于规则的评估指标识别
+
+MetricsAnalyzerAgent的快速路径：用Metrics_Prompt_Template中列出的指标别名（中英文）构造一个按字符前缀合并的正则
+（正则前缀树，模块加载时编译一次），一次扫描找出任务描述中提到的所有指标，再解析指标前后的目标值
+（如“准确率达到95%以上”、“MSE小于0.1”、“accuracy of at least 0.9”），根据指标和关键词判断任务类型。
+
+常见的任务描述在本地几十微秒内得到结果；没有识别到指标、任务类型不明确或提到了别名表之外的指标时置信度较低，
+由MetricsAnalyzerAgent退回到模型分析。
+"""
+import os
+import re
+
+
+METRICS_RULE_MIN_CONFIDENCE = float(os.getenv('METRICS_RULE_MIN_CONFIDENCE', '0.75'))
+
+CLASSIFICATION = 'classification'
+REGRESSION = 'regression'
+
+# (类型, 名称, 描述, 指标所属的任务类型, 别名)
+METRICS = (
+    ('accuracy', 'Accuracy', '预测正确的样本占全部样本的比例', CLASSIFICATION,
+     ('准确率', '正确率', 'Accuracy')),
+    ('precision', 'Precision', '预测为正类的样本中真正为正类的比例', CLASSIFICATION,
+     ('精确率', '查准率', 'Precision')),
+    ('recall', 'Recall', '真正为正类的样本中被预测为正类的比例', CLASSIFICATION,
+     ('召回率', '查全率', 'Recall')),
+    ('f1', 'F1-score', '精确率和召回率的调和平均', CLASSIFICATION,
+     ('F1分数', 'F1值', 'F1-score', 'F1 Score', 'F1-measure', 'F1')),
+    ('auc', 'AUC-ROC', 'ROC曲线下的面积，衡量模型区分正负类的能力', CLASSIFICATION,
+     ('AUC-ROC', 'ROC-AUC', 'AUC', 'ROC曲线下面积', 'Area Under Curve', 'Area Under the ROC Curve')),
+    ('roc', 'ROC', '不同阈值下真正率与假正率的关系曲线', CLASSIFICATION,
+     ('ROC曲线', 'ROC', 'ROC Curve')),
+    ('auprc', 'AUC-PR', 'PR曲线下的面积，适合正负类不平衡的数据', CLASSIFICATION,
+     ('AUPRC', 'AUC-PR', 'PR-AUC', 'PR曲线', 'Precision-Recall Curve')),
+    ('sensitivity', 'Sensitivity', '真正率，真正为正类的样本中被正确识别的比例', CLASSIFICATION,
+     ('灵敏度', '敏感度', 'Sensitivity', 'True Positive Rate', 'TPR')),
+    ('specificity', 'Specificity', '真负率，真正为负类的样本中被正确识别的比例', CLASSIFICATION,
+     ('特异性', '特异度', 'Specificity', 'True Negative Rate', 'TNR')),
+    ('confusion_matrix', 'Confusion Matrix', '各类别预测结果与真实类别的计数矩阵', CLASSIFICATION,
+     ('混淆矩阵', 'Confusion Matrix')),
+    ('kappa', "Cohen's Kappa", '扣除随机一致后的分类一致性', CLASSIFICATION,
+     ("Cohen's Kappa", 'Cohen Kappa', 'Kappa系数', 'Kappa')),
+    ('logloss', 'LogLoss', '预测概率与真实标签之间的对数损失', CLASSIFICATION,
+     ('LogLoss', 'Log Loss', '对数损失', 'Logarithmic Loss')),
+    ('mse', 'MSE', '预测值与真实值之差的平方的平均', REGRESSION,
+     ('MSE', '均方误差', 'Mean Squared Error', 'Mean Square Error')),
+    ('rmse', 'RMSE', '均方误差的平方根，与目标变量的单位相同', REGRESSION,
+     ('RMSE', '均方根误差', 'Root Mean Squared Error', 'Root Mean Square Error')),
+    ('mae', 'MAE', '预测值与真实值之差的绝对值的平均', REGRESSION,
+     ('MAE', '平均绝对误差', 'Mean Absolute Error')),
+    ('r2', 'R²', '模型解释的目标变量方差的比例', REGRESSION,
+     ('R2', 'R²', 'R^2', 'R方', 'R-squared', '决定系数', '判定系数', 'Determination Coefficient',
+      'Coefficient of Determination')),
+    ('mape', 'MAPE', '相对误差的绝对值的平均', REGRESSION,
+     ('MAPE', '平均绝对百分比误差', 'Mean Absolute Percentage Error')),
+    ('mcc', 'MCC', '综合考虑混淆矩阵四个值的相关系数，适合不平衡数据', CLASSIFICATION,
+     ('MCC', '马修斯相关系数', 'Matthews相关系数', 'Matthews Correlation Coefficient')),
+    ('hamming_loss', 'Hamming Loss', '被错误预测的标签所占的比例', CLASSIFICATION,
+     ('Hamming Loss', '汉明损失')),
+    ('balanced_accuracy', 'Balanced Accuracy', '各类别召回率的平均', CLASSIFICATION,
+     ('Balanced Accuracy', '平衡准确率')),
+    ('g_mean', 'G-mean', '灵敏度和特异性的几何平均', CLASSIFICATION,
+     ('G-mean', 'G均值', 'Geometric Mean')),
+    ('f_beta', 'F-beta', '按beta加权的精确率和召回率的调和平均', CLASSIFICATION,
+     ('F-beta', 'Fβ', 'F0.5', 'F2')),
+)
+
+# Recall@K、Precision@K、Top-K准确率等，K可以是具体的数字
+TOP_K_PATTERN = (r'(?<![a-z0-9])(?:recall|precision|hit[\s_-]?rate|ndcg|map)@(?:\d+|k)(?![a-z0-9])'
+                 r'|(?<![a-z0-9])top[\s_-]?(?:\d+|k)[\s_-]?(?:准确率|accuracy)')
+
+# 别名表中没有、需要模型理解的指标或任务
+UNKNOWN_METRICS = re.compile(
+    r'(?<![a-z0-9])(?:bleu|rouge|meteor|perplexity|wer|cer|iou|miou|dice|map|ndcg|mrr|silhouette|spearman|pearson'
+    r'|rmsle|msle|smape|gini|ks|lift|brier|huber|calinski|davies|cluster(?:ing)?|recommend\w*)(?![a-z0-9])'
+    r'|轮廓系数|困惑度|交并比|基尼系数|皮尔逊|斯皮尔曼|聚类|推荐',
+    re.I)
+
+TASK_KEYWORDS = (
+    (CLASSIFICATION, re.compile(r'分类|识别|检测|classif|detect', re.I)),
+    (REGRESSION, re.compile(r'回归|regress', re.I)),
+)
+BINARY = re.compile(r'二分类|二元分类|binary', re.I)
+MULTICLASS = re.compile(r'多分类|多类别|multi[\s-]?class', re.I)
+MULTILABEL = re.compile(r'多标签|multi[\s-]?label', re.I)
+
+TARGET_VARIABLE = re.compile(
+    r'(?:目标变量|目标列|标签列|预测目标)\s*(?:为|是|[:：])?\s*[`"\'“「]?(?P<zh>[A-Za-z_][A-Za-z0-9_.]*|[一-鿿]{1,10})'
+    r'|(?:target variable|target column|label column)\s*(?:is|=|:)?\s*[`"\']?(?P<en>[A-Za-z_][A-Za-z0-9_.]*)',
+    re.I)
+
+_SEPARATORS = ' -_'
+_SEPARATOR = r'[\s_-]?'
+_NUMBER = r'(?P<num>\d+(?:\.\d+)?)\s*(?P<pct>%|％|个百分点)?'
+_OPERATORS = (
+    ('>=', ('不低于', '不少于', '不小于', '达到', '至少', '>=', '≥', 'at least', 'no less than', 'reach', 'reaches')),
+    ('>', ('高于', '大于', '超过', '优于', '>', 'above', 'greater than', 'more than', 'higher than', 'exceed',
+           'exceeds')),
+    ('<=', ('不超过', '不高于', '不大于', '控制在', '<=', '≤', 'at most', 'no more than', 'no greater than')),
+    ('<', ('小于', '低于', '少于', '<', 'below', 'less than', 'lower than', 'under')),
+    ('=', ('等于', '为', '是', '=', ':', '：', 'of', 'equal to', 'around', 'about', '约')),
+)
+_SUFFIXES = {'以上': '>=', '及以上': '>=', '或以上': '>=', '或更高': '>=', '以下': '<=', '及以下': '<=', '或以下': '<=',
+             '以内': '<=', '或更低': '<=', 'or higher': '>=', 'or above': '>=', 'or more': '>=', 'or lower': '<=',
+             'or below': '<=', 'or less': '<='}
+_OPERATOR_OF = {word.lower(): op for op, words in _OPERATORS for word in words}
+_operator_alternation = '|'.join(re.escape(word) for word in sorted(_OPERATOR_OF, key=len, reverse=True))
+_suffix_alternation = '|'.join(re.escape(word) for word in sorted(_SUFFIXES, key=len, reverse=True))
+
+# 指标之后：“达到95%以上”、“小于0.1”、“ of at least 0.9”
+TARGET_AFTER = re.compile(
+    rf'^\s*(?:的)?(?:目标|要求|需要|需|应|须|必须|最好)?(?:值)?\s*(?:应|要)?\s*'
+    rf'(?:(?:score|value)\s+)?(?:(?:of|is|should be|must be|needs to be|to be)\s+)?'
+    rf'(?P<op>{_operator_alternation})?\s*(?:to\s+)?{_NUMBER}\s*(?P<suffix>{_suffix_alternation})?',
+    re.I)
+# 指标之前：“达到95%以上的准确率”、“at least 0.9 accuracy”
+TARGET_BEFORE = re.compile(
+    rf'(?P<op>{_operator_alternation})?\s*{_NUMBER}\s*(?P<suffix>{_suffix_alternation})?\s*(?:的)?\s*$',
+    re.I)
+# 目标值只在同一分句内查找
+TARGET_WINDOW = 24
+_CLAUSE_BREAK = re.compile(r'[，。；;,\n、]|\band\b|和|及')
+
+
+def _atoms(alias):
+    return [_SEPARATOR if char in _SEPARATORS else re.escape(char.lower()) for char in alias]
+
+
+def _is_word_char(char):
+    return char.isascii() and char.isalnum()
+
+
+def _trie_pattern(aliases):
+    '''
+    把别名合并成前缀树形式的正则：共同前缀只匹配一次；同一位置优先匹配更长的别名
+    '''
+    trie = {}
+    for alias in aliases:
+        node = trie
+        for atom in _atoms(alias):
+            node = node.setdefault(atom, {})
+        # 以字母数字结尾的别名后面不能紧跟字母数字（MSE不匹配RMSE的后半部分，F1不匹配F10）
+        node[''] = _is_word_char(alias[-1])
+
+    def render(node):
+        branches = [atom + render(child) for atom, child in node.items() if atom != '']
+        if '' in node:
+            branches.append(r'(?![a-z0-9])' if node[''] else '')
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+
+    # 以字母数字开头的别名前面不能紧跟字母数字
+    branches = []
+    for atom, child in trie.items():
+        first = atom.replace('\\', '')[:1]
+        prefix = r'(?<![a-z0-9])' if _is_word_char(first) else ''
+        branches.append(prefix + atom + render(child))
+    return '|'.join(branches)
+
+
+def _normalize(alias):
+    return ''.join(char for char in alias.lower() if char not in _SEPARATORS and not char.isspace())
+
+
+_ALIASES = {}
+for _type, _name, _description, _family, _aliases in METRICS:
+    for _alias in _aliases:
+        _ALIASES[_normalize(_alias)] = _type
+_METRIC_INFO = {metric[0]: metric for metric in METRICS}
+
+METRIC_PATTERN = re.compile(
+    rf'(?P<top_k>{TOP_K_PATTERN})|(?P<alias>{_trie_pattern([alias for metric in METRICS for alias in metric[4]])})',
+    re.I)
+
+
+def extract_metrics(task_description):
+    '''
+    从任务描述中识别评估指标
+
+    Returns:
+        (metrics_data, confidence): metrics_data与MetricsAnalyzerAgent.analyze_metrics返回的格式相同，
+            confidence为0~1之间的置信度，低于METRICS_RULE_MIN_CONFIDENCE时应交给模型分析
+    '''
+    text = task_description or ''
+    metrics = {}
+    for match in METRIC_PATTERN.finditer(text):
+        if match.group('top_k'):
+            metric_type, key = 'top_k', match.group('top_k').lower()
+            name = match.group('top_k')
+        else:
+            metric_type = key = _ALIASES.get(_normalize(match.group('alias')))
+            if metric_type is None:
+                continue
+            name = _METRIC_INFO[metric_type][1]
+
+        metric = metrics.get(key)
+        if metric is None:
+            metric = metrics[key] = {
+                'name': name,
+                'type': metric_type,
+                'description': _METRIC_INFO[metric_type][2] if metric_type in _METRIC_INFO else '前K个结果中的命中情况',
+                'target_value': None,
+                'priority': 'medium',
+            }
+        if metric['target_value'] is None:
+            target = _parse_target(text, match.start(), match.end())
+            if target is not None:
+                metric['target_value'], metric['target'] = target
+
+    metrics = list(metrics.values())
+    if not metrics:
+        return _result([], 'unknown', text), 0.0
+
+    # 有目标值的指标最重要；都没有目标值时第一个提到的指标最重要
+    targeted = [metric for metric in metrics if metric['target_value'] is not None]
+    for metric in targeted or metrics[:1]:
+        metric['priority'] = 'high'
+    for metric in metrics:
+        if metric['type'] == 'confusion_matrix' and metric['priority'] != 'high':
+            metric['priority'] = 'low'
+
+    task_type, confidence = _task_type(text, metrics)
+    if UNKNOWN_METRICS.search(text):
+        confidence -= 0.5
+    return _result(metrics, task_type, text), max(confidence, 0.0)
+
+
+def _parse_target(text, start, end):
+    '''
+    解析指标前后同一分句中的目标值
+
+    Returns:
+        (target_value, target): target_value为原文中的目标值描述，target为 {"op", "value"}（百分数已换算为小数）；
+            没有目标值时为None
+    '''
+    after = text[end:end + TARGET_WINDOW]
+    clause_end = _CLAUSE_BREAK.search(after)
+    after = after[:clause_end.start()] if clause_end else after
+    match = TARGET_AFTER.match(after)
+
+    if not _has_target(match):
+        before = text[max(start - TARGET_WINDOW, 0):start]
+        breaks = list(_CLAUSE_BREAK.finditer(before))
+        before = before[breaks[-1].end():] if breaks else before
+        match = TARGET_BEFORE.search(before)
+        if not _has_target(match):
+            return None
+
+    suffix = (match.group('suffix') or '').lower()
+    op = _SUFFIXES[suffix] if suffix else _OPERATOR_OF[match.group('op').lower()]
+    value = float(match.group('num'))
+    if match.group('pct'):
+        value = value / 100
+    return match.group(0).strip().rstrip('的').strip(), {'op': op, 'value': round(value, 10)}
+
+
+def _has_target(match):
+    # 只有数字时不是目标值（如“F1 2分类”），需要比较词或“以上/以下”
+    return match is not None and (match.group('op') or match.group('suffix'))
+
+
+def _task_type(text, metrics):
+    families = {_METRIC_INFO[metric['type']][3] for metric in metrics if metric['type'] in _METRIC_INFO}
+    keywords = {task_type for task_type, pattern in TASK_KEYWORDS if pattern.search(text)}
+
+    if len(keywords) == 1:
+        task_type = next(iter(keywords))
+        # 关键词与指标矛盾（如分类任务只提到MSE）
+        return task_type, 1.0 if not families or task_type in families else 0.5
+    if len(families) == 1:
+        return next(iter(families)), 0.9 if not keywords else 1.0
+    if len(keywords & families) == 1:
+        return next(iter(keywords & families)), 0.8
+    return 'unknown', 0.4
+
+
+def _result(metrics, task_type, text):
+    match = TARGET_VARIABLE.search(text)
+    target_variable = (match.group('zh') or match.group('en')) if match else 'unknown'
+    if task_type != CLASSIFICATION:
+        problem_type = task_type
+    elif MULTILABEL.search(text):
+        problem_type = 'multilabel_classification'
+    elif MULTICLASS.search(text):
+        problem_type = 'multiclass_classification'
+    elif BINARY.search(text):
+        problem_type = 'binary_classification'
+    else:
+        problem_type = CLASSIFICATION
+    return {
+        'metrics': metrics,
+        'task_type': task_type,
+        'dataset_info': {
+            'target_variable': target_variable,
+            'problem_type': problem_type,
+        },
+    }
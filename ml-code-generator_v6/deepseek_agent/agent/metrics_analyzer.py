@@ -1,10 +1,16 @@
-from .deepseek_api import BaseAgent
+from .deepseek_api import BaseAgent, AsyncBaseAgent
+from .metric_rules import extract_metrics, METRICS_RULE_MIN_CONFIDENCE
+from .. import telemetry
 import re
 import json
+import os
 
-Metrics_Prompt_Template = '''
-你是一个机器学习评估指标分析专家。请从给定的任务描述中识别和提取所有相关的评估指标。
+# 批量分析：一次请求最多打包的任务数、单个任务不超过多少字符才参与打包、一次请求的任务描述总字符数上限
+METRICS_BATCH_SIZE = int(os.getenv('METRICS_BATCH_SIZE', '8'))
+METRICS_BATCH_SHORT_CHARS = int(os.getenv('METRICS_BATCH_SHORT_CHARS', '1000'))
+METRICS_BATCH_MAX_CHARS = int(os.getenv('METRICS_BATCH_MAX_CHARS', '4000'))
 
+Metrics_Aliases = '''
 常见指标范式及别名（中英文均可识别）：
 - 准确率/Accuracy
 - 精确率/Precision
@@ -30,6 +36,12 @@ Metrics_Prompt_Template = '''
 - Balanced Accuracy/平衡准确率
 - G-mean/G均值
 - F-beta/F0.5/F2等
+'''.strip()
+
+Metrics_Prompt_Template = ('''
+你是一个机器学习评估指标分析专家。请从给定的任务描述中识别和提取所有相关的评估指标。
+
+''' + Metrics_Aliases + '''
 
 任务描述：
 {}
@@ -54,35 +66,156 @@ Metrics_Prompt_Template = '''
 }}
 
 只返回JSON格式，不要其他内容。
+''').strip()
+
+Batch_Metrics_Prompt_Template = ('''
+你是一个机器学习评估指标分析专家。下面有{count}个相互独立的任务描述，请分别从每个任务描述中识别和提取所有相关的评估指标。
+
+''' + Metrics_Aliases + '''
+
+{tasks}
+
+请分别分析上述每个任务描述，识别其中提到的所有评估指标，每个任务在results中返回一项，index为任务编号，按照以下格式返回JSON：
+
+{{
+  "results": [
+    {{
+      "index": 任务编号,
+      "metrics": [
+        {{
+          "name": "指标名称",
+          "type": "指标类型", // accuracy, precision, recall, f1, auc, mse, mae, r2, etc.
+          "description": "指标描述",
+          "target_value": "目标值或要求", // 如果有的话
+          "priority": "high/medium/low" // 重要性
+        }}
+      ],
+      "task_type": "任务类型", // classification, regression, clustering, etc.
+      "dataset_info": {{
+        "target_variable": "目标变量名",
+        "problem_type": "问题类型"
+      }}
+    }}
+  ]
+}}
+
+只返回JSON格式，不要其他内容。
+''').strip()
+
+Batch_Task_Template = '''
+任务 {index}：
+{task}
 '''.strip()
 
+
+def pack_task_descriptions(task_descriptions, batch_size=METRICS_BATCH_SIZE,
+                           short_chars=METRICS_BATCH_SHORT_CHARS, max_chars=METRICS_BATCH_MAX_CHARS):
+    '''
+    把任务描述分组，每组用一次请求分析：较短的描述按顺序打包，较长的描述单独一组
+
+    Params:
+        task_descriptions: 任务描述列表
+        batch_size: 每组最多的任务数
+        short_chars: 不超过这么多字符的描述才参与打包
+        max_chars: 每组描述的总字符数上限
+
+    Returns:
+        packs: 分组列表，每组是任务描述在task_descriptions中的下标列表
+    '''
+    packs = []
+    current, current_chars = [], 0
+    for i, task in enumerate(task_descriptions):
+        if len(task) > short_chars or batch_size <= 1:
+            packs.append([i])
+            continue
+        if current and (len(current) >= batch_size or current_chars + len(task) > max_chars):
+            packs.append(current)
+            current, current_chars = [], 0
+        current.append(i)
+        current_chars += len(task)
+    if current:
+        packs.append(current)
+    return packs
+
+
 class MetricsAnalyzerAgent(BaseAgent):
     def __init__(self, url, key, model_name, temperature=0.1, top_p=0.9):
         sys_prompt = '你是一个专业的机器学习评估指标分析专家，擅长从自然语言描述中准确识别和提取评估指标。'
         super().__init__(url, key, model_name, sys_prompt, temperature, top_p)
     
-    def analyze_metrics(self, task_description):
+    def analyze_metrics(self, task_description, rules=True, strict=False):
         """
-        从任务描述中分析评估指标
+        从任务描述中分析评估指标：先用别名规则识别（见metric_rules.py），置信度足够时不调用模型
         
         Args:
             task_description: 包含任务描述、评估方法等的完整文本
+            rules: 为False时跳过规则识别（调用方已经识别过）
+            strict: 为True时模型响应无法解析则抛出ValueError，而不是返回默认指标
             
         Returns:
             dict: 包含识别到的指标信息
         """
+        metrics_data = self.analyze_by_rules(task_description) if rules else None
+        if metrics_data is not None:
+            return metrics_data
+
         prompt = Metrics_Prompt_Template.format(task_description)
         response = self.generate(prompt)
         
+        return self._parse_metrics(response, strict)
+    
+    def analyze_metrics_batch(self, task_descriptions):
+        """
+        用一次模型请求分析多个任务描述（不经过规则识别）
+        
+        Args:
+            task_descriptions: 任务描述列表
+            
+        Returns:
+            list: 与task_descriptions一一对应的指标信息，模型没有返回某个任务的结果时该项为None
+        """
+        response = self.generate(self._batch_prompt(task_descriptions))
+        return self._parse_batch_metrics(response, len(task_descriptions))
+    
+    def analyze_by_rules(self, task_description):
+        """规则识别的置信度不低于METRICS_RULE_MIN_CONFIDENCE时返回结果，否则返回None"""
+        metrics_data, confidence = extract_metrics(task_description)
+        source = 'rules' if confidence >= METRICS_RULE_MIN_CONFIDENCE else 'llm'
+        telemetry.registry.inc('deepseek_metrics_analysis_total', help='Metric analyses by source', source=source)
+        return metrics_data if source == 'rules' else None
+    
+    def _parse_metrics(self, response, strict=False):
+        """解析模型返回的指标JSON，失败时返回默认指标；strict为True时抛出ValueError"""
         try:
             # 尝试解析JSON响应
             metrics_data = self.__extract_json(response)
             return metrics_data
         except Exception as e:
+            if strict:
+                raise ValueError(f"Error parsing metrics response: {e}") from e
             print(f"Error parsing metrics response: {e}")
             # 返回默认指标
             return self.__get_default_metrics()
     
+    def _batch_prompt(self, task_descriptions):
+        tasks = '\n\n'.join(Batch_Task_Template.format(index=i, task=task)
+                             for i, task in enumerate(task_descriptions))
+        return Batch_Metrics_Prompt_Template.format(count=len(task_descriptions), tasks=tasks)
+    
+    def _parse_batch_metrics(self, response, count):
+        """解析批量请求返回的JSON，按index放回对应位置；整个响应无法解析时抛出异常"""
+        batch_data = self.__extract_json(response)
+        results = [None] * count
+        for item in batch_data.get('results', []) if isinstance(batch_data, dict) else []:
+            if not isinstance(item, dict):
+                continue
+            index = item.pop('index', None)
+            if isinstance(index, str) and index.strip().isdigit():
+                index = int(index)
+            if isinstance(index, int) and 0 <= index < count and results[index] is None and 'metrics' in item:
+                results[index] = item
+        return results
+    
     def __extract_json(self, response):
         """从响应中提取JSON"""
         # 查找JSON块
@@ -102,4 +235,22 @@ class MetricsAnalyzerAgent(BaseAgent):
                 "target_variable": "unknown",
                 "problem_type": "unknown"
             }
-        } 
\ No newline at end of file
+        }
+
+
+class AsyncMetricsAnalyzerAgent(MetricsAnalyzerAgent, AsyncBaseAgent):
+    """MetricsAnalyzerAgent的异步版本"""
+    
+    async def analyze_metrics(self, task_description, rules=True, strict=False):
+        metrics_data = self.analyze_by_rules(task_description) if rules else None
+        if metrics_data is not None:
+            return metrics_data
+
+        prompt = Metrics_Prompt_Template.format(task_description)
+        response = await self.generate(prompt)
+        
+        return self._parse_metrics(response, strict)
+    
+    async def analyze_metrics_batch(self, task_descriptions):
+        response = await self.generate(self._batch_prompt(task_descriptions))
+        return self._parse_batch_metrics(response, len(task_descriptions))
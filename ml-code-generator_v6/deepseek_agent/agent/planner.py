@@ -1,4 +1,4 @@
-from .deepseek_api import BaseAgent
+from .deepseek_api import BaseAgent, AsyncBaseAgent
 import re
 
 Prompt_Template = '''
@@ -22,9 +22,22 @@ class PlannerAgent(BaseAgent):
         super().__init__(url, key, model_name, sys_prompt, temperature, top_p)
             
         
-    def plan(self, task):
-        prompt = Prompt_Template.format(task)
+    def plan(self, task, schema=None):
+        prompt = self._build_prompt(task, schema)
         response = self.generate(prompt)
+        plans = self._parse_plans(response)
+        
+        return plans, response
+    
+    
+    def _build_prompt(self, task, schema=None):
+        # schema为数据集结构摘要（见schema.py），附在任务描述之后
+        if schema:
+            task = task + '\n\n' + schema
+        return Prompt_Template.format(task)
+    
+    
+    def _parse_plans(self, response):
         plans = self.__extract_subtasks(response)
         
         if 'comment' in plans[-1].lower() or 'document' in plans[-1].lower() or 'optional' in plans[-1].lower():
@@ -32,7 +45,7 @@ class PlannerAgent(BaseAgent):
             
         self.plan_count = len(plans)
         
-        return plans, response
+        return plans
     
     
     def __extract_subtasks(self, text):
@@ -41,4 +54,15 @@ class PlannerAgent(BaseAgent):
         formatted_results = [match.strip() for match in matches]
         
         return formatted_results
-    
+
+
+class AsyncPlannerAgent(PlannerAgent, AsyncBaseAgent):
+    '''
+    PlannerAgent的异步版本
+    '''
+    async def plan(self, task, schema=None):
+        prompt = self._build_prompt(task, schema)
+        response = await self.generate(prompt)
+        plans = self._parse_plans(response)
+        
+        return plans, response
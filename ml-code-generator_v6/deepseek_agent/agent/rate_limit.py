@@ -0,0 +1,195 @@
+"""
+限流与重试
+
+同一个 (base_url, model) 的所有agent共享一个限流器，按每分钟请求数和每分钟token数两个令牌桶限流。
+限流器采用预约方式：调用前先从桶中扣除本次的额度（可以扣成负数），返回需要等待的时间后再发请求，
+先预约的请求先轮到，多个会话在配额内按到达顺序排队，而不是同时发出请求后一起被429拒绝。
+请求结束后再按接口返回的实际token数修正预约的额度。
+
+请求遇到429、5xx或连接错误时按带抖动的指数退避重试，响应中有Retry-After时按它等待，
+并让同一限流器上的其他请求也暂停到这个时间点。
+
+限流器只在进程内共享。多个进程使用同一份服务端配额时（如Node的Python工作进程池），
+由DEEPSEEK_RATE_LIMIT_SHARES指定进程数，每个进程只使用配额的 1/SHARES。
+"""
+import email.utils
+import os
+import random
+import threading
+import time
+
+import openai
+
+
+RATE_LIMIT_RPM = float(os.getenv('DEEPSEEK_RATE_LIMIT_RPM', '0'))
+RATE_LIMIT_TPM = float(os.getenv('DEEPSEEK_RATE_LIMIT_TPM', '0'))
+# 共享上面这份配额的进程数，工作进程池启动时设为池的大小
+RATE_LIMIT_SHARES = max(1, int(os.getenv('DEEPSEEK_RATE_LIMIT_SHARES', '1')))
+
+MAX_RETRIES = int(os.getenv('DEEPSEEK_MAX_RETRIES', '5'))
+RETRY_BASE_DELAY = float(os.getenv('DEEPSEEK_RETRY_BASE_DELAY', '1'))
+RETRY_MAX_DELAY = float(os.getenv('DEEPSEEK_RETRY_MAX_DELAY', '60'))
+
+RETRYABLE_STATUS = (408, 409, 429)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class _Bucket:
+    '''
+    令牌桶：容量为一分钟的额度，按per_minute / 60的速度匀速补充
+    '''
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # 单次超过整桶容量的请求按整桶计算，否则永远等不到
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount):
+        self.level = min(self.capacity, self.level - amount)
+
+
+class RateLimiter:
+    '''
+    按每分钟请求数和每分钟token数限流，值为0时表示不限制
+
+    Params:
+        requests_per_minute: 每分钟请求数
+        tokens_per_minute: 每分钟token数（prompt + completion）
+    '''
+
+    def __init__(self, requests_per_minute=RATE_LIMIT_RPM, tokens_per_minute=RATE_LIMIT_TPM):
+        self._lock = threading.Lock()
+        self._requests = _Bucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._paused_until = 0.0
+
+    def reserve(self, tokens=0):
+        '''
+        预约一次请求和tokens个token的额度
+
+        Returns:
+            delay: 发请求前需要等待的秒数
+        '''
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._paused_until - now)
+            if self._requests is not None:
+                delay = max(delay, self._requests.reserve(1, now))
+            if self._tokens is not None and tokens:
+                delay = max(delay, self._tokens.reserve(tokens, now))
+            return delay
+
+    def acquire(self, tokens=0):
+        '''
+        预约并等待到可以发请求，返回等待的秒数
+        '''
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def settle(self, reserved_tokens, used_tokens):
+        '''
+        请求结束后按实际用量修正预约的token额度
+        '''
+        if self._tokens is None or used_tokens is None:
+            return
+        with self._lock:
+            self._tokens.adjust(used_tokens - reserved_tokens)
+
+    def pause(self, seconds):
+        '''
+        服务端要求等待（429 Retry-After）时，让之后预约的请求都至少等到这个时间点
+        '''
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def get_rate_limiter(base_url, model):
+    '''
+    获取 (base_url, model) 共享的限流器，不存在时按环境变量的配置创建（本进程只使用配额的 1/RATE_LIMIT_SHARES）
+    '''
+    key = (base_url, model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(RATE_LIMIT_RPM / RATE_LIMIT_SHARES,
+                                                   RATE_LIMIT_TPM / RATE_LIMIT_SHARES)
+        return limiter
+
+
+def configure_rate_limit(base_url, model, requests_per_minute=0, tokens_per_minute=0):
+    '''
+    为 (base_url, model) 设置本进程的限流额度，替换原有的限流器（额度不再按RATE_LIMIT_SHARES划分）
+    '''
+    with _limiters_lock:
+        _limiters[(base_url, model)] = RateLimiter(requests_per_minute, tokens_per_minute)
+
+
+def estimate_tokens(messages):
+    '''
+    粗略估计prompt的token数（按4个字符一个token），只用于预约额度，实际用量在请求结束后修正
+    '''
+    return sum(len(str(message.get('content') or '')) for message in messages) // 4 + 1
+
+
+def is_retryable(error):
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def retry_after(error):
+    '''
+    从错误响应的Retry-After / retry-after-ms头中取出等待秒数，没有时返回None
+    '''
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # HTTP日期格式
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def backoff_delay(attempt, error=None, base_delay=None, max_delay=None):
+    '''
+    第attempt次重试（从0开始）前等待的秒数：有Retry-After时按它等待并加少量抖动，
+    否则为 [0, min(max_delay, base_delay * 2^attempt)] 之间的随机值（full jitter）
+    '''
+    base_delay = RETRY_BASE_DELAY if base_delay is None else base_delay
+    max_delay = RETRY_MAX_DELAY if max_delay is None else max_delay
+    server_delay = retry_after(error) if error is not None else None
+    if server_delay is not None:
+        return min(server_delay, max_delay) + random.uniform(0, base_delay / 4)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
@@ -1,4 +1,4 @@
-from .deepseek_api import BaseAgent
+from .deepseek_api import BaseAgent, AsyncBaseAgent
 import re
 
 Prompt_Template = '''
@@ -30,18 +30,50 @@ class RefinerAgent(BaseAgent):
         prompt = Prompt_Template.format(task, code_draft)
         
         response = super().generate(prompt)
-        code = self.__extract_code(response)
+        code = self._extract_code(response)
                 
         return code
     
     
-    def __extract_code(self, response):
+    def refine_stream(self, 
+                      task: str,
+                      code_draft: str):
+        '''
+        refine的流式版本：逐段yield模型输出，结束后返回整合后的代码
+        '''
+        super().clean_message()
+                
+        prompt = Prompt_Template.format(task, code_draft)
+        
+        response = yield from super().generate_stream(prompt)
+        code = self._extract_code(response)
+                
+        return code
+    
+    
+    def _extract_code(self, response):
         if "```python" not in response:
             return response
         else:
             match = re.search(r'```python(.*?)```', response, re.S)
             code = match.group(1).strip()
                 
-        return code 
+        return code
+
+
+class AsyncRefinerAgent(RefinerAgent, AsyncBaseAgent):
+    '''
+    RefinerAgent的异步版本
+    '''
+    async def refine(self, 
+                     task: str,
+                     code_draft: str):
+        
+        self.clean_message()
+                
+        prompt = Prompt_Template.format(task, code_draft)
         
-        
\ No newline at end of file
+        response = await self.generate(prompt)
+        code = self._extract_code(response)
+                
+        return code
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'deepseek_agent', 'responses.sqlite')
+# 所有工作进程共用同一个SQLite文件，等待其他进程释放写锁的时间（秒）
+DEFAULT_DB_TIMEOUT = float(os.getenv('DEEPSEEK_RESPONSE_CACHE_DB_TIMEOUT', '30'))
+# 磁盘命中时访问时间只在距上次更新超过这么久（秒）时写回，避免每次读取都要获取写锁
+ACCESS_UPDATE_INTERVAL = 60
+
+
+class ResponseCache:
+    '''
+    LLM响应缓存，键为 (model, sys_prompt, messages, temperature, top_p) 的哈希
+
+    两级存储：内存中的LRU缓存 + SQLite磁盘缓存（带容量上限和过期时间）
+
+    磁盘缓存由多个进程共用（WAL模式，读不阻塞写）。缓存只是优化：SQLite出错（如等待写锁超时）时读取按未命中处理、
+    写入跳过，不影响调用方，已经付费得到的响应照常返回
+    '''
+
+    def __init__(self,
+                 path=DEFAULT_CACHE_PATH,
+                 max_memory_entries=256,
+                 max_disk_bytes=256 * 1024 * 1024,
+                 ttl=7 * 24 * 3600,
+                 timeout=DEFAULT_DB_TIMEOUT):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+            'expired': 0,
+            'disk_errors': 0,
+        }
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            ''')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            self._db.commit()
+
+
+    @staticmethod
+    def make_key(model, sys_prompt, messages, temperature, top_p):
+        payload = json.dumps({
+            'model': model,
+            'sys_prompt': sys_prompt,
+            'messages': messages,
+            'temperature': temperature,
+            'top_p': top_p,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if self._expired(created, now):
+                    del self._memory[key]
+                    self._stats['expired'] += 1
+                else:
+                    self._memory.move_to_end(key)
+                    self._stats['hits'] += 1
+                    self._stats['memory_hits'] += 1
+                    return value
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute('SELECT value, created, accessed FROM responses WHERE key = ?',
+                                           (key,)).fetchone()
+                except sqlite3.Error as e:
+                    self._disk_error('read', e)
+                    row = None
+                if row is not None:
+                    value, created, accessed = row
+                    if self._expired(created, now):
+                        self._write(self._db.execute, 'DELETE FROM responses WHERE key = ?', (key,))
+                        self._stats['expired'] += 1
+                    else:
+                        # 访问时间只影响淘汰顺序：不需要每次都写回，写回失败时照常返回命中的响应
+                        if now - accessed > ACCESS_UPDATE_INTERVAL:
+                            self._write(self._db.execute, 'UPDATE responses SET accessed = ? WHERE key = ?',
+                                        (now, key))
+                        self._remember(key, value, created)
+                        self._stats['hits'] += 1
+                        self._stats['disk_hits'] += 1
+                        return value
+
+            self._stats['misses'] += 1
+            return None
+
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+
+            if self._db is not None:
+                size = len(value.encode('utf-8'))
+                self._write(self._insert, key, value, size, now)
+
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM responses')
+                self._db.commit()
+
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            if self._db is not None:
+                try:
+                    entries, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+                    stats['disk_entries'] = entries
+                    stats['disk_bytes'] = size
+                except sqlite3.Error as e:
+                    self._disk_error('read', e)
+            return stats
+
+
+    def _insert(self, key, value, size, now):
+        self._db.execute(
+            'INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+            (key, value, size, now, now)
+        )
+        self._evict_disk()
+
+
+    def _write(self, func, *args):
+        # 执行一次磁盘写入并提交；出错时回滚并跳过
+        try:
+            func(*args)
+            self._db.commit()
+            return True
+        except sqlite3.Error as e:
+            try:
+                self._db.rollback()
+            except sqlite3.Error:
+                pass
+            self._disk_error('write', e)
+            return False
+
+
+    def _disk_error(self, operation, error):
+        self._stats['disk_errors'] += 1
+        print(f'Response cache {operation} failed, skipping disk cache: {error}')
+
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats['memory_evictions'] += 1
+
+
+    def _evict_disk(self):
+        if self.ttl is not None:
+            expired = self._db.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,)).rowcount
+            self._stats['expired'] += expired
+
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        # 按最近访问时间从旧到新淘汰，直到低于容量上限
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY accessed ASC').fetchall():
+            if total <= self.max_disk_bytes:
+                break
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+            self._stats['disk_evictions'] += 1
+
+
+_response_cache = None
+
+
+def enable_response_cache(path=DEFAULT_CACHE_PATH, **kwargs):
+    '''
+    开启全局响应缓存，之后所有BaseAgent.generate调用都会先查询缓存
+    '''
+    global _response_cache
+    _response_cache = ResponseCache(path, **kwargs)
+    return _response_cache
+
+
+def disable_response_cache():
+    global _response_cache
+    _response_cache = None
+
+
+def get_response_cache():
+    return _response_cache
+
+
+# 通过环境变量开启缓存：DEEPSEEK_RESPONSE_CACHE=1 使用默认路径，或直接指定SQLite文件路径
+_cache_setting = os.getenv('DEEPSEEK_RESPONSE_CACHE', '')
+if _cache_setting and _cache_setting.lower() not in ('0', 'false', 'no'):
+    enable_response_cache(
+        DEFAULT_CACHE_PATH if _cache_setting.lower() in ('1', 'true', 'yes') else _cache_setting,
+        max_memory_entries=int(os.getenv('DEEPSEEK_RESPONSE_CACHE_MEMORY_ENTRIES', '256')),
+        max_disk_bytes=int(os.getenv('DEEPSEEK_RESPONSE_CACHE_MAX_BYTES', str(256 * 1024 * 1024))),
+        ttl=float(os.getenv('DEEPSEEK_RESPONSE_CACHE_TTL', str(7 * 24 * 3600))),
+    )
@@ -1,4 +1,4 @@
-from .deepseek_api import BaseAgent
+from .deepseek_api import BaseAgent, AsyncBaseAgent
 import re
 
 Prompt_Template = '''
@@ -29,17 +29,45 @@ class RevisorAgent(BaseAgent):
         super().clean_message()
         prompt = Prompt_Template.format(task, code_snippet, error_reason)
         response = self.generate(prompt)
-        code = self.__extract_code(response)
+        code = self._extract_code(response)
+        
+        return code
+    
+    
+    def revise_stream(self, task, code_snippet, error_reason):
+        '''
+        revise的流式版本：逐段yield模型输出，结束后返回修改后的代码
+        '''
+        self.revised_code = []
+        
+        super().clean_message()
+        prompt = Prompt_Template.format(task, code_snippet, error_reason)
+        response = yield from self.generate_stream(prompt)
+        code = self._extract_code(response)
         
         return code
             
             
-    def __extract_code(self, response):
+    def _extract_code(self, response):
         if "```python" not in response:
             return response
         else:
             match = re.search(r'```python(.*?)```', response, re.S)
             code = match.group(1).strip()
                 
-        return code 
-            
\ No newline at end of file
+        return code
+
+
+class AsyncRevisorAgent(RevisorAgent, AsyncBaseAgent):
+    '''
+    RevisorAgent的异步版本
+    '''
+    async def revise(self, task, code_snippet, error_reason):
+        self.revised_code = []
+        
+        self.clean_message()
+        prompt = Prompt_Template.format(task, code_snippet, error_reason)
+        response = await self.generate(prompt)
+        code = self._extract_code(response)
+        
+        return code
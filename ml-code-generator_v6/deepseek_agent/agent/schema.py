@@ -0,0 +1,133 @@
+"""
+PlannerAgent和WritterAgent提示词中的数据集结构摘要
+
+模型不知道数据集有哪些列时，生成的代码往往先用一整步打印 info()/head()，或者猜错列名导致检查失败、多一轮修正。
+根据上传时计算的数据集画像（见dataset_profile.py）生成紧凑的结构摘要：文件路径、行列数、可能的目标列，
+以及每列的类型、缺失率、不同取值数、取值示例。摘要不超过token预算：超出时逐级去掉取值示例、统计信息，
+最后只保留部分列名。每个数据集在每个详细程度下的摘要以及最终的摘要都按内容哈希缓存。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from .deepseek_api import count_tokens
+
+
+DATASET_SCHEMA_TOKEN_BUDGET = int(os.getenv('DATASET_SCHEMA_TOKEN_BUDGET', '800'))
+
+HEADER = ('The following datasets have already been inspected. Use these exact file paths and column names, '
+          'and do not add steps or code that only explore the data (such as head(), info() or describe()).')
+
+# 详细程度：0 全部信息，1 去掉取值示例和数值范围，2 只有列名和类型，3 只有部分列名
+LEVELS = (0, 1, 2, 3)
+MAX_COLUMNS_AT_LOWEST_LEVEL = 30
+MAX_SAMPLES = 3
+MAX_SAMPLE_LENGTH = 20
+CACHE_SIZE = 256
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def summarize_datasets(profiles, budget=DATASET_SCHEMA_TOKEN_BUDGET):
+    '''
+    生成多个数据集的结构摘要
+
+    Params:
+        profiles: DatasetIndex.profile返回的画像列表（带有path和sha256）
+        budget: 摘要最多占用的token数
+
+    Returns:
+        summary: 摘要文本，没有数据集时为空字符串
+    '''
+    if not profiles:
+        return ''
+
+    # 同一组数据集的摘要也缓存，不重复统计token数
+    key = (tuple((profile['sha256'], profile['path']) for profile in profiles), budget)
+    summary = _cached(key)
+    if summary is not None:
+        return summary
+
+    for level in LEVELS:
+        summary = '\n'.join([HEADER] + [_dataset_block(profile, level) for profile in profiles])
+        if _count(summary) <= budget:
+            break
+    else:
+        # 最简略的摘要仍超出预算时按字符截断（一个token至少对应一个字符）
+        summary = summary[:budget]
+    return _store(key, summary)
+
+
+def _count(text):
+    tokens = count_tokens(text)
+    # 编码无法加载时按4个字符一个token估算
+    return tokens if tokens is not None else len(text) // 4 + 1
+
+
+def _dataset_block(profile, level):
+    key = (profile['sha256'], profile['path'], level)
+    block = _cached(key)
+    if block is None:
+        block = _store(key, _render(profile, level))
+    return block
+
+
+def _cached(key):
+    with _cache_lock:
+        value = _cache.get(key)
+        if value is not None:
+            _cache.move_to_end(key)
+        return value
+
+
+def _store(key, value):
+    with _cache_lock:
+        _cache[key] = value
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
+
+
+def _render(profile, level):
+    lines = [f"- {profile['path']} ({profile['rows']} rows, {profile['columns']} columns)"]
+    if not profile['has_header']:
+        lines.append('  No header row: read it with header=None; the column names below are positions.')
+    candidates = profile['target_candidates']
+    if candidates:
+        target = candidates[0]
+        lines.append(f"  Likely target: {target['column']} ({target['task']})")
+
+    columns = profile['column_profiles']
+    if level == 3:
+        names = [column['name'] for column in columns[:MAX_COLUMNS_AT_LOWEST_LEVEL]]
+        more = len(columns) - len(names)
+        lines.append('  Columns: ' + ', '.join(names) + (f', ... (+{more} more)' if more > 0 else ''))
+        return '\n'.join(lines)
+
+    lines.append('  Columns:')
+    for column in columns:
+        lines.append(f"    {column['name']}: {_describe(column, level)}")
+    return '\n'.join(lines)
+
+
+def _describe(column, level):
+    parts = [column['dtype']]
+    if level >= 2:
+        return parts[0]
+
+    if column['null_rate']:
+        parts.append(f"{column['null_rate']:.1%} missing")
+    parts.append(f"{'~' if column['distinct_approx'] else ''}{column['distinct']} distinct")
+    if level == 0:
+        if 'min' in column:
+            parts.append(f"range {column['min']}..{column['max']}")
+        samples = [_shorten(value) for value in column['samples'][:MAX_SAMPLES]]
+        if samples and column['dtype'] not in ('int', 'float'):
+            parts.append('e.g. ' + ', '.join(samples))
+    return ', '.join(parts)
+
+
+def _shorten(value):
+    value = ' '.join(value.split())
+    return value if len(value) <= MAX_SAMPLE_LENGTH else value[:MAX_SAMPLE_LENGTH - 3] + '...'
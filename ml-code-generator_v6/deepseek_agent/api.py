@@ -1,32 +1,55 @@
 from .agent import WritterAgent, PlannerAgent, RefinerAgent, RevisorAgent, MetricsAnalyzerAgent
 from .agent.deepseek_api import BaseAgent
-import subprocess
+from .agent.response_cache import get_response_cache
+from .agent.check import IncrementalChecker
+from .agent.schema import summarize_datasets
+from .agent.metrics_analyzer import pack_task_descriptions
+from .agent import dependency
+from .sandbox import sandbox_pool
+from .executor import execute
+from .static_check import static_check, STATIC_CHECK
+from . import sampling
+from . import CHECK_ROOT
+from .dataset_profile import dataset_index
+from . import repair
+from . import telemetry
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
 import argparse
 import os
+import shutil
+import sys
 import json
+import hashlib
 import re
 from dotenv import load_dotenv
 
 load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '..', '.env'))
 
-base_url = 'https://api.deepseek.com'
+# 可指向其他OpenAI兼容的服务，如benchmarks/mock_llm.py启动的本地模拟服务
+base_url = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
 api_key = os.getenv('DEEPSEEK_API_KEY')
 model = "deepseek-chat"
 
+STEP_GENERATION_WORKERS = int(os.getenv('STEP_GENERATION_WORKERS', '4'))
+METRICS_BATCH_WORKERS = int(os.getenv('METRICS_BATCH_WORKERS', '4'))
 
-def plan_for_machine_task(task_prompt: str):
+
+def plan_for_machine_task(task_prompt: str, datasets: list = None):
     '''
     给定一个机器学习任务，对其进行分解规划
     
     Params:
         task_prompt: task_prompt中包含了机器学习任务描述，评估指标，数据集描述，以及参考解决方案
+        datasets: 任务使用的数据集路径，其结构摘要会附在提示词中（见dataset_schema）
 
     Returns:
         plan: 为list类型数据，对任务进行规划分解后的若干个子步骤
     '''
     
     agent = PlannerAgent(base_url, api_key, model)
-    plans, response = agent.plan(task_prompt)
+    with telemetry.stage('plan'):
+        plans, response = agent.plan(task_prompt, dataset_schema(datasets))
     return plans
 
 
@@ -34,7 +57,8 @@ def plan_for_machine_task(task_prompt: str):
 def generate_current_step_code(task_prompt: str, 
                                current_step: str, 
                                step_id: int,
-                               previous_code: str = None):
+                               previous_code: str = None,
+                               datasets: list = None):
     '''
     分步生成代码，生成第N步的代码
     
@@ -42,16 +66,175 @@ def generate_current_step_code(task_prompt: str,
         task_prompt: task_prompt中包含了机器学习任务描述，评估指标，数据集描述，以及参考解决方案
         current_step: 为函数plan_for_machine_task所返回的步骤集合中，当前步骤对应的子任务
         previous_code: 为前 N - 1 步所对应的代码
+        datasets: 任务使用的数据集路径，其结构摘要会附在提示词中（见dataset_schema）
 
     Returns:
         current_step_code: 当前步骤对应的代码
     '''
     agent = WritterAgent(base_url, api_key, model)
-    current_step_code = agent.write_code(task_prompt, current_step, step_id, previous_code)
+    with telemetry.stage('generate_step', step_id=step_id):
+        current_step_code = agent.write_code(task_prompt, current_step, step_id, previous_code,
+                                             dataset_schema(datasets))
     return current_step_code
 
 
 
+def generate_current_step_code_stream(task_prompt: str, 
+                                      current_step: str, 
+                                      step_id: int,
+                                      previous_code: str = None,
+                                      datasets: list = None):
+    '''
+    generate_current_step_code的流式版本，逐段yield模型输出的代码片段
+    
+    Returns:
+        current_step_code: 生成器结束时返回当前步骤对应的完整代码
+    '''
+    agent = WritterAgent(base_url, api_key, model)
+    with telemetry.stage('generate_step', step_id=step_id):
+        current_step_code = yield from agent.write_code_stream(task_prompt, current_step, step_id, previous_code,
+                                                               dataset_schema(datasets))
+    return current_step_code
+
+
+
+def analyze_step_dependencies(plans: list):
+    '''
+    分析规划步骤之间的依赖关系，没有依赖关系的步骤可以并发生成
+    
+    Params:
+        plans: plan_for_machine_task返回的步骤列表
+        
+    Returns:
+        dependencies: 第i项为第i+1步直接依赖的步骤编号（从1开始）
+    '''
+    return dependency.analyze_step_dependencies(plans)
+
+
+
+def _artifact_key(*parts):
+    payload = json.dumps([model, *parts], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+
+def step_input_keys(task_prompt: str, plans: list, dependencies: list, datasets: list = None):
+    '''
+    计算每个步骤的输入指纹：由任务描述、步骤描述、数据集结构摘要和所依赖步骤的指纹决定，
+    任一输入变化时该步骤及所有依赖它的步骤的指纹都会变化
+    
+    Returns:
+        keys: 与plans等长的指纹列表
+    '''
+    schema = dataset_schema(datasets)
+    # 没有数据集时指纹与之前保持一致
+    extra = [schema] if schema else []
+    keys = []
+    for index, current_step in enumerate(plans):
+        dep_keys = [keys[dep - 1] for dep in dependencies[index]]
+        keys.append(_artifact_key('step', task_prompt, current_step, index + 1, dep_keys, *extra))
+    return keys
+
+
+
+def _notify(observer, event, **data):
+    if observer is not None:
+        observer(event, data)
+
+
+
+def _consume_stream(generator, on_delta):
+    # 把流式函数的每个增量交给on_delta，返回生成器的最终结果
+    while True:
+        try:
+            delta = next(generator)
+        except StopIteration as stop:
+            return stop.value
+        on_delta(delta)
+
+
+
+def _generate_step(task_prompt, current_step, step_id, previous_code, observer, datasets):
+    if observer is None:
+        return generate_current_step_code(task_prompt, current_step, step_id, previous_code, datasets)
+    
+    _notify(observer, 'step-started', stepId=step_id, stepName=current_step)
+    return _consume_stream(
+        generate_current_step_code_stream(task_prompt, current_step, step_id, previous_code, datasets),
+        lambda delta: _notify(observer, 'step-delta', stepId=step_id, stage='generate', delta=delta),
+    )
+
+
+
+def generate_all_step_code(task_prompt: str,
+                           plans: list,
+                           dependencies: list = None,
+                           max_workers: int = STEP_GENERATION_WORKERS,
+                           cancel_event: threading.Event = None,
+                           reuse: dict = None,
+                           observer=None,
+                           datasets: list = None):
+    '''
+    生成所有步骤的代码：依赖的步骤都生成完毕后即开始生成，互不依赖的步骤并发生成
+    
+    Params:
+        plans: plan_for_machine_task返回的步骤列表
+        dependencies: 步骤依赖关系，默认由analyze_step_dependencies分析得到
+        max_workers: 同时生成的步骤数上限
+        cancel_event: 被设置后不再开始新的步骤，并抛出GenerationCancelled
+        reuse: 之前生成的步骤代码 {步骤输入指纹: 代码}，指纹相同的步骤直接复用，不再调用模型
+        observer: 进度回调observer(event, data)，传入时以流式方式生成并上报step-started/step-delta/step-complete
+        datasets: 任务使用的数据集路径，其结构摘要会附在提示词中
+        
+    Returns:
+        step_codes: 按步骤顺序排列的每一步的代码，每一步只以其依赖的步骤的代码作为previous_code
+    '''
+    if dependencies is None:
+        dependencies = analyze_step_dependencies(plans)
+    
+    step_codes = [None] * len(plans)
+    started = set()
+    futures = {}
+    
+    if reuse:
+        for index, key in enumerate(step_input_keys(task_prompt, plans, dependencies, datasets)):
+            if key in reuse:
+                step_codes[index] = reuse[key]
+                started.add(index)
+                _notify(observer, 'step-complete', stepId=index + 1, stepName=plans[index],
+                        code=step_codes[index], reused=True)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit_ready():
+            for index, current_step in enumerate(plans):
+                if index in started or any(step_codes[dep - 1] is None for dep in dependencies[index]):
+                    continue
+                step_id = index + 1
+                previous_code = ''.join('\n\n' + step_codes[dep - 1]
+                                        for dep in dependency.dependency_closure(dependencies, step_id))
+                future = executor.submit(_generate_step, task_prompt, current_step, step_id, previous_code,
+                                         observer, datasets)
+                futures[future] = index
+                started.add(index)
+        
+        submit_ready()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures.pop(future)
+                step_codes[index] = future.result()
+                _notify(observer, 'step-complete', stepId=index + 1, stepName=plans[index],
+                        code=step_codes[index], reused=False)
+            if cancel_event is not None and cancel_event.is_set():
+                for future in futures:
+                    future.cancel()
+                _raise_if_cancelled(cancel_event)
+            submit_ready()
+    
+    return step_codes
+
+
+
 def refine_all_step_code(task_prompt: str,
                          all_step_code: str):
     '''
@@ -64,35 +247,66 @@ def refine_all_step_code(task_prompt: str,
         refined_code: 整合后的代码
     '''
     agent = RefinerAgent(base_url, api_key, model)
-    refined_code = agent.refine(task_prompt, all_step_code)
+    with telemetry.stage('refine'):
+        refined_code = agent.refine(task_prompt, all_step_code)
     return refined_code
 
 
 
-def checking(folder, py_file):
-    shell_template = '''
-    cd {}\npython {}
-    '''.strip()
-    shell = shell_template.format(folder, py_file)
-    try:
-        result = subprocess.run(
-            shell,
-            shell=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True 
-        )
-        return {
-            "success": True,
-            "stderr": None
-        }
+def refine_all_step_code_stream(task_prompt: str,
+                                all_step_code: str):
+    '''
+    refine_all_step_code的流式版本，逐段yield模型输出的代码片段
+
+    Returns:
+        refined_code: 生成器结束时返回整合后的完整代码
+    '''
+    agent = RefinerAgent(base_url, api_key, model)
+    with telemetry.stage('refine'):
+        refined_code = yield from agent.refine_stream(task_prompt, all_step_code)
+    return refined_code
+
+
+
+def checking(folder, py_file, cancel_event=None, full_data=False, datasets=None):
+    '''
+    在folder目录下执行py_file，受超时、CPU时间、内存和输出大小限制（见executor.py）。
+    执行前先做静态预检（见static_check.py），语法错误、未定义的名字和缺失的模块不启动解释器直接返回；
+    较大的数据集默认只读取样本（见sampling.py）
     
-    except subprocess.CalledProcessError as e:
-        return {
-            "success": False,
-            "stderr": e.stderr
-        }
+    Params:
+        cancel_event: 可选的threading.Event，被设置后立即结束执行
+        full_data: 为True时在完整数据上执行
+        datasets: 任务使用的数据集，与代码中写出的数据集路径一起决定对哪些文件抽样
+    
+    Returns:
+        result: {"success": bool, "stderr": str | None, "sampled": 是否读取的是样本,
+                 以及exit_code、duration、peak_rss_kb等执行信息；静态预检失败时只有success、stderr和static}
+    '''
+    with open(os.path.join(folder, py_file), 'r', encoding='utf-8') as f:
+        code = f.read()
+
+    if STATIC_CHECK:
+        with telemetry.stage('static_check'):
+            result = static_check(code, filename=py_file, search_paths=[folder])
+        if not result['success']:
+            return result
+
+    redirects = {}
+    if not full_data and sampling.enabled():
+        with telemetry.stage('sample'):
+            redirects = sampling.sample_redirects(code, folder, datasets)
+
+    with telemetry.stage('check'):
+        if redirects:
+            with sampling.redirected(redirects) as env:
+                result = execute([sys.executable, py_file], cwd=folder, env=env, cancel_event=cancel_event)
+        else:
+            result = execute([sys.executable, py_file], cwd=folder, cancel_event=cancel_event)
+    result['sampled'] = bool(redirects)
+    if result['success']:
+        result['stderr'] = None
+    return result
 
 
 def revise_code(task_prompt: str,
@@ -110,47 +324,333 @@ def revise_code(task_prompt: str,
         revised_code: 修改后的代码
     '''
     agent = RevisorAgent(base_url, api_key, model)
-    revised_code = agent.revise(task_prompt, code, error_log)
+    with telemetry.stage('revise'):
+        revised_code = agent.revise(task_prompt, code, error_log)
     return revised_code
 
 
 
+def revise_code_stream(task_prompt: str,
+                       code: str,
+                       error_log: str):
+    '''
+    revise_code的流式版本，逐段yield模型输出的代码片段
+        
+    Returns:
+        revised_code: 生成器结束时返回修改后的完整代码
+    '''
+    agent = RevisorAgent(base_url, api_key, model)
+    with telemetry.stage('revise'):
+        revised_code = yield from agent.revise_stream(task_prompt, code, error_log)
+    return revised_code
+
+
+
+def _candidate_inputs(data_folder, datasets, full_data=False):
+    '''
+    修正候选沙箱中提供的输入文件 {沙箱中的相对路径: 拷贝来源}，数据目录中的数据集保持原来的相对路径。
+    候选只做检查，较大的数据集直接拷贝样本（与checking中的重定向读到的内容相同），拷贝的代价很小；
+    full_data为True时拷贝完整的数据集
+    '''
+    inputs = {}
+    for path in datasets:
+        if not os.path.isfile(path):
+            continue
+        source = os.path.realpath(path)
+        if not full_data and sampling.enabled() and os.path.getsize(source) >= sampling.CHECK_SAMPLE_MIN_BYTES:
+            source = sampling.sample_file(source) or source
+        name = os.path.basename(path)
+        if data_folder is not None:
+            relative = os.path.relpath(os.path.abspath(path), os.path.abspath(data_folder))
+            if not relative.startswith(os.pardir):
+                name = relative
+        inputs[name] = source
+    return inputs
+
+
+def _candidate_runner(data_folder, python_file_name, datasets=None, full_data=False):
+    '''
+    返回repair.repair使用的候选执行函数：每个候选在独立的沙箱中执行，输入的数据集以拷贝提供，
+    候选的所有输出都留在沙箱中（不会通过链接写回数据目录），
+    只有胜出的候选把新产生的文件（模型、预测结果等）拷回数据目录
+    '''
+    inputs = _candidate_inputs(data_folder, datasets or [], full_data)
+
+    def run_candidate(code, stop_event, claim):
+        with sandbox_pool.sandbox() as folder:
+            if stop_event.is_set():
+                # 等待沙箱期间已有其他候选胜出
+                return {"success": False, "stderr": None, "cancelled": True}
+            for name, source in inputs.items():
+                if name != python_file_name:
+                    target = os.path.join(folder, name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.copyfile(source, target)
+            with open(os.path.join(folder, python_file_name), 'w', encoding='utf-8') as f:
+                f.write(code)
+
+            result = checking(folder, python_file_name, cancel_event=stop_event, full_data=full_data)
+            if result['success'] and claim() and data_folder is not None:
+                for root, _, files in os.walk(folder):
+                    for file_name in files:
+                        path = os.path.join(root, file_name)
+                        name = os.path.relpath(path, folder)
+                        # 输入的数据集（拷贝的可能是样本）即使被候选改写也不拷回
+                        if name in inputs or name == python_file_name or os.path.islink(path):
+                            continue
+                        target = os.path.join(data_folder, name)
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        shutil.copy2(path, target)
+        return result
+
+    return run_candidate
+
+
+def repair_code(task_prompt: str,
+                code: str,
+                error_log: str,
+                data_folder: str = None,
+                python_file_name: str = 'check_this.py',
+                candidates: int = None,
+                max_rounds: int = None,
+                cancel_event: threading.Event = None,
+                observer=None,
+                datasets: list = None,
+                full_data: bool = False):
+    '''
+    多候选并行修正：每轮用不同的temperature并发请求多个修正版本，各自在独立沙箱中执行，
+    第一个执行通过的候选胜出，其余的被杀掉；都失败时以执行最久的候选继续下一轮（见repair.py）
+    
+    Params:
+        task_prompt: task_prompt中包含了机器学习任务描述，评估指标，数据集描述，以及参考解决方案
+        code: 执行失败的代码
+        error_log: 错误log
+        data_folder: 代码运行需要的数据目录，胜出候选产生的文件会拷回这里；为None时在空沙箱中执行
+        python_file_name: 代码在沙箱中的文件名
+        candidates: 每轮的候选数，默认REPAIR_CANDIDATES
+        max_rounds: 最多修正轮数，默认REPAIR_MAX_ROUNDS
+        cancel_event: 可选的threading.Event，被设置后停止修正
+        observer: 进度回调observer(event, data)，每个候选执行结束后发送repair-candidate事件
+        datasets: 代码读取的数据集，以拷贝提供给每个候选；为None时不提供数据集（数据目录可能是共享的上传目录，不做扫描）
+        full_data: 为True时候选在完整数据上执行（代码在样本上通过、在完整数据上失败时）
+        
+    Returns:
+        result: {
+            "success": bool, "code": 修正后的代码, "stderr": str | None,
+            "rounds": 进行的轮数, "attempts": 执行过的候选数,
+            "winner": {"round", "index", "temperature"} | None, "cancelled": bool,
+        }
+    '''
+    def generate_candidate(current_code, current_error, temperature):
+        agent = RevisorAgent(base_url, api_key, model, temperature=temperature)
+        with telemetry.stage('revise', temperature=temperature):
+            return agent.revise(task_prompt, current_code, current_error)
+
+    def on_candidate(round_id, index, temperature, result):
+        _notify(observer, 'repair-candidate', round=round_id, index=index, temperature=temperature,
+                success=result['success'], stderr=None if result['success'] else result['stderr'])
+
+    return repair.repair(code, error_log, generate_candidate,
+                         _candidate_runner(data_folder, python_file_name, datasets, full_data),
+                         candidates=candidates, max_rounds=max_rounds,
+                         cancel_event=cancel_event, on_candidate=on_candidate)
+
+
+
 task_prompt = 'Use random forest model to classify the iris dataset.'
 
-def run(task_prompt: str, python_file_name: str, save_fold: str):
-    plans = plan_for_machine_task(task_prompt)
+
+class GenerationCancelled(Exception):
+    '''
+    run()在执行过程中被取消
+    '''
+
+
+def _raise_if_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise GenerationCancelled('Code generation was cancelled')
+
+
+def _dataset_digests(datasets):
+    '''
+    数据集的内容哈希 [[文件名, sha256], ...]；.csv / .tsv 的哈希取自画像索引（规划时已计算，文件未变化时只需stat）
+    '''
+    digests = []
+    for path in sorted(datasets or []):
+        if not os.path.isfile(path):
+            digests.append([os.path.basename(path), None])
+        elif path.lower().endswith(sampling.DATA_EXTENSIONS):
+            digests.append([os.path.basename(path), dataset_index.profile(path)['sha256']])
+        else:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            digests.append([os.path.basename(path), sha.hexdigest()])
+    return digests
+
+
+def _check_key(save_fold, python_file_name, code, digests, full_data=False):
+    # 检查结果取决于代码本身、任务读取的数据集内容（数据集被替换或修改后需要重新执行）以及是否只读取样本；
+    # 数据目录中的其他文件（检查自己写出的输出、无关的上传）不影响检查结果
+    data = 'full' if full_data or not sampling.enabled() else \
+        f'sample:{sampling.CHECK_SAMPLE_MODE}:{sampling.CHECK_SAMPLE_ROWS}'
+    return _artifact_key('check', os.path.abspath(save_fold), python_file_name, code, digests, data)
+
+
+def run(task_prompt: str,
+        python_file_name: str,
+        save_fold: str,
+        cancel_event: threading.Event = None,
+        plans: list = None,
+        artifacts: dict = None,
+        observer=None,
+        datasets: list = None):
+    '''
+    完整的代码生成流程：规划 -> 分步生成 -> 整合 -> 检查 -> 修正
     
-    previous_code = ''
-    for i, current_step in enumerate(plans):
-        current_step_id = i + 1
-        current_step_code = generate_current_step_code(task_prompt, current_step, current_step_id, previous_code)
-        previous_code += '\n\n' + current_step_code
+    Params:
+        cancel_event: 可选的threading.Event，被设置后在下一个阶段开始前抛出GenerationCancelled
+        plans: 指定步骤列表时跳过规划
+        artifacts: 之前运行返回的artifacts，输入未变化的步骤代码、整合结果、检查结果和修正结果直接复用
+        observer: 进度回调observer(event, data)，事件与WebSocket接口一致：
+                  planning-complete、step-started、step-delta、step-complete、final-refining、
+                  step-checked、repair-candidate、step-revised、generation-complete
+        datasets: 任务使用的数据集路径，其结构摘要会附在规划和代码生成的提示词中；为None时不使用数据集
+                  （save_fold可能是共享的上传目录，不扫描其中的文件）
         
-    refined_code = refine_all_step_code(task_prompt, previous_code)
+    Returns:
+        result: {
+            "code": 最终代码, "success": 最终代码能否正常运行, "stderr": 运行错误,
+            "artifacts": 本次运行的中间结果，可传给下一次run复用,
+            "reused": 各阶段是否复用了之前的结果,
+        }
+    '''
+    artifacts = artifacts or {}
+    reused = {}
+    datasets = datasets or []
+    
+    if plans is None:
+        plans = plan_for_machine_task(task_prompt, datasets)
+    _notify(observer, 'planning-complete', plans=plans)
+    _raise_if_cancelled(cancel_event)
+    
+    # 互不依赖的步骤并发生成，最后按步骤顺序拼接
+    dependencies = analyze_step_dependencies(plans)
+    step_keys = step_input_keys(task_prompt, plans, dependencies, datasets)
+    previous_steps = artifacts.get('steps', {})
+    step_codes = generate_all_step_code(task_prompt, plans, dependencies,
+                                        cancel_event=cancel_event, reuse=previous_steps, observer=observer,
+                                        datasets=datasets)
+    reused['steps'] = [i + 1 for i, key in enumerate(step_keys) if key in previous_steps]
+    previous_code = ''.join('\n\n' + current_step_code for current_step_code in step_codes)
+    _raise_if_cancelled(cancel_event)
+    
+    refine_key = _artifact_key('refine', task_prompt, previous_code)
+    refined_code = artifacts.get('refines', {}).get(refine_key)
+    reused['refine'] = refined_code is not None
+    _notify(observer, 'final-refining', reused=refined_code is not None)
+    if refined_code is None and observer is not None:
+        refined_code = _consume_stream(
+            refine_all_step_code_stream(task_prompt, previous_code),
+            lambda delta: _notify(observer, 'step-delta', stepId=None, stage='refine', delta=delta),
+        )
+    elif refined_code is None:
+        refined_code = refine_all_step_code(task_prompt, previous_code)
     
     with open(os.path.join(save_fold, python_file_name), 'w') as f:
         f.write(refined_code)
         
     code = refined_code
-        
-    ### debug 
-    run_log = checking(save_fold, python_file_name)
+    _raise_if_cancelled(cancel_event)
     
-    if not run_log['success']:
-        error_log = run_log['stderr']
+    previous_checks = artifacts.get('checks', {})
+    checks = {}
+    revisions = {}
+    
+    digests = _dataset_digests(datasets)
+    
+    def cached_checking(full_data=False):
+        key = _check_key(save_fold, python_file_name, code, digests, full_data=full_data)
+        result = previous_checks.get(key)
+        reused.setdefault('checks', []).append(result is not None)
+        if result is None:
+            result = checking(save_fold, python_file_name, full_data=full_data, datasets=datasets)
+            result = {"success": result['success'], "stderr": result['stderr']}
+        checks[key] = result
+        _notify(observer, 'step-checked', stepId=None, success=result['success'], stderr=result['stderr'])
+        return result
+    
+    def revise(error_log, full_data=False):
+        nonlocal code
+        _raise_if_cancelled(cancel_event)
         
         with open(os.path.join(save_fold, python_file_name), 'r') as f:
             code = f.read()
         
-        revised_code = revise_code(task_prompt, code, error_log)
+        # 完整数据上的修正与样本上的修正分别记录，样本上的修正结果的指纹与之前保持一致
+        revise_key = _artifact_key('revise', task_prompt, code, error_log, *(['full'] if full_data else []))
+        revised_code = artifacts.get('revisions', {}).get(revise_key)
+        reused['revise_full' if full_data else 'revise'] = revised_code is not None
+        if revised_code is not None:
+            _notify(observer, 'step-revised', stepId=None, revisedCode=revised_code)
+            with open(os.path.join(save_fold, python_file_name), 'w') as f:
+                f.write(revised_code)
+            code = revised_code
+            revisions[revise_key] = code
+            _raise_if_cancelled(cancel_event)
+            return cached_checking(full_data)
         
+        # 多个候选并行修正和执行，胜出候选的执行结果直接作为检查结果，不再重复执行
+        repaired = repair_code(task_prompt, code, error_log,
+                               data_folder=save_fold, python_file_name=python_file_name,
+                               cancel_event=cancel_event, observer=observer, datasets=datasets,
+                               full_data=full_data)
+        _raise_if_cancelled(cancel_event)
+        code = repaired['code']
+        revisions[revise_key] = code
+        _notify(observer, 'step-revised', stepId=None, revisedCode=code,
+                rounds=repaired['rounds'], attempts=repaired['attempts'], winner=repaired['winner'])
         with open(os.path.join(save_fold, python_file_name), 'w') as f:
-            f.write(revised_code)
+            f.write(code)
 
-        code = revised_code
-        run_log = checking(save_fold, python_file_name)
+        result = {"success": repaired['success'], "stderr": repaired['stderr']}
+        checks[_check_key(save_fold, python_file_name, code, digests, full_data=full_data)] = result
+        reused['checks'].append(False)
+        _notify(observer, 'step-checked', stepId=None, success=result['success'], stderr=result['stderr'])
+        return result
         
+    ### debug 
+    run_log = cached_checking()
+    
+    if not run_log['success']:
+        run_log = revise(run_log['stderr'])
+    
+    if run_log['success'] and sampling.sample_redirects(code, save_fold, datasets):
+        # 检查和修正都只读取了数据集的样本，最终代码在完整数据上再执行一次；
+        # 在完整数据上才出现的错误（内存不足、样本中没有的类别等）同样交给修正，修正候选读取完整数据
+        _raise_if_cancelled(cancel_event)
+        run_log = cached_checking(full_data=True)
+        if not run_log['success']:
+            run_log = revise(run_log['stderr'], full_data=True)
     
+    _notify(observer, 'generation-complete', finalCode=code, success=run_log['success'], stderr=run_log['stderr'])
+    
+    return {
+        "code": code,
+        "success": run_log['success'],
+        "stderr": run_log['stderr'],
+        "artifacts": {
+            "plans": plans,
+            "dependencies": dependencies,
+            "steps": dict(zip(step_keys, step_codes)),
+            "refines": {refine_key: refined_code},
+            "revisions": revisions,
+            "checks": checks,
+        },
+        "reused": reused,
+    }
+
 def main():
     parser = argparse.ArgumentParser(description='Generate ML code for a given task')
     parser.add_argument('--task', type=str, required=True, help='Task description')
@@ -162,29 +662,147 @@ def main():
     save_fold = os.path.dirname(args.dataset)
     
     try:
-        run(args.task, python_file_name, save_fold)
+        run(args.task, python_file_name, save_fold, datasets=[args.dataset])
         print("Code generation completed successfully")
     except Exception as e:
         print(f"Error: {str(e)}")
         exit(1)
 
-def check_code(code: str):
-    save_fold = 'temp_check'
-    if not os.path.exists(save_fold):
-        os.makedirs(save_fold)
+def check_code(code: str, full_data: bool = False):
+    '''
+    在独立的沙箱目录中执行代码，检查是否能正常运行；多个检查可以并发进行
     
+    Params:
+        code: 要检查的完整代码
+        full_data: 为True时读取完整的数据集，否则较大的数据集只读取样本
+        
+    Returns:
+        result: {"success": bool, "stderr": str | None}
+    '''
     python_file_name = 'check_this.py'
-    file_path = os.path.join(save_fold, python_file_name)
     
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write(code)
-        
-    result = checking(save_fold, python_file_name)
+    with sandbox_pool.sandbox() as save_fold:
+        with open(os.path.join(save_fold, python_file_name), 'w', encoding='utf-8') as f:
+            f.write(code)
+            
+        result = checking(save_fold, python_file_name, full_data=full_data)
     return result
 
+CHECK_STEP_TIMEOUT = float(os.getenv('CHECK_STEP_TIMEOUT', '600'))
+CHECK_SESSION_ROOT = os.path.join(CHECK_ROOT, 'sessions')
+
+_check_sessions = {}
+_check_sessions_lock = threading.Lock()
+
+
+def _check_session_folder(session_id: str):
+    safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', str(session_id))
+    return os.path.join(CHECK_SESSION_ROOT, safe_id)
+
+
+def _session_redirects_file(folder):
+    return os.path.join(folder, '.sample_redirects.json')
+
+
+def check_step_code(session_id: str,
+                    code: str,
+                    previous_code: str = None,
+                    reset: bool = False):
+    '''
+    增量检查代码：同一会话保存上一次检查通过后的解释器状态，只执行当前步骤的代码，
+    执行失败时自动回滚到上一次成功的状态；与checking相同，较大的数据集只读取样本
+    
+    Params:
+        session_id: 会话ID，同一会话中的步骤共享状态
+        code: 当前步骤的代码
+        previous_code: 之前步骤的代码，会话状态不存在时（如工作进程被回收）先执行它来恢复状态
+        reset: 为True时丢弃已保存的状态，从空的命名空间开始执行code（如整段代码被修正后）
+        
+    Returns:
+        result: {"success": bool, "stderr": str | None}
+    '''
+    with _check_sessions_lock:
+        checker = _check_sessions.get(session_id)
+        is_new = checker is None
+        if is_new:
+            folder = _check_session_folder(session_id)
+            env = sampling.sample_env(_session_redirects_file(folder)) if sampling.enabled() else None
+            checker = IncrementalChecker(folder, timeout=CHECK_STEP_TIMEOUT, env=env)
+            _check_sessions[session_id] = checker
+
+    if reset:
+        checker.reset()
+
+    if STATIC_CHECK:
+        # 跨步骤的名字分析需要之前步骤的代码；会话中已有状态但没有传入previous_code时只检查语法和import
+        context = None if reset else previous_code
+        step = checker.steps + (2 if is_new and context else 1)
+        with telemetry.stage('static_check'):
+            result = static_check(code, previous_code=context or '', filename=f'step_{step}.py',
+                                  search_paths=[checker.workdir],
+                                  check_names=context is not None or checker.steps == 0)
+        if not result['success']:
+            return result
+
+    if sampling.enabled():
+        # 会话中的解释器进程是常驻的，新步骤读取的数据集追加到会话的重定向表中
+        with telemetry.stage('sample'):
+            redirects = sampling.sample_redirects((previous_code or '') + '\n' + code, checker.workdir)
+        if redirects:
+            redirects_file = _session_redirects_file(checker.workdir)
+            if os.path.exists(redirects_file):
+                with open(redirects_file, 'r', encoding='utf-8') as f:
+                    redirects = {**json.load(f), **redirects}
+            sampling.write_redirects(redirects_file, redirects)
+
+    if not reset and is_new and previous_code and previous_code.strip():
+        result = checker.check(previous_code)
+        if not result['success']:
+            return result
+
+    return checker.check(code)
+
+
+def close_check_session(session_id: str):
+    '''
+    结束增量检查会话，释放其解释器进程和工作目录
+    '''
+    with _check_sessions_lock:
+        checker = _check_sessions.pop(session_id, None)
+    if checker is not None:
+        checker.close()
+        shutil.rmtree(checker.workdir, ignore_errors=True)
+
+
+def dataset_profile(path: str):
+    '''
+    数据集画像（见dataset_profile.py）：文件未变化时直接从索引读出，否则流式读取一次并保存
+    
+    Returns:
+        profile: {"rows", "columns", "header", "head", "column_profiles", "target_candidates", "sha256", ...}
+    '''
+    return dataset_index.profile(path)
+
+
+def dataset_schema(datasets: list = None):
+    '''
+    数据集的结构摘要（列名、类型、取值示例、目标列），附在PlannerAgent和WritterAgent的提示词中，
+    长度受DATASET_SCHEMA_TOKEN_BUDGET限制；画像和摘要都按数据集内容缓存
+    
+    Params:
+        datasets: 数据集路径列表，不是 .csv / .tsv 或不存在的文件被忽略
+        
+    Returns:
+        summary: 摘要文本，没有数据集时为空字符串
+    '''
+    profiles = [dataset_index.profile(path) for path in datasets or []
+                if path.lower().endswith(('.csv', '.tsv')) and os.path.isfile(path)]
+    return summarize_datasets(profiles)
+
+
 def analyze_task_metrics(task_prompt: str):
     '''
-    从任务描述中分析评估指标
+    从任务描述中分析评估指标；常见的描述由别名规则在本地识别，置信度较低时才调用模型
     
     Params:
         task_prompt: 包含任务描述、评估方法等的完整文本
@@ -196,6 +814,98 @@ def analyze_task_metrics(task_prompt: str):
     metrics_data = agent.analyze_metrics(task_prompt)
     return metrics_data
 
+
+def analyze_task_metrics_batch(task_prompts: list, max_workers: int = METRICS_BATCH_WORKERS):
+    '''
+    批量分析多个任务描述的评估指标：相同的描述只分析一次，规则能识别的在本地完成，
+    其余较短的描述打包到同一次模型请求中（见pack_task_descriptions），各次请求并发执行
+    
+    Params:
+        task_prompts: 任务描述列表
+        max_workers: 同时进行的模型请求数上限
+        
+    Returns:
+        results: 与task_prompts一一对应的 {"success": bool, "result": 指标信息或None, "error": 错误信息或None}，
+            某一项失败不影响其他项
+    '''
+    outcomes = {}
+    pending = []
+    agent = MetricsAnalyzerAgent(base_url, api_key, model)
+    for task_prompt in dict.fromkeys(task for task in task_prompts if isinstance(task, str) and task.strip()):
+        metrics_data = agent.analyze_by_rules(task_prompt)
+        if metrics_data is not None:
+            outcomes[task_prompt] = _metrics_outcome(metrics_data)
+        else:
+            pending.append(task_prompt)
+    
+    packs = [[pending[i] for i in pack] for pack in pack_task_descriptions(pending)]
+    if packs:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(packs)))) as executor:
+            for pack_outcomes in executor.map(_analyze_metrics_pack, packs):
+                outcomes.update(pack_outcomes)
+    
+    invalid = _metrics_outcome(error='task_prompt must be a non-empty string')
+    return [dict(outcomes.get(task, invalid)) if isinstance(task, str) else dict(invalid)
+            for task in task_prompts]
+
+
+def _analyze_metrics_pack(task_prompts):
+    '''
+    用一次模型请求分析一组任务描述；请求失败或响应中缺少某些任务时，这些任务再单独请求
+    '''
+    results = [None] * len(task_prompts)
+    if len(task_prompts) > 1:
+        try:
+            results = MetricsAnalyzerAgent(base_url, api_key, model).analyze_metrics_batch(task_prompts)
+        except Exception as e:
+            print(f'Batch metrics analysis failed, analyzing tasks one by one: {e}')
+    
+    outcomes = {}
+    for task_prompt, metrics_data in zip(task_prompts, results):
+        if metrics_data is None:
+            if len(task_prompts) > 1:
+                telemetry.registry.inc('deepseek_metrics_batch_fallback_total',
+                                       help='Batched metric analyses retried one by one')
+            try:
+                # 每次请求使用新的agent，避免对话历史相互影响；响应无法解析时作为该项的错误返回
+                metrics_data = MetricsAnalyzerAgent(base_url, api_key, model).analyze_metrics(
+                    task_prompt, rules=False, strict=True)
+            except Exception as e:
+                outcomes[task_prompt] = _metrics_outcome(error=str(e))
+                continue
+        outcomes[task_prompt] = _metrics_outcome(metrics_data)
+    return outcomes
+
+
+def _metrics_outcome(metrics_data=None, error=None):
+    return {'success': error is None, 'result': metrics_data, 'error': error}
+
+def response_cache_stats():
+    '''
+    获取LLM响应缓存的命中、未命中和淘汰计数
+
+    Returns:
+        stats: 缓存统计信息；未开启缓存时返回 {"enabled": False}
+    '''
+    cache = get_response_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+def telemetry_metrics(format: str = 'json'):
+    '''
+    获取本进程中LLM调用和各流程阶段的耗时、token用量统计（见telemetry.py）
+
+    Params:
+        format: 'json' 返回计数器和直方图的快照，'prometheus' 返回Prometheus文本格式
+
+    Returns:
+        metrics: dict 或 str
+    '''
+    if format == 'prometheus':
+        return telemetry.registry.render_prometheus()
+    return telemetry.registry.snapshot()
+
 def evaluate_instruction_following(solution: str, generated_code: str):
     """
     用大模型评估指令跟随能力四个维度
@@ -0,0 +1,210 @@
+"""
+deepseek_agent.api 的asyncio版本
+
+所有LLM调用都经过一个有界并发的调度器，单个进程可以同时保持大量生成请求在途，
+而不会无限制地向服务端发起连接。
+"""
+import asyncio
+import contextvars
+import os
+
+from .agent import AsyncWritterAgent, AsyncPlannerAgent, AsyncRefinerAgent, AsyncRevisorAgent, AsyncMetricsAnalyzerAgent
+from .agent.dependency import analyze_step_dependencies, dependency_closure
+from .agent.metrics_analyzer import pack_task_descriptions
+from . import api
+from . import telemetry
+
+
+# 占用调度器并发名额的任务。只有同一个任务中的嵌套提交不再重复占用（避免死锁）；
+# gather等创建的子任务会继承这个变量，但它们不是名额的持有者，仍需各自占用名额
+_slot_owner = contextvars.ContextVar('slot_owner', default=None)
+
+
+class AgentScheduler:
+    '''
+    有界并发调度器：同一时刻最多有max_concurrency个协程在执行
+    '''
+
+    def __init__(self, max_concurrency=32):
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._loop = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _get_semaphore(self):
+        # asyncio.Semaphore绑定在事件循环上，事件循环变化时重新创建
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    async def submit(self, func, *args, **kwargs):
+        '''
+        在并发上限内执行协程函数func(*args, **kwargs)并返回结果
+
+        func内部在同一个任务中再次submit时直接执行；func内部并发创建的子任务各自占用名额，
+        因此func不应在持有名额时等待大量子任务，否则名额耗尽后会互相等待
+        '''
+        task = asyncio.current_task()
+        if task is not None and _slot_owner.get() is task:
+            return await func(*args, **kwargs)
+
+        async with self._get_semaphore():
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            token = _slot_owner.set(task)
+            try:
+                result = await func(*args, **kwargs)
+                self.completed += 1
+                return result
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                _slot_owner.reset(token)
+                self.in_flight -= 1
+
+    async def map(self, func, args_list, return_exceptions=False):
+        '''
+        并发执行func(*args)，按args_list的顺序返回结果
+        '''
+        return await asyncio.gather(
+            *(self.submit(func, *args) for args in args_list),
+            return_exceptions=return_exceptions,
+        )
+
+    def stats(self):
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+
+scheduler = AgentScheduler(int(os.getenv('DEEPSEEK_MAX_CONCURRENCY', '32')))
+
+
+async def plan_for_machine_task(task_prompt: str, datasets: list = None):
+    '''
+    异步版本的 api.plan_for_machine_task
+    '''
+    agent = AsyncPlannerAgent(api.base_url, api.api_key, api.model)
+    plans, response = await scheduler.submit(agent.plan, task_prompt, api.dataset_schema(datasets))
+    return plans
+
+
+async def generate_current_step_code(task_prompt: str,
+                                     current_step: str,
+                                     step_id: int,
+                                     previous_code: str = None,
+                                     datasets: list = None):
+    '''
+    异步版本的 api.generate_current_step_code
+    '''
+    agent = AsyncWritterAgent(api.base_url, api.api_key, api.model)
+    return await scheduler.submit(agent.write_code, task_prompt, current_step, step_id, previous_code,
+                                  api.dataset_schema(datasets))
+
+
+async def generate_all_step_code(task_prompt: str,
+                                 plans: list,
+                                 dependencies: list = None,
+                                 datasets: list = None):
+    '''
+    异步版本的 api.generate_all_step_code，并发数由调度器限制
+    '''
+    if dependencies is None:
+        dependencies = analyze_step_dependencies(plans)
+
+    tasks = []
+
+    async def generate(index):
+        await asyncio.gather(*(tasks[dep - 1] for dep in dependencies[index]))
+        step_id = index + 1
+        previous_code = ''.join('\n\n' + tasks[dep - 1].result()
+                                for dep in dependency_closure(dependencies, step_id))
+        return await generate_current_step_code(task_prompt, plans[index], step_id, previous_code, datasets)
+
+    for index in range(len(plans)):
+        tasks.append(asyncio.ensure_future(generate(index)))
+    return list(await asyncio.gather(*tasks))
+
+
+async def refine_all_step_code(task_prompt: str,
+                               all_step_code: str):
+    '''
+    异步版本的 api.refine_all_step_code
+    '''
+    agent = AsyncRefinerAgent(api.base_url, api.api_key, api.model)
+    return await scheduler.submit(agent.refine, task_prompt, all_step_code)
+
+
+async def revise_code(task_prompt: str,
+                      code: str,
+                      error_log: str):
+    '''
+    异步版本的 api.revise_code
+    '''
+    agent = AsyncRevisorAgent(api.base_url, api.api_key, api.model)
+    return await scheduler.submit(agent.revise, task_prompt, code, error_log)
+
+
+async def analyze_task_metrics(task_prompt: str):
+    '''
+    异步版本的 api.analyze_task_metrics
+    '''
+    agent = AsyncMetricsAnalyzerAgent(api.base_url, api.api_key, api.model)
+    return await scheduler.submit(agent.analyze_metrics, task_prompt)
+
+
+async def analyze_task_metrics_batch(task_prompts: list):
+    '''
+    异步版本的 api.analyze_task_metrics_batch，各次模型请求的并发由调度器限制
+    '''
+    outcomes = {}
+    pending = []
+    agent = AsyncMetricsAnalyzerAgent(api.base_url, api.api_key, api.model)
+    for task_prompt in dict.fromkeys(task for task in task_prompts if isinstance(task, str) and task.strip()):
+        metrics_data = agent.analyze_by_rules(task_prompt)
+        if metrics_data is not None:
+            outcomes[task_prompt] = api._metrics_outcome(metrics_data)
+        else:
+            pending.append(task_prompt)
+    
+    packs = [[pending[i] for i in pack] for pack in pack_task_descriptions(pending)]
+    for pack_outcomes in await asyncio.gather(*(_analyze_metrics_pack(pack) for pack in packs)):
+        outcomes.update(pack_outcomes)
+    
+    invalid = api._metrics_outcome(error='task_prompt must be a non-empty string')
+    return [dict(outcomes.get(task, invalid)) if isinstance(task, str) else dict(invalid)
+            for task in task_prompts]
+
+
+async def _analyze_metrics_pack(task_prompts):
+    results = [None] * len(task_prompts)
+    if len(task_prompts) > 1:
+        try:
+            agent = AsyncMetricsAnalyzerAgent(api.base_url, api.api_key, api.model)
+            results = await scheduler.submit(agent.analyze_metrics_batch, task_prompts)
+        except Exception as e:
+            print(f'Batch metrics analysis failed, analyzing tasks one by one: {e}')
+    
+    async def analyze(task_prompt, metrics_data):
+        if metrics_data is None:
+            if len(task_prompts) > 1:
+                telemetry.registry.inc('deepseek_metrics_batch_fallback_total',
+                                       help='Batched metric analyses retried one by one')
+            try:
+                agent = AsyncMetricsAnalyzerAgent(api.base_url, api.api_key, api.model)
+                metrics_data = await scheduler.submit(agent.analyze_metrics, task_prompt, rules=False, strict=True)
+            except Exception as e:
+                return task_prompt, api._metrics_outcome(error=str(e))
+        return task_prompt, api._metrics_outcome(metrics_data)
+    
+    return dict(await asyncio.gather(*(analyze(task, data) for task, data in zip(task_prompts, results))))
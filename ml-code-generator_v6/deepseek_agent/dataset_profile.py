@@ -0,0 +1,358 @@
+"""
+数据集画像
+
+上传数据集时一次流式读取CSV（按块读取，不把整个文件读进内存），同时计算文件内容的SHA-256和画像：
+行数、列数、每列的类型、缺失率、不同取值数、取值示例、数值范围，以及可能的目标列。
+画像保存在索引目录中，以内容哈希为键（内容相同的文件只计算一次）；文件路径到内容哈希的映射按
+(路径, 大小, 修改时间) 保存，文件未变化时直接读出画像，数据集列表、预览和提示词都使用画像而不重新扫描文件。
+
+本模块只依赖标准库。
+"""
+import csv
+import hashlib
+import heapq
+import io
+import json
+import os
+import re
+import threading
+import time
+
+from . import CHECK_ROOT
+
+
+DATASET_PROFILE_DIR = os.path.abspath(os.getenv('DATASET_PROFILE_DIR', os.path.join(CHECK_ROOT, 'profiles')))
+
+PROFILE_VERSION = 1
+CHUNK_SIZE = 1024 * 1024
+HEAD_ROWS = 5
+SAMPLE_VALUES = 5
+# 不同取值数超过这个数时用KMV估计
+DISTINCT_SKETCH_SIZE = 1024
+
+NULL_VALUES = {'', 'na', 'nan', 'null', 'none', 'n/a', '?'}
+BOOL_VALUES = {'true', 'false'}
+DATETIME_PATTERN = re.compile(r'^\d{4}[-/]\d{1,2}[-/]\d{1,2}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?$')
+TARGET_NAMES = ('target', 'label', 'labels', 'class', 'y', 'survived', 'outcome', 'churn', 'is_fraud', 'price', 'saleprice')
+ID_NAMES = ('id', 'index', 'uuid', 'key')
+# 不同取值不超过这个数的列视为分类目标
+MAX_CLASSES = 50
+
+_HASH_RANGE = 2 ** 64
+
+
+class _HashingReader(io.RawIOBase):
+    '''
+    读取文件的同时计算SHA-256，供TextIOWrapper按块读取
+    '''
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self._f.readinto(buffer)
+        if n:
+            self.sha256.update(memoryview(buffer)[:n])
+        return n
+
+
+class _Column:
+    '''
+    单列的流式统计
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.nulls = 0
+        self.is_int = self.is_float = self.is_bool = self.is_datetime = True
+        self.minimum = self.maximum = None
+        self.total = 0.0
+        self.numeric = 0
+        self.samples = []
+        # KMV：保留最小的DISTINCT_SKETCH_SIZE个哈希值（取负数存入最大堆）
+        self._sketch = []
+        self._seen = set()
+
+    def add(self, value):
+        self.count += 1
+        value = value.strip()
+        if value.lower() in NULL_VALUES:
+            self.nulls += 1
+            return
+
+        if len(self.samples) < SAMPLE_VALUES and value not in self.samples:
+            self.samples.append(value)
+        self._add_distinct(value)
+
+        if self.is_int or self.is_float:
+            try:
+                number = int(value) if self.is_int else float(value)
+            except ValueError:
+                number = None
+                if self.is_int:
+                    self.is_int = False
+                    try:
+                        number = float(value)
+                    except ValueError:
+                        self.is_float = False
+                else:
+                    self.is_float = False
+            if number is not None:
+                self.numeric += 1
+                self.total += number
+                self.minimum = number if self.minimum is None else min(self.minimum, number)
+                self.maximum = number if self.maximum is None else max(self.maximum, number)
+        if self.is_bool and value.lower() not in BOOL_VALUES:
+            self.is_bool = False
+        if self.is_datetime and not DATETIME_PATTERN.match(value):
+            self.is_datetime = False
+
+    def _add_distinct(self, value):
+        h = hash(value) % _HASH_RANGE
+        if h in self._seen:
+            return
+        if len(self._sketch) < DISTINCT_SKETCH_SIZE:
+            heapq.heappush(self._sketch, -h)
+            self._seen.add(h)
+        elif h < -self._sketch[0]:
+            self._seen.discard(-heapq.heappushpop(self._sketch, -h))
+            self._seen.add(h)
+
+    @property
+    def distinct(self):
+        if len(self._sketch) < DISTINCT_SKETCH_SIZE:
+            return len(self._sketch), False
+        kth = -self._sketch[0] / _HASH_RANGE
+        return int((DISTINCT_SKETCH_SIZE - 1) / kth), True
+
+    @property
+    def dtype(self):
+        if self.count == self.nulls:
+            return 'empty'
+        if self.is_bool:
+            return 'bool'
+        if self.is_int:
+            return 'int'
+        if self.is_float:
+            return 'float'
+        if self.is_datetime:
+            return 'datetime'
+        return 'string'
+
+    def summary(self):
+        distinct, approximate = self.distinct
+        summary = {
+            'name': self.name,
+            'dtype': self.dtype,
+            'nulls': self.nulls,
+            'null_rate': round(self.nulls / self.count, 4) if self.count else 0.0,
+            'distinct': distinct,
+            'distinct_approx': approximate,
+            'samples': self.samples,
+        }
+        if self.dtype in ('int', 'float') and self.numeric:
+            summary.update(min=self.minimum, max=self.maximum, mean=round(self.total / self.numeric, 6))
+        return summary
+
+
+def profile_csv(path):
+    '''
+    流式读取path并计算画像
+
+    Returns:
+        (sha256, profile): profile为 {
+            "rows", "columns", "delimiter", "has_header", "header", "head": 前几行,
+            "column_profiles": [{"name", "dtype", "nulls", "null_rate", "distinct", "distinct_approx", "samples",
+                                 数值列还有 "min", "max", "mean"}],
+            "target_candidates": [{"column", "task": classification | regression, "reason"}],
+        }
+    '''
+    delimiter = '\t' if path.lower().endswith('.tsv') else ','
+    with open(path, 'rb', buffering=0) as raw:
+        reader = _HashingReader(raw)
+        text = io.TextIOWrapper(io.BufferedReader(reader, CHUNK_SIZE), encoding='utf-8',
+                                errors='replace', newline='')
+        rows = csv.reader(text, delimiter=delimiter)
+        header = next(rows, None) or []
+        columns = [_Column(name.strip()) for name in header]
+        head = []
+        count = 0
+        for row in rows:
+            if not row:
+                continue
+            count += 1
+            if len(head) < HEAD_ROWS:
+                head.append(row)
+            for column, value in zip(columns, row):
+                column.add(value)
+        # 读到文件末尾，哈希覆盖了全部内容
+        text.read()
+
+    # 数值列的列名也是数字时，第一行是数据而不是表头（需要 pd.read_csv(..., header=None) 读取）
+    has_header = not any(column.dtype in ('int', 'float') and _is_number(column.name) for column in columns)
+    if not has_header:
+        count += 1
+        head = [header] + head[:HEAD_ROWS - 1]
+        for i, (column, value) in enumerate(zip(columns, header)):
+            column.add(value)
+            column.name = f'column_{i}'
+
+    column_profiles = [column.summary() for column in columns]
+    profile = {
+        'version': PROFILE_VERSION,
+        'rows': count,
+        'columns': len(columns),
+        'delimiter': delimiter,
+        'has_header': has_header,
+        'header': [column.name for column in columns],
+        'head': head,
+        'column_profiles': column_profiles,
+        'target_candidates': target_candidates(column_profiles, count),
+    }
+    return reader.sha256.hexdigest(), profile
+
+
+def _is_number(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def target_candidates(column_profiles, rows):
+    '''
+    根据列名和取值分布推测目标列：名字像目标的列优先，其次是最后一列
+    '''
+    candidates = []
+    for position, column in enumerate(column_profiles):
+        name = column['name'].lower()
+        if column['dtype'] == 'empty' or name in ID_NAMES or name.endswith('_id'):
+            continue
+        if name in TARGET_NAMES:
+            reason = 'name'
+        elif position == len(column_profiles) - 1:
+            reason = 'last column'
+        else:
+            continue
+        # 每行取值都不同的列更像ID
+        if rows and column['distinct'] >= rows and column['dtype'] not in ('float',):
+            continue
+        if column['distinct'] <= MAX_CLASSES or column['dtype'] in ('string', 'bool'):
+            task = 'classification'
+        else:
+            task = 'regression'
+        candidates.append({'column': column['name'], 'task': task, 'reason': reason})
+    candidates.sort(key=lambda candidate: candidate['reason'] != 'name')
+    return candidates
+
+
+class DatasetIndex:
+    '''
+    数据集画像索引
+
+    Params:
+        root: 索引目录：profiles/<sha256>.json 保存画像，paths/<路径哈希>.json 保存路径到内容哈希的映射和上传信息
+    '''
+
+    def __init__(self, root=DATASET_PROFILE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def profile(self, path, sha256=None):
+        '''
+        返回path的画像，文件变化或还没有画像时流式读取一次并保存
+
+        Params:
+            sha256: 调用方已经算出的文件内容哈希（如上传时），这个内容已有画像时不再读取文件
+
+        Returns:
+            profile: 画像，另外带有 "sha256"、"size"、"path"
+        '''
+        profile = self.lookup(path)
+        if profile is not None:
+            return profile
+
+        real = os.path.realpath(path)
+        stat = os.stat(real)
+        profile = _read_json(self._profile_path(sha256)) if sha256 else None
+        if profile is None or profile.get('version') != PROFILE_VERSION:
+            sha256, profile = profile_csv(real)
+        profile_path = self._profile_path(sha256)
+        # 内容相同的文件已有画像时不覆盖，profiled_at保持为第一次计算的时间
+        existing = _read_json(profile_path)
+        if existing is None or existing.get('version') != PROFILE_VERSION:
+            profile['profiled_at'] = time.time()
+            _write_json(profile_path, profile)
+        else:
+            profile = existing
+
+        with self._lock:
+            entry = _read_json(self._path_entry(real)) or {}
+            entry.update(path=real, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256)
+            _write_json(self._path_entry(real), entry)
+        return {**profile, 'sha256': sha256, 'size': stat.st_size, 'path': real}
+
+    def lookup(self, path):
+        '''
+        只读索引取出path的画像，文件变化或没有画像时返回None（不读取文件内容）
+        '''
+        real = os.path.realpath(path)
+        try:
+            stat = os.stat(real)
+        except OSError:
+            return None
+        entry = _read_json(self._path_entry(real))
+        if entry is None or 'sha256' not in entry \
+                or entry.get('size') != stat.st_size or entry.get('mtime_ns') != stat.st_mtime_ns:
+            return None
+        profile = _read_json(self._profile_path(entry['sha256']))
+        if profile is None or profile.get('version') != PROFILE_VERSION:
+            return None
+        return {**profile, 'sha256': entry['sha256'], 'size': stat.st_size, 'path': real}
+
+    def set_info(self, path, **info):
+        '''
+        保存上传时的附加信息（类型、描述等），与画像一起在列表中返回
+        '''
+        real = os.path.realpath(path)
+        with self._lock:
+            entry = _read_json(self._path_entry(real)) or {'path': real}
+            entry.setdefault('info', {}).update(info)
+            _write_json(self._path_entry(real), entry)
+
+    def info(self, path):
+        entry = _read_json(self._path_entry(os.path.realpath(path)))
+        return (entry or {}).get('info', {})
+
+    def _profile_path(self, sha256):
+        return os.path.join(self.root, 'profiles', sha256 + '.json')
+
+    def _path_entry(self, real):
+        name = hashlib.sha1(real.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.root, 'paths', name + '.json')
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    # 先写临时文件再替换，多个进程同时写同一个文件时读到的总是完整的JSON
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+dataset_index = DatasetIndex()
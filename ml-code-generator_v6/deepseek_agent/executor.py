@@ -0,0 +1,252 @@
+"""
+生成代码的执行引擎
+
+在独立的进程组中执行命令，并限制资源：
+    - 墙钟超时：超时后杀掉整个进程组（包括代码中启动的子进程）
+    - 可选的CPU时间（RLIMIT_CPU）和地址空间（RLIMIT_AS）上限，默认不开启，平台不支持时忽略。
+      地址空间上限限制的是虚拟内存（包括未实际使用的映射），不是RSS：numpy/torch等会预留大量虚拟内存，
+      设置过低时代码在启动阶段就会失败；CPU时间是所有线程累计的时间，多线程训练会比墙钟时间增长得快
+    - stdout/stderr只保留开头和结尾各一半，超出部分截断，不会把全部输出读进内存
+    - POSIX平台用selectors读取管道，Windows上select不支持管道，改用读取线程
+返回结构化的结果：退出码、耗时、峰值内存、截断后的日志。
+"""
+import os
+import selectors
+import signal
+import subprocess
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+EXEC_TIMEOUT = float(os.getenv('CHECK_TIMEOUT', '600'))
+# 0表示不限制（默认），只有墙钟超时生效
+EXEC_CPU_TIME = int(os.getenv('CHECK_CPU_TIME', '0'))
+EXEC_MEMORY_LIMIT_MB = int(os.getenv('CHECK_MEMORY_LIMIT_MB', '0'))
+EXEC_MAX_OUTPUT_BYTES = int(os.getenv('CHECK_MAX_OUTPUT_BYTES', str(1024 * 1024)))
+
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class _CappedBuffer:
+    '''
+    只保留输出开头和结尾各limit/2字节的缓冲区
+    '''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+        half = self.limit // 2
+        room = half - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > half:
+                del self.tail[:len(self.tail) - half]
+
+    @property
+    def truncated(self):
+        return self.total > len(self.head) + len(self.tail)
+
+    def getvalue(self):
+        text = self.head.decode('utf-8', errors='replace')
+        if self.truncated:
+            skipped = self.total - len(self.head) - len(self.tail)
+            text += f'\n... [{skipped} bytes truncated] ...\n'
+        return text + self.tail.decode('utf-8', errors='replace')
+
+
+def _limit_resources(cpu_time, memory_limit_mb):
+    def preexec():
+        if cpu_time:
+            # 软限制到达时收到SIGXCPU，留1秒余量再由硬限制强制结束
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_time, cpu_time + 1))
+        if memory_limit_mb:
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    return preexec
+
+
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        process.kill()
+
+
+def _wait(process):
+    # wait4可以同时拿到子进程的资源使用情况（峰值内存、CPU时间）
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return usage
+    process.wait()
+    return None
+
+
+# select只能在POSIX平台上等待管道，其他平台（Windows）用线程读取
+_SELECT_PIPES = os.name == 'posix'
+
+
+def _read_selector(process, buffers, deadline, cancel_event):
+    '''
+    用selectors同时读取stdout和stderr，直到两者都关闭、超时或被取消
+
+    Returns:
+        (timed_out, cancelled)
+    '''
+    with selectors.DefaultSelector() as selector:
+        for stream in buffers:
+            selector.register(stream, selectors.EVENT_READ)
+
+        while selector.get_map():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                _kill_group(process)
+                return True, False
+            if cancel_event is not None:
+                if cancel_event.is_set():
+                    _kill_group(process)
+                    return False, True
+                # 定期醒来检查取消信号
+                remaining = CANCEL_POLL_INTERVAL if remaining is None else min(remaining, CANCEL_POLL_INTERVAL)
+            for key, _ in selector.select(remaining):
+                data = os.read(key.fileobj.fileno(), 65536)
+                if data:
+                    buffers[key.fileobj].write(data)
+                else:
+                    selector.unregister(key.fileobj)
+    return False, False
+
+
+def _read_threads(process, buffers, deadline, cancel_event):
+    '''
+    每个管道一个线程读取，主线程负责超时和取消，与_read_selector返回相同
+    '''
+    def pump(stream, buffer):
+        for data in iter(lambda: stream.read1(65536), b''):
+            buffer.write(data)
+
+    threads = [threading.Thread(target=pump, args=item, daemon=True) for item in buffers.items()]
+    for thread in threads:
+        thread.start()
+
+    timed_out = cancelled = False
+    for thread in threads:
+        while thread.is_alive():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                timed_out = True
+            elif cancel_event is not None and cancel_event.is_set():
+                cancelled = True
+            if timed_out or cancelled:
+                _kill_group(process)
+                # 代码启动的子进程可能继承了管道而没有被杀掉，不无限等待读取线程
+                for t in threads:
+                    t.join(CANCEL_POLL_INTERVAL)
+                return timed_out, cancelled
+            thread.join(CANCEL_POLL_INTERVAL if remaining is None else min(remaining, CANCEL_POLL_INTERVAL))
+    return False, False
+
+
+def execute(args,
+            cwd=None,
+            timeout=EXEC_TIMEOUT,
+            cpu_time=EXEC_CPU_TIME,
+            memory_limit_mb=EXEC_MEMORY_LIMIT_MB,
+            max_output_bytes=EXEC_MAX_OUTPUT_BYTES,
+            env=None,
+            cancel_event=None):
+    '''
+    在资源限制下执行命令（不经过shell）
+
+    Params:
+        args: 命令及参数列表，如 [sys.executable, 'check_this.py']
+        cwd: 工作目录
+        timeout: 墙钟超时（秒），None或0表示不限制
+        cpu_time: CPU时间上限（秒），0表示不限制
+        memory_limit_mb: 地址空间上限（MB），0表示不限制
+        max_output_bytes: stdout和stderr各自最多保留的字节数
+        cancel_event: 可选的threading.Event，被设置后立即杀掉整个进程组
+
+    Returns:
+        result: {
+            "success": 退出码是否为0,
+            "exit_code": 退出码，被信号杀掉时为负的信号值,
+            "timed_out": 是否因墙钟超时被杀掉,
+            "cancelled": 是否因cancel_event被杀掉,
+            "duration": 墙钟耗时（秒）,
+            "cpu_time": 用户态+内核态CPU时间（秒），平台不支持时为None,
+            "peak_rss_kb": 峰值常驻内存（KB），平台不支持时为None,
+            "stdout"/"stderr": 截断后的输出,
+            "stdout_truncated"/"stderr_truncated": 输出是否被截断,
+        }
+    '''
+    preexec_fn = None
+    if resource is not None and (cpu_time or memory_limit_mb):
+        preexec_fn = _limit_resources(cpu_time, memory_limit_mb)
+
+    started = time.monotonic()
+    process = subprocess.Popen(
+        args,
+        cwd=cwd,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+        preexec_fn=preexec_fn,
+    )
+
+    buffers = {
+        process.stdout: _CappedBuffer(max_output_bytes),
+        process.stderr: _CappedBuffer(max_output_bytes),
+    }
+    deadline = started + timeout if timeout else None
+    read = _read_selector if _SELECT_PIPES else _read_threads
+    timed_out, cancelled = read(process, buffers, deadline, cancel_event)
+
+    # 进程退出后，代码中启动的后台子进程可能还在同一进程组中运行
+    _kill_group(process)
+    usage = _wait(process)
+    duration = time.monotonic() - started
+    process.stdout.close()
+    process.stderr.close()
+
+    stdout, stderr = buffers[process.stdout], buffers[process.stderr]
+    stderr_text = stderr.getvalue()
+    if timed_out:
+        stderr_text += f'\nTimeoutError: execution did not finish within {timeout} seconds\n'
+    elif cancelled:
+        stderr_text += '\nExecution was cancelled\n'
+    elif process.returncode < 0:
+        signum = -process.returncode
+        if signum == getattr(signal, 'SIGXCPU', None):
+            stderr_text += f'\nTimeoutError: CPU time limit of {cpu_time} seconds exceeded\n'
+        else:
+            stderr_text += f'\nProcess was killed by signal {signum}\n'
+
+    return {
+        'success': process.returncode == 0 and not timed_out and not cancelled,
+        'exit_code': process.returncode,
+        'timed_out': timed_out,
+        'cancelled': cancelled,
+        'duration': round(duration, 3),
+        'cpu_time': round(usage.ru_utime + usage.ru_stime, 3) if usage else None,
+        'peak_rss_kb': usage.ru_maxrss if usage else None,
+        'stdout': stdout.getvalue(),
+        'stderr': stderr_text,
+        'stdout_truncated': stdout.truncated,
+        'stderr_truncated': stderr.truncated,
+    }
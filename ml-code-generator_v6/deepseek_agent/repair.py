@@ -0,0 +1,155 @@
+"""
+多候选并行修正
+
+代码执行失败后，同时向模型请求多个候选修正（使用不同的temperature），每个候选一生成出来就立即在独立的沙箱中执行，
+第一个执行通过的候选胜出，其余还在执行的候选被杀掉、还没开始的被取消。
+一轮中所有候选都失败时，以执行时间最长（通常意味着运行到了更靠后的位置）的候选和它的错误信息作为下一轮的输入，
+最多进行max_rounds轮。
+
+本模块不依赖具体的模型和执行方式：生成候选和执行候选都由调用方以函数传入（见api.repair_code）。
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+REPAIR_CANDIDATES = int(os.getenv('REPAIR_CANDIDATES', '3'))
+REPAIR_MAX_ROUNDS = int(os.getenv('REPAIR_MAX_ROUNDS', '2'))
+REPAIR_TEMPERATURES = [float(t) for t in os.getenv('REPAIR_TEMPERATURES', '0.2,0.5,0.8').split(',') if t.strip()]
+
+POLL_INTERVAL = 0.1
+
+logger = logging.getLogger(__name__)
+
+
+def candidate_temperatures(candidates, temperatures=None):
+    '''
+    为每个候选分配temperature，候选数多于temperature列表时循环使用
+    '''
+    temperatures = temperatures or REPAIR_TEMPERATURES or [0.5]
+    return [temperatures[i % len(temperatures)] for i in range(candidates)]
+
+
+def repair(code,
+           error_log,
+           generate_candidate,
+           run_candidate,
+           candidates=None,
+           max_rounds=None,
+           temperatures=None,
+           cancel_event=None,
+           on_candidate=None):
+    '''
+    多轮、多候选并行修正
+
+    Params:
+        code: 执行失败的代码
+        error_log: 错误信息
+        generate_candidate: generate_candidate(code, error_log, temperature) -> 修正后的代码
+        run_candidate: run_candidate(code, stop_event, claim) -> {"success", "stderr", "duration", ...}
+                       stop_event被设置时应尽快结束执行；执行成功后调用claim()，只有第一个成功的候选得到True，
+                       可据此只让胜出的候选产生副作用（如把输出文件拷回数据目录）
+        candidates: 每轮的候选数
+        max_rounds: 最多修正轮数
+        temperatures: 候选使用的temperature列表
+        cancel_event: 被设置后停止修正，返回结果中cancelled为True
+        on_candidate: 每个候选执行结束后调用 on_candidate(round, index, temperature, result)
+
+    Returns:
+        result: {
+            "success": 是否得到能执行通过的代码,
+            "code": 胜出的代码；都失败时为最后一轮中执行时间最长的候选,
+            "stderr": 胜出时为None，否则为上述候选的错误信息,
+            "rounds": 进行的轮数, "attempts": 执行过的候选数,
+            "winner": {"round", "index", "temperature"} 或 None,
+            "cancelled": 是否被cancel_event取消,
+        }
+    '''
+    candidates = max(1, candidates or REPAIR_CANDIDATES)
+    max_rounds = max(1, max_rounds or REPAIR_MAX_ROUNDS)
+    temps = candidate_temperatures(candidates, temperatures)
+
+    attempts = 0
+    for round_id in range(1, max_rounds + 1):
+        outcome = _repair_round(round_id, code, error_log, temps, generate_candidate, run_candidate,
+                                cancel_event, on_candidate)
+        attempts += outcome['attempts']
+        result = {'rounds': round_id, 'attempts': attempts, 'cancelled': outcome['cancelled']}
+
+        if outcome['winner'] is not None:
+            index, candidate = outcome['winner']
+            return {**result, 'success': True, 'code': candidate, 'stderr': None,
+                    'winner': {'round': round_id, 'index': index, 'temperature': temps[index]}}
+        if outcome['cancelled']:
+            return {**result, 'success': False, 'code': code, 'stderr': error_log, 'winner': None}
+
+        if outcome['failures']:
+            # 执行时间最长的候选通常运行到了更靠后的位置，以它作为下一轮修正的起点
+            _, candidate, failed = max(outcome['failures'], key=lambda f: f[2].get('duration') or 0)
+            code, error_log = candidate, failed['stderr']
+
+    return {'rounds': max_rounds, 'attempts': attempts, 'cancelled': False,
+            'success': False, 'code': code, 'stderr': error_log, 'winner': None}
+
+
+def _repair_round(round_id, code, error_log, temps, generate_candidate, run_candidate, cancel_event, on_candidate):
+    stop = threading.Event()
+    lock = threading.Lock()
+    winner = []
+    codes = {}
+    failures = []
+    attempts = 0
+
+    def claim(index):
+        with lock:
+            if not winner:
+                winner.append(index)
+            return winner[0] == index
+
+    # 生成和执行共用一个线程池：每个候选生成完立即提交执行，不等其他候选
+    executor = ThreadPoolExecutor(max_workers=2 * len(temps), thread_name_prefix='repair')
+    pending = {}
+    try:
+        for index, temperature in enumerate(temps):
+            pending[executor.submit(generate_candidate, code, error_log, temperature)] = ('generate', index)
+
+        while pending:
+            done, _ = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                return {'winner': None, 'failures': failures, 'attempts': attempts, 'cancelled': True}
+
+            for future in done:
+                kind, index = pending.pop(future)
+                if kind == 'generate':
+                    try:
+                        codes[index] = future.result()
+                    except Exception as e:
+                        logger.warning('Repair candidate %d of round %d could not be generated: %s', index, round_id, e)
+                        continue
+                    pending[executor.submit(run_candidate, codes[index], stop, lambda i=index: claim(i))] = ('run', index)
+                    continue
+
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'success': False, 'stderr': f'{type(e).__name__}: {e}'}
+                if result.get('cancelled'):
+                    # 其他候选已经胜出，被杀掉的不算一次尝试
+                    continue
+                attempts += 1
+                if on_candidate is not None:
+                    on_candidate(round_id, index, temps[index], result)
+
+                if result['success'] and claim(index):
+                    stop.set()
+                    return {'winner': (index, codes[index]), 'failures': failures,
+                            'attempts': attempts, 'cancelled': False}
+                if not result['success']:
+                    failures.append((index, codes[index], result))
+
+        return {'winner': None, 'failures': failures, 'attempts': attempts, 'cancelled': False}
+    finally:
+        stop.set()
+        # 不等待还在进行中的模型请求，它们的结果直接丢弃
+        executor.shutdown(wait=False, cancel_futures=True)
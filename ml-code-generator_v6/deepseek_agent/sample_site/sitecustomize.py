@@ -0,0 +1,50 @@
+"""
+检查代码时把数据集的读取重定向到抽样后的文件（见deepseek_agent/sampling.py）
+
+检查进程的PYTHONPATH中包含本目录，解释器启动时自动加载本模块，替换内置的open：
+以只读方式打开的 .csv / .tsv 文件如果在重定向表中，改为打开对应的样本文件。
+重定向表是环境变量CHECK_SAMPLE_REDIRECTS指向的JSON文件，文件变化后重新读取（增量检查的常驻进程中表会更新）。
+本模块只依赖标准库。
+"""
+import builtins
+import io
+import json
+import os
+
+
+def _install():
+    redirects_file = os.environ.get('CHECK_SAMPLE_REDIRECTS')
+    if not redirects_file:
+        return
+
+    original_open = builtins.open
+    suffixes = ('.csv', '.tsv')
+    state = {'version': None, 'redirects': {}}
+
+    def load():
+        try:
+            stat = os.stat(redirects_file)
+        except OSError:
+            return {}
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version != state['version']:
+            try:
+                with original_open(redirects_file, 'r', encoding='utf-8') as f:
+                    state['redirects'] = json.load(f)
+            except (OSError, ValueError):
+                state['redirects'] = {}
+            state['version'] = version
+        return state['redirects']
+
+    def open(file, mode='r', *args, **kwargs):
+        if isinstance(file, (str, os.PathLike)) and not any(flag in mode for flag in 'wax+'):
+            path = os.fspath(file)
+            if isinstance(path, str) and path.lower().endswith(suffixes):
+                file = load().get(os.path.realpath(path), file)
+        return original_open(file, mode, *args, **kwargs)
+
+    builtins.open = io.open = open
+
+
+_install()
+del _install
@@ -0,0 +1,274 @@
+"""
+检查代码时使用的数据集样本
+
+检查（包括修正候选的执行和增量检查）只是为了尽快发现运行错误，不需要在完整的数据集上训练。
+检查前找出代码会读取的较大的数据集（代码中以字符串写出的数据集路径，以及任务指定的数据集），
+为每个数据集生成一个样本文件：有目标列（target、label等）时按目标列分层抽样，否则取开头的若干行
+（测试集和提交样例的行保持对应）。样本按文件内容的哈希、抽样方式和行数缓存在CHECK_SAMPLE_DIR中，
+每次使用时更新访问时间，Flask的存储清理不会删除其他进程（如Node的Python工作进程）正在使用的样本。
+
+代码本身不做修改：检查进程通过sample_site/sitecustomize.py替换内置的open，把对原数据集的读取重定向到样本，
+pd.read_csv等读取函数因此读到的是样本。最终代码仍在完整数据上执行（见api.run）。
+"""
+import ast
+import csv
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from . import CHECK_ROOT
+from .dataset_profile import TARGET_NAMES
+
+
+CHECK_SAMPLE_ROWS = int(os.getenv('CHECK_SAMPLE_ROWS', '2000'))
+CHECK_SAMPLE_MODE = os.getenv('CHECK_SAMPLE_MODE', 'stratified')
+CHECK_SAMPLE_MIN_BYTES = int(os.getenv('CHECK_SAMPLE_MIN_BYTES', str(1024 * 1024)))
+CHECK_SAMPLE_DIR = os.path.abspath(os.getenv('CHECK_SAMPLE_DIR', os.path.join(CHECK_ROOT, 'samples')))
+CHECK_SAMPLE_TARGET = os.getenv('CHECK_SAMPLE_TARGET', '')
+
+SAMPLE_SITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_site')
+DATA_EXTENSIONS = ('.csv', '.tsv')
+
+# 不同取值超过这个数时不是分类目标，不做分层
+MAX_STRATA = 100
+# 每个类别至少保留的行数，保证分层划分训练集/测试集时不出错
+MIN_PER_CLASS = 2
+
+_digests = {}
+_build_lock = threading.Lock()
+
+
+def enabled():
+    return CHECK_SAMPLE_ROWS > 0
+
+
+def sample_redirects(code, folder, datasets=None):
+    '''
+    为code在folder中执行时会读取的数据集生成样本：代码中以字符串写出的数据集路径，以及调用方给出的数据集。
+    目录中的其他文件（如共享上传目录中其他任务的数据集）不做抽样
+
+    Params:
+        datasets: 任务使用的数据集路径，代码通过拼接等方式得到路径、字符串中看不出来时由它补充
+
+    Returns:
+        redirects: {原数据集的真实路径: 样本文件的绝对路径}，没有需要抽样的数据集时为空
+    '''
+    if not enabled():
+        return {}
+
+    candidates = {path for path in datasets or [] if os.path.isfile(path)}
+    for literal in _path_literals(code):
+        path = literal if os.path.isabs(literal) else os.path.join(folder, literal)
+        if not os.path.isfile(path):
+            # f-string等拼接出的路径只能看到文件名部分
+            path = os.path.join(folder, os.path.basename(literal))
+        if os.path.isfile(path):
+            candidates.add(path)
+
+    redirects = {}
+    for path in candidates:
+        real = os.path.realpath(path)
+        if os.path.getsize(real) < CHECK_SAMPLE_MIN_BYTES:
+            continue
+        sample = sample_file(real)
+        if sample is not None:
+            redirects[real] = sample
+    return redirects
+
+
+def sample_file(path, rows=None, mode=None):
+    '''
+    生成（或从缓存中取出）path的样本
+
+    Params:
+        rows: 样本行数，默认CHECK_SAMPLE_ROWS
+        mode: stratified（有目标列时分层抽样，否则取开头） | head（取开头）
+
+    Returns:
+        sample_path: 样本文件的绝对路径；数据集本身不超过rows行时为None
+    '''
+    rows = rows or CHECK_SAMPLE_ROWS
+    mode = mode or CHECK_SAMPLE_MODE
+    extension = os.path.splitext(path)[1].lower()
+    name = f'{_file_digest(path)[:24]}-{mode}-{rows}'
+    sample_path = os.path.abspath(os.path.join(CHECK_SAMPLE_DIR, name + extension))
+    # 数据集不需要抽样时留下一个空的标记文件
+    small_marker = os.path.abspath(os.path.join(CHECK_SAMPLE_DIR, name + '.full'))
+
+    with _build_lock:
+        if os.path.exists(sample_path):
+            _touch(sample_path)
+            return sample_path
+        if os.path.exists(small_marker):
+            return None
+
+        os.makedirs(CHECK_SAMPLE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CHECK_SAMPLE_DIR, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', errors='surrogateescape', newline='') as out:
+                sampled = _write_sample(path, out, rows, mode, '\t' if extension == '.tsv' else ',')
+            if sampled:
+                os.replace(tmp_path, sample_path)
+                return sample_path
+            open(small_marker, 'w').close()
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def write_redirects(path, redirects):
+    '''
+    原子地写入重定向表（检查进程在文件变化后重新读取）
+    '''
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(redirects, f)
+    os.replace(tmp_path, path)
+
+
+def sample_env(redirects_file, env=None):
+    '''
+    检查进程的环境变量：加载sample_site中的sitecustomize，并指定重定向表
+    '''
+    env = dict(os.environ if env is None else env)
+    pythonpath = env.get('PYTHONPATH')
+    env['PYTHONPATH'] = SAMPLE_SITE + (os.pathsep + pythonpath if pythonpath else '')
+    env['CHECK_SAMPLE_REDIRECTS'] = os.path.abspath(redirects_file)
+    return env
+
+
+@contextmanager
+def redirected(redirects):
+    '''
+    with redirected(redirects) as env: 在env下执行的进程读取的是样本，离开时删除重定向表
+    '''
+    os.makedirs(CHECK_SAMPLE_DIR, exist_ok=True)
+    redirects_file = os.path.join(CHECK_SAMPLE_DIR, f'redirects-{uuid.uuid4().hex}.json')
+    write_redirects(redirects_file, redirects)
+    try:
+        yield sample_env(redirects_file)
+    finally:
+        os.remove(redirects_file)
+
+
+def _path_literals(code):
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return []
+    return [node.value for node in ast.walk(tree)
+            if isinstance(node, ast.Constant) and isinstance(node.value, str)
+            and node.value.lower().endswith(DATA_EXTENSIONS) and '\n' not in node.value]
+
+
+def _touch(path):
+    # 显式更新访问时间（noatime挂载时读取不会更新），存储清理按最后一次访问时间淘汰样本
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+
+def _file_digest(path):
+    # 按文件内容缓存，同一文件未修改时不重复计算
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    digest = _digests.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        digest = _digests[key] = sha.hexdigest()
+    return digest
+
+
+def _target_column(header):
+    names = [CHECK_SAMPLE_TARGET.lower()] if CHECK_SAMPLE_TARGET else TARGET_NAMES
+    lowered = [column.strip().lower() for column in header]
+    for name in names:
+        if name in lowered:
+            return lowered.index(name)
+    return None
+
+
+def _write_sample(path, out, rows, mode, delimiter):
+    '''
+    把path的样本写入out
+
+    Returns:
+        sampled: 数据集超过rows行、确实写入了样本时为True
+    '''
+    with open(path, 'r', encoding='utf-8', errors='surrogateescape', newline='') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        writer = csv.writer(out, delimiter=delimiter, lineterminator='\n')
+        header = next(reader, None)
+        if header is None:
+            return False
+
+        target = _target_column(header) if mode == 'stratified' else None
+        if target is not None:
+            selected = _stratified(reader, target, rows)
+            if selected is not None:
+                if len(selected) == 0:
+                    return False
+                writer.writerow(header)
+                writer.writerows(selected)
+                return True
+            # 目标列取值太多，不是分类目标，改为取开头
+            f.seek(0)
+            next(reader)
+
+        selected = []
+        for row in reader:
+            if len(selected) == rows:
+                writer.writerow(header)
+                writer.writerows(selected)
+                return True
+            selected.append(row)
+        return False
+
+
+def _stratified(reader, target, rows):
+    '''
+    按目标列分层抽样：一次遍历，每个类别各保留一个容量为rows的蓄水池，结束后按各类别的比例取样，保持原来的行顺序
+
+    Returns:
+        selected: 抽样的行；数据集不超过rows行时为空列表；类别数超过MAX_STRATA时为None
+    '''
+    rng = random.Random(0)
+    counts = {}
+    reservoirs = {}
+    total = 0
+    for index, row in enumerate(reader):
+        total += 1
+        label = row[target] if target < len(row) else ''
+        count = counts.get(label, 0) + 1
+        counts[label] = count
+        if count == 1 and len(counts) > MAX_STRATA:
+            return None
+        reservoir = reservoirs.setdefault(label, [])
+        if len(reservoir) < rows:
+            reservoir.append((index, row))
+        else:
+            slot = rng.randrange(count)
+            if slot < rows:
+                reservoir[slot] = (index, row)
+
+    if total <= rows:
+        return []
+
+    selected = []
+    for label, count in counts.items():
+        quota = max(min(MIN_PER_CLASS, count), round(rows * count / total))
+        reservoir = reservoirs[label]
+        selected.extend(rng.sample(reservoir, min(quota, len(reservoir))))
+    selected.sort(key=lambda item: item[0])
+    return [row for _, row in selected]
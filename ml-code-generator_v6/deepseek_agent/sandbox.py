@@ -0,0 +1,129 @@
+"""
+代码检查沙箱目录池
+
+每次检查在独立的沙箱目录中执行，并发的检查不会互相覆盖代码文件、读到对方的错误信息。
+沙箱目录预先创建并重复使用：归还时清空目录内容，而不是每次新建再删除。
+"""
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from . import CHECK_ROOT
+
+
+SANDBOX_ROOT = os.getenv('CHECK_SANDBOX_ROOT', os.path.join(CHECK_ROOT, 'sandboxes'))
+SANDBOX_POOL_SIZE = int(os.getenv('CHECK_SANDBOX_POOL_SIZE', str(os.cpu_count() or 1)))
+
+
+class SandboxPool:
+    '''
+    预先创建的沙箱目录池
+
+    Params:
+        root: 沙箱目录的父目录
+        size: 沙箱数量，即同时进行的检查数上限；池中没有空闲沙箱时acquire会阻塞等待
+    '''
+
+    def __init__(self, root=SANDBOX_ROOT, size=SANDBOX_POOL_SIZE):
+        self.root = os.path.abspath(root)
+        self.size = max(int(size), 1)
+        self._idle = []
+        self._all = set()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def acquire(self, timeout=None):
+        '''
+        取出一个空的沙箱目录
+
+        Returns:
+            path: 沙箱目录的绝对路径
+        '''
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Sandbox pool is closed')
+            if not self._all:
+                self._fill()
+
+            if not self._condition.wait_for(lambda: self._idle, timeout=timeout):
+                raise TimeoutError(f'No sandbox became available within {timeout} seconds')
+            return self._idle.pop()
+
+    def release(self, path):
+        '''
+        清空沙箱目录并放回池中；清理失败的目录直接丢弃，换一个新目录补上
+        '''
+        try:
+            _clear_directory(path)
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True)
+            with self._condition:
+                self._all.discard(path)
+                path = None if self._closed else self._create()
+
+        with self._condition:
+            if path is None:
+                return
+            if self._closed:
+                shutil.rmtree(path, ignore_errors=True)
+                return
+            self._idle.append(path)
+            self._condition.notify()
+
+    @contextmanager
+    def sandbox(self, timeout=None):
+        '''
+        with pool.sandbox() as folder: ... 离开时自动清理并归还
+        '''
+        path = self.acquire(timeout)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'root': self.root,
+                'size': self.size,
+                'idle': len(self._idle),
+                'in_use': len(self._all) - len(self._idle),
+            }
+
+    def close(self):
+        '''
+        删除所有沙箱目录，正在使用的沙箱在归还时删除
+        '''
+        with self._condition:
+            self._closed = True
+            for path in self._idle:
+                shutil.rmtree(path, ignore_errors=True)
+                self._all.discard(path)
+            self._idle.clear()
+
+    def _fill(self):
+        os.makedirs(self.root, exist_ok=True)
+        while len(self._all) < self.size:
+            self._idle.append(self._create())
+
+    def _create(self):
+        # 目录名带随机后缀，多个工作进程共用同一个root时也不会冲突
+        path = tempfile.mkdtemp(prefix=f'sandbox_{os.getpid()}_', dir=self.root)
+        self._all.add(path)
+        return path
+
+
+def _clear_directory(path):
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+
+sandbox_pool = SandboxPool()
+atexit.register(sandbox_pool.close)
@@ -0,0 +1,216 @@
+"""
+代码检查前的静态预检
+
+在启动解释器执行代码之前，先用很小的代价排除明显会失败的代码：
+    - 语法错误：compile() 编译整段代码
+    - 未定义的名字：代码（以及之前步骤的代码）中任何地方都没有绑定过、也不是内置名字的名字
+    - 缺失的模块：模块级的import用 importlib.util.find_spec 查找顶层包，结果缓存
+预检失败时直接返回与执行失败相同格式的结果，错误信息交给RevisorAgent修正，不再执行代码。
+
+名字分析只做保守判断：不考虑作用域和定义顺序，只要名字在任何地方被绑定过就认为已定义；
+代码中有 from x import *、exec、eval、globals() 等动态手段时跳过名字分析。宁可漏报，不能误报。
+"""
+import ast
+import builtins
+import importlib
+import importlib.util
+import os
+import traceback
+
+
+STATIC_CHECK = os.getenv('CHECK_STATIC', '1') != '0'
+
+# 模块执行时就存在的全局名字
+MODULE_NAMES = {'__name__', '__file__', '__doc__', '__builtins__', '__spec__', '__loader__',
+                '__package__', '__annotations__', '__cached__'}
+BUILTIN_NAMES = set(dir(builtins)) | MODULE_NAMES
+
+# 出现这些调用时名字可能被动态定义，跳过名字分析
+DYNAMIC_NAMES = {'exec', 'eval', 'globals', 'locals', 'vars', '__import__', 'get_ipython'}
+
+# try块中的代码出错会被这些异常处理捕获
+CATCH_ALL = {'Exception', 'BaseException', 'ImportError', 'ModuleNotFoundError', 'NameError'}
+
+
+def static_check(code, previous_code='', filename='<string>', search_paths=(), check_names=True):
+    '''
+    静态预检代码
+
+    Params:
+        code: 要检查的代码
+        previous_code: 之前步骤的代码，其中绑定的名字视为已定义（增量检查时使用）
+        filename: 错误信息中显示的文件名
+        search_paths: 除sys.path外查找模块的目录（如代码运行时的工作目录中的本地模块）
+        check_names: 为False时跳过未定义名字的检查（无法得知之前步骤定义了哪些名字时）
+
+    Returns:
+        result: {"success": bool, "stderr": str | None, "static": True}
+    '''
+    try:
+        tree = ast.parse(code, filename)
+        # 编译AST还能发现parse不报错的问题，如函数外的return
+        compile(tree, filename, 'exec')
+    except (SyntaxError, ValueError) as e:
+        return _failure(''.join(traceback.format_exception_only(type(e), e)))
+
+    missing = _missing_import(tree, search_paths)
+    if missing is not None:
+        node, name = missing
+        return _failure(_format_error(code, filename, node, 'ModuleNotFoundError', f'No module named {name!r}'))
+
+    if check_names:
+        undefined = _undefined_name(tree, previous_code)
+        if undefined is not None:
+            return _failure(_format_error(code, filename, undefined, 'NameError',
+                                          f'name {undefined.id!r} is not defined'))
+
+    return {'success': True, 'stderr': None, 'static': True}
+
+
+def clear_import_cache():
+    '''
+    清空模块查找的缓存（安装了新的包之后调用）
+    '''
+    _found_modules.clear()
+    importlib.invalidate_caches()
+
+
+# 只缓存找到的模块：进程运行期间可能安装新的包，找不到的模块每次重新查找
+_found_modules = set()
+
+
+def _find_module(name):
+    if name in _found_modules:
+        return True
+    try:
+        found = importlib.util.find_spec(name) is not None
+        if not found:
+            # 查找器会缓存目录列表，刷新后再确认一次，避免刚安装的包被拒绝
+            importlib.invalidate_caches()
+            found = importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        # 已导入的模块没有__spec__等情况，交给执行阶段判断
+        return True
+    if found:
+        _found_modules.add(name)
+    return found
+
+
+def _failure(stderr):
+    return {'success': False, 'stderr': stderr, 'static': True}
+
+
+def _format_error(code, filename, node, error_type, message):
+    lines = code.splitlines()
+    source = lines[node.lineno - 1].strip() if 0 < node.lineno <= len(lines) else ''
+    return f'  File "{filename}", line {node.lineno}\n    {source}\n{error_type}: {message}\n'
+
+
+def _guarded_nodes(tree):
+    '''
+    不一定会执行、或出错会被捕获的代码：函数体、lambda、条件分支（if __name__ == '__main__'除外），
+    以及带有宽泛异常处理的try块
+    '''
+    guarded = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            body = node.body if isinstance(node.body, list) else [node.body]
+        elif isinstance(node, ast.If) and not _is_main_check(node.test):
+            body = node.body + node.orelse
+        elif isinstance(node, ast.Try) and any(_catches(handler) for handler in node.handlers):
+            body = node.body
+        else:
+            continue
+        for statement in body:
+            guarded.update(id(child) for child in ast.walk(statement))
+    return guarded
+
+
+def _is_main_check(test):
+    return isinstance(test, ast.Compare) and isinstance(test.left, ast.Name) and test.left.id == '__name__'
+
+
+def _catches(handler):
+    if handler.type is None:
+        return True
+    types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+    return any(isinstance(t, ast.Name) and t.id in CATCH_ALL for t in types)
+
+
+def _missing_import(tree, search_paths):
+    guarded = _guarded_nodes(tree)
+    for node in ast.walk(tree):
+        if id(node) in guarded:
+            continue
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            # 只查找顶层包：查找子模块需要先导入父包，代价和执行差不多
+            top = name.split('.')[0]
+            if not _find_module(top) and not _local_module(top, search_paths):
+                return node, top
+    return None
+
+
+def _local_module(name, search_paths):
+    for path in search_paths:
+        if os.path.isdir(os.path.join(path, name)) or os.path.isfile(os.path.join(path, name + '.py')):
+            return True
+    return False
+
+
+def _undefined_name(tree, previous_code):
+    try:
+        previous = ast.parse(previous_code) if previous_code else None
+    except (SyntaxError, ValueError):
+        # 之前步骤的代码无法解析时不知道其中绑定了哪些名字，跳过名字分析
+        return None
+    trees = [tree] if previous is None else [previous, tree]
+
+    bound = set(BUILTIN_NAMES)
+    for t in trees:
+        if _is_dynamic(t):
+            return None
+        bound |= _bound_names(t)
+
+    guarded = _guarded_nodes(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) \
+                and node.id not in bound and id(node) not in guarded:
+            return node
+    return None
+
+
+def _is_dynamic(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and any(alias.name == '*' for alias in node.names):
+            return True
+        if isinstance(node, ast.Name) and node.id in DYNAMIC_NAMES:
+            return True
+    return False
+
+
+def _bound_names(tree):
+    '''
+    代码中任何地方绑定的名字（不区分作用域）
+    '''
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update(alias.asname or alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+        elif isinstance(getattr(node, 'name', None), str):
+            # 函数、类、except ... as name、match中的捕获、类型参数
+            names.add(node.name)
+    return names
@@ -0,0 +1,203 @@
+"""
+耗时与token用量统计
+
+记录两类数据：
+    - 每次LLM调用：agent类名、prompt/completion token数、耗时、首token耗时（流式）、重试次数
+    - run()流程中每个阶段的耗时：规划、每一步的代码生成、整合、检查执行、修正
+可导出为Prometheus文本格式（Flask的 /metrics），设置 DEEPSEEK_METRICS_JSONL 后每条记录同时追加写入JSON行文件。
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+METRICS_JSONL = os.getenv('DEEPSEEK_METRICS_JSONL', '')
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# 当前LLM调用中已发出的HTTP请求数，由HTTP客户端的请求钩子累加，用于计算重试次数
+_attempts = contextvars.ContextVar('llm_attempts', default=None)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    '''
+    进程内的计数器和直方图，按标签分别统计
+    '''
+
+    def __init__(self, jsonl_path=METRICS_JSONL):
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def inc(self, name, value=1, help='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('counter', help))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, help='', buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('histogram', help))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def write_jsonl(self, record):
+        if not self.jsonl_path:
+            return
+        line = json.dumps({'ts': time.time(), 'pid': os.getpid(), **record}, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self._counters.items()
+                ],
+                'histograms': [
+                    {'name': name, 'labels': dict(labels), 'count': h.count, 'sum': h.sum}
+                    for (name, labels), h in self._histograms.items()
+                ],
+            }
+
+    def render_prometheus(self):
+        '''
+        导出为Prometheus文本格式
+        '''
+        with self._lock:
+            series = {}
+            for (name, labels), value in self._counters.items():
+                series.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value}')
+            for (name, labels), h in self._histograms.items():
+                lines = series.setdefault(name, [])
+                for bound, count in zip(h.buckets, h.counts):
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", str(bound)),))} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {h.count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {h.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {h.count}')
+
+            output = []
+            for name in sorted(series):
+                kind, help = self._help[name]
+                output.append(f'# HELP {name} {help}')
+                output.append(f'# TYPE {name} {kind}')
+                output.extend(series[name])
+            return '\n'.join(output) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+registry = MetricsRegistry()
+
+
+def record_llm_call(agent, model, latency, prompt_tokens=None, completion_tokens=None,
+                    ttft=None, retries=0, status='ok', stream=False):
+    '''
+    记录一次LLM调用，status为 ok / error / cache_hit
+    '''
+    registry.inc('deepseek_llm_calls_total', help='LLM calls by agent and status', agent=agent, status=status)
+    if status != 'cache_hit':
+        registry.observe('deepseek_llm_latency_seconds', latency, help='LLM call latency', agent=agent)
+    if ttft is not None:
+        registry.observe('deepseek_llm_time_to_first_token_seconds', ttft,
+                         help='Time to first streamed token', agent=agent)
+    if retries:
+        registry.inc('deepseek_llm_retries_total', retries, help='HTTP retries of LLM calls', agent=agent)
+    if prompt_tokens:
+        registry.inc('deepseek_llm_prompt_tokens_total', prompt_tokens, help='Prompt tokens', agent=agent)
+    if completion_tokens:
+        registry.inc('deepseek_llm_completion_tokens_total', completion_tokens, help='Completion tokens', agent=agent)
+
+    registry.write_jsonl({
+        'type': 'llm_call',
+        'agent': agent,
+        'model': model,
+        'status': status,
+        'stream': stream,
+        'latency': latency,
+        'ttft': ttft,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'retries': retries,
+    })
+
+
+@contextmanager
+def stage(name, **fields):
+    '''
+    记录流程中一个阶段的耗时：with stage('plan'): ...
+    fields只写入JSON行（如step_id），不作为Prometheus标签，避免标签基数过大
+    '''
+    started = time.monotonic()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        duration = time.monotonic() - started
+        registry.observe('deepseek_stage_duration_seconds', duration,
+                         help='Duration of pipeline stages', stage=name, status=status)
+        registry.write_jsonl({'type': 'stage', 'stage': name, 'status': status, 'duration': duration, **fields})
+
+
+@contextmanager
+def count_attempts():
+    '''
+    统计with块中发出的HTTP请求数，重试次数 = 请求数 - 1
+    '''
+    attempts = [0]
+    token = _attempts.set(attempts)
+    try:
+        yield attempts
+    finally:
+        _attempts.reset(token)
+
+
+def on_http_request(request):
+    attempts = _attempts.get()
+    if attempts is not None:
+        attempts[0] += 1
+
+
+async def on_async_http_request(request):
+    on_http_request(request)
@@ -0,0 +1,168 @@
+"""
+常驻Python工作进程
+
+Node端的工作进程池（server/pythonWorkerPool.js）通过stdin/stdout与本进程通信，
+避免每次调用都重新启动解释器并重新导入deepseek_agent、openai、tiktoken等模块。
+
+通信协议为按行分帧的JSON（每行一个JSON对象）：
+    请求: {"id": 1, "method": "plan_for_machine_task", "args": [...], "kwargs": {...}}
+    增量: {"id": 1, "event": "delta", "data": "..."}   （仅流式函数，可能有多条）
+    响应: {"id": 1, "ok": true, "result": ...}
+          {"id": 1, "ok": false, "error": "...", "traceback": "..."}
+启动完成后会先输出一行 {"event": "ready", "pid": ...}。
+
+业务调用在单独的线程中执行（同一时刻只有一个），主线程继续读取请求，
+因此 __metrics__ 等内部查询在进程忙碌时也能立即得到响应。
+"""
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+# 保证以 `python deepseek_agent/worker.py` 方式启动时也能导入包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deepseek_agent import api
+
+
+HEALTH_METHOD = '__health__'
+# 本进程的耗时/token统计（telemetry_metrics）和LLM响应缓存统计（response_cache_stats）
+METRICS_METHOD = '__metrics__'
+
+
+def exported_functions():
+    '''
+    收集deepseek_agent.api中所有可供调用的公开函数
+    '''
+    functions = {}
+    for name, obj in vars(api).items():
+        if name.startswith('_') or name == 'main':
+            continue
+        if inspect.isfunction(obj) and obj.__module__ == api.__name__:
+            functions[name] = obj
+    return functions
+
+
+def peak_rss_kb():
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return None
+
+
+class Worker:
+    def __init__(self, channel):
+        self.channel = channel
+        self.functions = exported_functions()
+        self.started_at = time.time()
+        self.served = 0
+        self.failed = 0
+        self._send_lock = threading.Lock()
+        self._call = None
+
+    def send(self, message):
+        data = json.dumps(message, ensure_ascii=False, default=str) + '\n'
+        with self._send_lock:
+            self.channel.write(data)
+            self.channel.flush()
+
+    def health(self):
+        return {
+            'pid': os.getpid(),
+            'served': self.served,
+            'failed': self.failed,
+            'uptime': time.time() - self.started_at,
+            'peak_rss_kb': peak_rss_kb(),
+            'methods': sorted(self.functions),
+        }
+
+    def stream(self, request_id, generator):
+        # 流式函数：每个增量单独发送一帧，生成器的返回值作为最终结果
+        while True:
+            try:
+                delta = next(generator)
+            except StopIteration as stop:
+                return stop.value
+            self.send({'id': request_id, 'event': 'delta', 'data': delta})
+
+    def metrics(self, format='prometheus'):
+        return {
+            'pid': os.getpid(),
+            'metrics': api.telemetry_metrics(format),
+            'cache': api.response_cache_stats(),
+        }
+
+    def handle(self, request):
+        request_id = request.get('id')
+        method = request.get('method')
+
+        if method == HEALTH_METHOD:
+            self.send({'id': request_id, 'ok': True, 'result': self.health()})
+            return
+        if method == METRICS_METHOD:
+            self.send({'id': request_id, 'ok': True, 'result': self.metrics(*request.get('args', []))})
+            return
+
+        function = self.functions.get(method)
+        if function is None:
+            self.failed += 1
+            self.send({'id': request_id, 'ok': False, 'error': f'Unknown method: {method}'})
+            return
+
+        try:
+            result = function(*request.get('args', []), **request.get('kwargs', {}))
+            if inspect.isgenerator(result):
+                result = self.stream(request_id, result)
+            self.served += 1
+            self.send({'id': request_id, 'ok': True, 'result': result})
+        except Exception as e:
+            self.failed += 1
+            self.send({
+                'id': request_id,
+                'ok': False,
+                'error': str(e),
+                'traceback': traceback.format_exc(),
+            })
+
+    def serve(self, stream):
+        self.send({'event': 'ready', 'pid': os.getpid()})
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                self.send({'id': None, 'ok': False, 'error': f'Invalid request: {e}'})
+                continue
+            if request.get('method') in (HEALTH_METHOD, METRICS_METHOD):
+                self.handle(request)
+                continue
+            # Node端保证同一时刻只发送一个业务调用，上一个调用仍未结束时等待它完成
+            if self._call is not None:
+                self._call.join()
+            self._call = threading.Thread(target=self.handle, args=(request,), name='worker-call')
+            self._call.start()
+        if self._call is not None:
+            self._call.join()
+
+
+def main():
+    # 协议独占原始stdout，业务代码中的print统一转到stderr，避免污染响应
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    logging.basicConfig(level=os.getenv('DEEPSEEK_LOG_LEVEL', 'INFO'), stream=sys.stderr,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    stream = open(sys.stdin.fileno(), 'r', encoding='utf-8', closefd=False)
+    Worker(channel).serve(stream)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+后台任务队列
+
+耗时的代码生成流程不在Flask请求线程中执行：提交后立即返回任务ID，由固定数量的后台线程依次执行，
+客户端轮询任务状态并获取结果，或订阅任务的进度事件。队列有容量上限，满时拒绝新任务（HTTP 429）。
+"""
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_QUEUE_DEPTH = int(os.getenv('JOB_QUEUE_DEPTH', '16'))
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '3600'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    '''
+    排队中的任务数已达到上限
+    '''
+
+
+class Job:
+    def __init__(self, func, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # 传给任务函数的取消信号，任务函数在各阶段之间检查
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        # 任务函数通过publish上报的进度事件 (编号, 事件名, 数据)，编号从1开始
+        self.events = []
+        self._events_condition = threading.Condition()
+
+    def wait(self, timeout=None):
+        '''
+        等待任务结束，返回是否已结束
+        '''
+        return self.done_event.wait(timeout)
+
+    def publish(self, event, data):
+        '''
+        记录一条进度事件并唤醒等待中的订阅者，可在任意线程中调用
+        '''
+        with self._events_condition:
+            self.events.append((len(self.events) + 1, event, data))
+            self._events_condition.notify_all()
+
+    def wait_events(self, after=0, timeout=None):
+        '''
+        返回编号大于after的事件，没有新事件时最多等待timeout秒
+        '''
+        with self._events_condition:
+            self._events_condition.wait_for(lambda: len(self.events) > after or self.done_event.is_set(), timeout)
+            return self.events[after:]
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'cancel_requested': self.cancel_event.is_set(),
+            'error': self.error,
+        }
+
+
+class JobQueue:
+    '''
+    有界的后台任务队列
+
+    Params:
+        workers: 同时执行的任务数
+        max_queued: 最多排队等待的任务数，超出时submit抛出QueueFull
+        result_ttl: 已结束的任务保留多久（秒），过期后无法再查询
+        cancelled_exceptions: 任务函数响应取消时抛出的异常类型，捕获后任务状态记为cancelled
+    '''
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_QUEUE_DEPTH, result_ttl=JOB_RESULT_TTL,
+                 cancelled_exceptions=()):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.cancelled_exceptions = tuple(cancelled_exceptions)
+
+        self._jobs = OrderedDict()
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopped = False
+
+    def start(self):
+        with self._condition:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        提交任务，func会以关键字参数cancel_event收到取消信号，以关键字参数observer收到进度回调job.publish
+
+        Returns:
+            job: 新建的Job
+        '''
+        self.start()
+        with self._condition:
+            self._expire()
+            if len(self._pending) >= self.max_queued:
+                raise QueueFull(f'Job queue is full ({self.max_queued} jobs waiting)')
+            job = Job(func, args, kwargs)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._condition.notify()
+            return job
+
+    def get(self, job_id):
+        with self._condition:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        '''
+        取消任务：排队中的任务直接取消，执行中的任务设置取消信号，由任务函数在下一个阶段开始前退出
+
+        Returns:
+            job: 对应的Job，不存在时为None
+        '''
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return job
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                self._pending.remove(job)
+                self._finish(job, CANCELLED)
+            return job
+
+    def stats(self):
+        with self._condition:
+            counts = {state: 0 for state in (QUEUED, RUNNING) + FINISHED_STATES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {
+                'workers': self.workers,
+                'max_queued': self.max_queued,
+                'queue_depth': len(self._pending),
+                'jobs': counts,
+            }
+
+    def shutdown(self):
+        with self._condition:
+            self._stopped = True
+            for job in self._pending:
+                job.cancel_event.set()
+                self._finish(job, CANCELLED)
+            self._pending.clear()
+            for job in self._jobs.values():
+                job.cancel_event.set()
+            self._condition.notify_all()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._stopped)
+                if self._stopped:
+                    return
+                job = self._pending.popleft()
+                job.status = RUNNING
+                job.started_at = time.time()
+
+            try:
+                result = job.func(*job.args, cancel_event=job.cancel_event, observer=job.publish, **job.kwargs)
+                status, error = SUCCEEDED, None
+            except self.cancelled_exceptions:
+                result, status, error = None, CANCELLED, None
+            except Exception as e:
+                traceback.print_exc()
+                result, status, error = None, FAILED, str(e)
+
+            with self._condition:
+                job.result = result
+                job.error = error
+                self._finish(job, status)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        # 结果已经保存在job上，释放对参数的引用
+        job.func = job.args = job.kwargs = None
+        # 先记录job-finished再标记结束，订阅者看到done_event时该事件一定已在job.events中
+        job.publish('job-finished', job.to_dict())
+        job.done_event.set()
+
+    def _expire(self):
+        if self.result_ttl is None:
+            return
+        deadline = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.status in FINISHED_STATES and job.finished_at < deadline]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -39,6 +39,11 @@ const datasetSchema = new mongoose.Schema({
   userId: {
     type: String,
     required: true
+  },
+  // 文件被存储清理删除的时间，未删除时为null
+  evictedAt: {
+    type: Date,
+    default: null
   }
 });
 
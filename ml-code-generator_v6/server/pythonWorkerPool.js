@@ -0,0 +1,333 @@
+const { spawn } = require('child_process');
+const path = require('path');
+const readline = require('readline');
+
+// 常驻Python工作进程池：每个进程预先加载 deepseek_agent，
+// 通过按行分帧的JSON协议（见 deepseek_agent/worker.py）调用 deepseek_agent.api 中的函数
+class PythonWorker {
+  constructor(pool, index) {
+    this.pool = pool;
+    this.index = index;
+    this.served = 0;
+    this.failed = 0;
+    this.current = null;
+    this.ready = false;
+    this.retiring = false;
+    this.exited = false;
+    this.startedAt = Date.now();
+    // 不占用工作进程的内部查询（进程忙碌时也会立即响应），id -> 回调
+    this.queries = new Map();
+
+    this.process = spawn(pool.pythonPath, ['-m', 'deepseek_agent.worker'], {
+      cwd: pool.cwd,
+      env: {
+        ...process.env,
+        PYTHONIOENCODING: 'utf-8',
+        PYTHONUNBUFFERED: '1',
+        // 限流器只在进程内共享，各工作进程平分DEEPSEEK_RATE_LIMIT_RPM/TPM的配额
+        DEEPSEEK_RATE_LIMIT_SHARES: process.env.DEEPSEEK_RATE_LIMIT_SHARES || String(pool.size)
+      }
+    });
+    this.pid = this.process.pid;
+
+    readline.createInterface({ input: this.process.stdout }).on('line', (line) => this.onLine(line));
+
+    this.process.stderr.on('data', (data) => {
+      console.error(`[python-worker ${this.pid}] ${data.toString('utf8').trimEnd()}`);
+    });
+
+    this.process.on('error', (err) => {
+      console.error(`Python worker ${this.pid} error:`, err);
+      this.onExit(null);
+    });
+
+    this.process.on('exit', (code) => this.onExit(code));
+  }
+
+  get busy() {
+    return this.current !== null;
+  }
+
+  onLine(line) {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (e) {
+      console.error(`[python-worker ${this.pid}] invalid frame: ${line}`);
+      return;
+    }
+
+    if (message.event === 'ready') {
+      this.ready = true;
+      this.pool.dispatch();
+      return;
+    }
+
+    if (this.queries.has(message.id)) {
+      const done = this.queries.get(message.id);
+      this.queries.delete(message.id);
+      done(message.ok ? message.result : null);
+      return;
+    }
+
+    const job = this.current;
+    if (!job || message.id !== job.id) {
+      return;
+    }
+
+    if (message.event === 'delta') {
+      if (job.onDelta) {
+        job.onDelta(message.data);
+      }
+      return;
+    }
+
+    clearTimeout(job.timer);
+    this.current = null;
+    if (message.ok) {
+      if (!job.internal) {
+        this.served++;
+      }
+      job.resolve(message.result);
+    } else {
+      this.failed++;
+      const error = new Error(message.error);
+      error.traceback = message.traceback;
+      job.reject(error);
+    }
+    this.pool.release(this, job);
+  }
+
+  onExit(code) {
+    if (this.exited) {
+      return;
+    }
+    this.exited = true;
+    this.ready = false;
+
+    this.queries.forEach((done) => done(null));
+    this.queries.clear();
+
+    if (this.current) {
+      clearTimeout(this.current.timer);
+      this.current.reject(new Error(`Python worker ${this.pid} exited with code ${code}`));
+      this.current = null;
+    }
+    this.pool.replace(this);
+  }
+
+  run(job) {
+    this.current = job;
+    if (job.timeout) {
+      job.timer = setTimeout(() => {
+        console.error(`Python worker ${this.pid} timed out on ${job.method}, killing it`);
+        this.kill();
+      }, job.timeout);
+    }
+    this.process.stdin.write(JSON.stringify({
+      id: job.id,
+      method: job.method,
+      args: job.args,
+      kwargs: job.kwargs
+    }) + '\n');
+  }
+
+  kill() {
+    this.retiring = true;
+    this.process.kill('SIGKILL');
+  }
+
+  retire() {
+    this.retiring = true;
+    this.process.stdin.end();
+  }
+
+  probe(timeout) {
+    // 空闲时向进程询问其自身的运行状态（内存、处理数量等）
+    return new Promise((resolve) => {
+      this.run({
+        id: this.pool.nextId++,
+        method: '__health__',
+        args: [],
+        kwargs: {},
+        timeout,
+        internal: true,
+        resolve,
+        reject: () => resolve(null)
+      });
+    });
+  }
+
+  query(method, args, timeout) {
+    // 内部查询不经过任务队列，失败或超时时得到null
+    if (!this.ready || this.exited) {
+      return Promise.resolve(null);
+    }
+    return new Promise((resolve) => {
+      const id = this.pool.nextId++;
+      const timer = setTimeout(() => {
+        this.queries.delete(id);
+        resolve(null);
+      }, timeout);
+      this.queries.set(id, (result) => {
+        clearTimeout(timer);
+        resolve(result);
+      });
+      this.process.stdin.write(JSON.stringify({ id, method, args, kwargs: {} }) + '\n');
+    });
+  }
+
+  health() {
+    return {
+      index: this.index,
+      pid: this.pid,
+      ready: this.ready,
+      busy: this.busy,
+      currentMethod: this.current ? this.current.method : null,
+      served: this.served,
+      failed: this.failed,
+      uptimeMs: Date.now() - this.startedAt
+    };
+  }
+}
+
+class PythonWorkerPool {
+  constructor(options = {}) {
+    this.size = options.size || 2;
+    this.maxRequests = options.maxRequests || 100;
+    this.requestTimeout = options.requestTimeout || 0;
+    this.pythonPath = options.pythonPath || 'python';
+    this.cwd = options.cwd || path.join(__dirname, '..');
+
+    this.nextId = 1;
+    this.queue = [];
+    // 会话亲和：有状态的调用（如增量检查）需要始终发往同一个工作进程
+    this.affinity = new Map();
+    this.recycled = 0;
+    this.closed = false;
+    this.workers = [];
+    for (let i = 0; i < this.size; i++) {
+      this.workers.push(new PythonWorker(this, i));
+    }
+  }
+
+  call(method, args = [], kwargs = {}, options = {}) {
+    if (this.closed) {
+      return Promise.reject(new Error('Python worker pool is closed'));
+    }
+    return new Promise((resolve, reject) => {
+      this.queue.push({
+        id: this.nextId++,
+        method,
+        args,
+        kwargs,
+        timeout: options.timeout || this.requestTimeout,
+        onDelta: options.onDelta,
+        affinity: options.affinity,
+        unpin: options.unpin,
+        resolve,
+        reject
+      });
+      this.dispatch();
+    });
+  }
+
+  isIdle(worker) {
+    return worker.ready && !worker.busy && !worker.retiring;
+  }
+
+  dispatch() {
+    for (let i = 0; i < this.queue.length; i++) {
+      const job = this.queue[i];
+      let worker;
+      if (job.affinity !== undefined && this.affinity.has(job.affinity)) {
+        worker = this.workers[this.affinity.get(job.affinity)];
+        if (!this.isIdle(worker)) {
+          continue;
+        }
+      } else {
+        worker = this.workers.find((w) => this.isIdle(w));
+        if (!worker) {
+          return;
+        }
+        if (job.affinity !== undefined && !job.unpin) {
+          this.affinity.set(job.affinity, worker.index);
+        }
+      }
+      this.queue.splice(i, 1);
+      i--;
+      worker.run(job);
+    }
+  }
+
+  isPinned(worker) {
+    for (const index of this.affinity.values()) {
+      if (index === worker.index) {
+        return true;
+      }
+    }
+    return false;
+  }
+
+  release(worker, job) {
+    if (job && job.unpin) {
+      this.affinity.delete(job.affinity);
+    }
+    // 处理达到上限的请求数后回收进程，防止内存持续增长；仍有会话绑定的进程推迟回收
+    if (worker.served + worker.failed >= this.maxRequests && !this.isPinned(worker)) {
+      this.recycled++;
+      worker.retire();
+    }
+    this.dispatch();
+  }
+
+  replace(worker) {
+    if (this.closed) {
+      return;
+    }
+    // 启动即崩溃的进程延迟重启，避免反复拉起
+    const crashed = !worker.retiring && Date.now() - worker.startedAt < 1000;
+    const delay = crashed ? 1000 : 0;
+    setTimeout(() => {
+      if (!this.closed) {
+        this.workers[worker.index] = new PythonWorker(this, worker.index);
+      }
+    }, delay);
+  }
+
+  async health() {
+    const workers = await Promise.all(this.workers.map(async (worker) => {
+      const status = worker.health();
+      if (worker.ready && !worker.busy && !worker.retiring) {
+        status.process = await worker.probe(5000);
+      }
+      return status;
+    }));
+    return {
+      size: this.size,
+      maxRequests: this.maxRequests,
+      queued: this.queue.length,
+      recycled: this.recycled,
+      pinnedSessions: this.affinity.size,
+      workers
+    };
+  }
+
+  async metrics(format = 'prometheus') {
+    // 各工作进程中的耗时/token统计和LLM响应缓存统计，未就绪或没有响应的进程为null
+    return Promise.all(this.workers.map(async (worker) => ({
+      index: worker.index,
+      pid: worker.pid,
+      ...((await worker.query('__metrics__', [format], 5000)) || { metrics: null, cache: null })
+    })));
+  }
+
+  close() {
+    this.closed = true;
+    this.workers.forEach((worker) => worker.retire());
+    this.queue.forEach((job) => job.reject(new Error('Python worker pool is closed')));
+    this.queue = [];
+  }
+}
+
+module.exports = { PythonWorkerPool };
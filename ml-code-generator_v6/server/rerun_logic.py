@@ -1,9 +1,158 @@
-def rerun_task(task_id, params=None):
-    # TODO: 实现重跑逻辑
-    # task_id: 任务ID，params: 可选参数
-    # 返回重跑结果
+"""
+任务重跑
+
+每次代码生成完成后，把规划、每一步的代码、整合/修正结果和检查结果按任务ID保存到产物存储中。
+重跑时在保存的产物上调用run()：输入指纹未变化的步骤、整合、检查和修正直接复用，
+只有受params影响的部分才重新生成或重新执行。没有任何变化的重跑不会调用模型，也不会重新执行代码。
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from deepseek_agent.api import run, analyze_step_dependencies, step_input_keys
+
+
+ARTIFACT_ROOT = os.getenv('ARTIFACT_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifacts'))
+ARTIFACT_MEMORY_ENTRIES = int(os.getenv('ARTIFACT_MEMORY_ENTRIES', '64'))
+
+
+class ArtifactStore:
+    '''
+    按任务ID保存生成产物：每个任务一个JSON文件，最近使用的任务同时缓存在内存中
+
+    Params:
+        root: 产物文件目录
+        max_memory_entries: 内存中缓存的任务数
+    '''
+
+    def __init__(self, root=ARTIFACT_ROOT, max_memory_entries=ARTIFACT_MEMORY_ENTRIES):
+        self.root = root
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, task_id):
+        path = self._path(task_id)
+        with self._lock:
+            record = self._memory.get(task_id)
+            if record is not None:
+                self._memory.move_to_end(task_id)
+                return record
+
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            record = json.load(f)
+
+        with self._lock:
+            self._remember(task_id, record)
+        return record
+
+    def save(self, task_id, record):
+        path = self._path(task_id)
+        os.makedirs(self.root, exist_ok=True)
+        # 先写临时文件再替换，避免并发读取到写了一半的文件
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._remember(task_id, record)
+
+    def _path(self, task_id):
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', str(task_id)):
+            raise ValueError(f'Invalid task id: {task_id}')
+        return os.path.join(self.root, f'{task_id}.json')
+
+    def _remember(self, task_id, record):
+        self._memory[task_id] = record
+        self._memory.move_to_end(task_id)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+
+artifact_store = ArtifactStore()
+
+
+def save_task(task_id, task_prompt, dataset_path, python_file_name, result):
+    '''
+    保存一次run()的结果，供之后按task_id重跑
+    '''
+    artifact_store.save(task_id, {
+        'task_id': task_id,
+        'task_prompt': task_prompt,
+        'dataset_path': dataset_path,
+        'python_file_name': python_file_name,
+        'updated_at': time.time(),
+        'code': result['code'],
+        'success': result['success'],
+        'stderr': result['stderr'],
+        'artifacts': result['artifacts'],
+    })
+
+
+def rerun_task(task_id, params=None, cancel_event=None, observer=None):
+    '''
+    在保存的产物上增量重跑任务
+
+    Params:
+        task_id: 任务ID
+        params: 可选的修改项
+            task_prompt: 新的任务描述（保留原规划，所有步骤重新生成）
+            dataset_path: 新的数据集路径（数据集结构摘要不变时只重新执行检查）
+            plans: 新的完整步骤列表
+            steps: {步骤编号: 新的步骤描述}，只修改部分步骤，依赖这些步骤的步骤也会重新生成
+            force_steps: 强制重新生成的步骤编号列表
+            recheck: 为True时强制重新执行检查
+        cancel_event: 取消信号，见run()
+        observer: 进度回调，见run()
+
+    Returns:
+        {"status": "success" | "error", "message": str, "result": dict | None}
+    '''
+    started = time.monotonic()
+    record = artifact_store.load(task_id)
+    if record is None:
+        return {'status': 'error', 'message': f'任务 {task_id} 不存在', 'result': None}
+
+    params = params or {}
+    artifacts = dict(record['artifacts'])
+    task_prompt = params.get('task_prompt') or record['task_prompt']
+    dataset_path = params.get('dataset_path') or record['dataset_path']
+
+    plans = list(params.get('plans') or artifacts['plans'])
+    for step_id, description in (params.get('steps') or {}).items():
+        step_id = int(step_id)
+        if not 1 <= step_id <= len(plans):
+            return {'status': 'error', 'message': f'步骤 {step_id} 不存在', 'result': None}
+        plans[step_id - 1] = description
+
+    if params.get('force_steps'):
+        keys = step_input_keys(task_prompt, plans, analyze_step_dependencies(plans), [dataset_path])
+        forced = {keys[int(step_id) - 1] for step_id in params['force_steps'] if 1 <= int(step_id) <= len(keys)}
+        artifacts['steps'] = {key: code for key, code in artifacts['steps'].items() if key not in forced}
+    if params.get('recheck'):
+        artifacts['checks'] = {}
+
+    result = run(task_prompt, record['python_file_name'], os.path.dirname(dataset_path),
+                 cancel_event=cancel_event, plans=plans, artifacts=artifacts, observer=observer,
+                 datasets=[dataset_path])
+    save_task(task_id, task_prompt, dataset_path, record['python_file_name'], result)
+
+    reused_steps = result['reused']['steps']
     return {
         'status': 'success',
         'message': f'任务 {task_id} 已重跑',
-        'result': None
-    } 
\ No newline at end of file
+        'result': {
+            'code': result['code'],
+            'success': result['success'],
+            'stderr': result['stderr'],
+            'reused': result['reused'],
+            'regenerated_steps': [i + 1 for i in range(len(plans)) if i + 1 not in reused_steps],
+            'duration': round(time.monotonic() - started, 3),
+        },
+    }
@@ -7,9 +7,10 @@ const path = require('path');
 const { createServer } = require('http');
 const { Server } = require('socket.io');
 const Dataset = require('./models/Dataset');
-const { spawn } = require('child_process');
+const { PythonWorkerPool } = require('./pythonWorkerPool');
+const { ContentStore, UploadError } = require('./uploadStore');
 const fs = require('fs');
-const csv = require('csv-parser');
+const { spawn } = require('child_process');
 
 const app = express();
 const server = createServer(app);
@@ -22,22 +23,94 @@ const io = new Server(server, {
 
 const port = process.env.PORT || 5001;
 
+// 每个会话最多同时推测生成的步骤数，默认留一个工作进程给按顺序生成的当前步骤
+const MAX_SPECULATIVE_STEPS = parseInt(
+  process.env.MAX_SPECULATIVE_STEPS || String(Math.max(parseInt(process.env.PY_WORKER_POOL_SIZE || '2', 10) - 1, 1)),
+  10
+);
+
+// 一次批量指标分析请求最多包含的任务描述数
+const METRICS_BATCH_MAX_TASKS = parseInt(process.env.METRICS_BATCH_MAX_TASKS || '100', 10);
+
+// 常驻Python工作进程池，替代每次调用都启动新的 python -c 进程
+const pythonPool = new PythonWorkerPool({
+  size: parseInt(process.env.PY_WORKER_POOL_SIZE || '2', 10),
+  maxRequests: parseInt(process.env.PY_WORKER_MAX_REQUESTS || '100', 10),
+  pythonPath: process.env.PYTHON_BIN || 'python',
+  cwd: path.join(__dirname, '..')
+});
+
 // 中间件
 app.use(cors());
 app.use(express.json());
 
-// 配置文件上传
+// 上传的文件按内容哈希保存在 uploads/.store 中，uploads 中的文件名是它的硬链接（见 uploadStore.js）
+const UPLOAD_DIR = 'uploads';
+const uploadStore = new ContentStore(path.join(UPLOAD_DIR, '.store'));
+
+// 上传目录由Node自己清理（Flask只清理它自己的上传目录）：定期运行 storage_janitor.py，
+// 进行中的会话和请求使用的数据集固定不删除，文件已被删除的数据集记录标记evictedAt
+const STORAGE_JANITOR_INTERVAL = parseFloat(process.env.STORAGE_JANITOR_INTERVAL || '600');
+
+// 固定ID -> 数据集的绝对路径
+const pinnedDatasets = new Map();
+let nextPinId = 0;
+let janitorRunning = null;
+
+// 配置文件上传：multer先写入存储的临时目录，计算哈希后移入存储
 const storage = multer.diskStorage({
   destination: function (req, file, cb) {
-    cb(null, 'uploads/');
+    cb(null, path.join(UPLOAD_DIR, '.store', 'partial'));
   },
   filename: function (req, file, cb) {
-    cb(null, Date.now() + '-' + file.originalname);
+    cb(null, Date.now() + '-' + file.originalname + '.tmp');
   }
 });
 
 const upload = multer({ storage: storage });
 
+function uploadPath(originalname) {
+  return path.join(UPLOAD_DIR, Date.now() + '-' + path.basename(originalname));
+}
+
+// 上传完成后保存数据集记录：上传时流式读取一次，计算画像（行数、列、目标列等）并保存到索引，之后的列表和预览直接使用
+async function saveDataset(body, filePath, fileSize, fileType) {
+  const metadata = typeof body.metadata === 'string' ? JSON.parse(body.metadata || '{}') : { ...(body.metadata || {}) };
+  const profile = await datasetProfile(filePath);
+  if (profile) {
+    metadata.rowCount = profile.rows;
+    metadata.columnCount = profile.columns;
+    metadata.features = profile.header;
+    if (!metadata.targetVariable && profile.target_candidates.length > 0) {
+      metadata.targetVariable = profile.target_candidates[0].column;
+    }
+  }
+
+  const dataset = new Dataset({
+    name: body.name,
+    description: body.description,
+    type: body.type,
+    filePath,
+    fileSize,
+    fileType,
+    metadata,
+    userId: body.userId
+  });
+
+  await dataset.save();
+  return dataset;
+}
+
+function sendUploadError(res, error) {
+  if (error instanceof UploadError) {
+    if (error.offset !== null) {
+      res.set('Upload-Offset', String(error.offset));
+    }
+    return res.status(error.status).json({ message: error.message, offset: error.offset });
+  }
+  res.status(500).json({ message: error.message });
+}
+
 // 连接数据库
 mongoose.connect(process.env.MONGODB_URI || 'mongodb://localhost:27017/ml-code-generator', {
   useNewUrlParser: true,
@@ -79,6 +152,7 @@ io.on('connection', (socket) => {
   // 处理代码生成请求
   socket.on('generate-code', async (data) => {
     const { task_prompt, dataset_paths, sessionId } = data;
+    const unpin = pinDatasets(dataset_paths);
     
     try {
       // 发送开始处理的消息
@@ -91,7 +165,7 @@ io.on('connection', (socket) => {
         status: 'planning'
       });
       
-      const plans = await planForMachineTask(task_prompt);
+      const plans = await planForMachineTask(task_prompt, dataset_paths);
       
       // 发送规划结果
       socket.emit('planning-complete', {
@@ -104,6 +178,25 @@ io.on('connection', (socket) => {
       let previousCode = '';
       let allGeneratedCode = '';
 
+      // 依赖的步骤都已完成的后续步骤在后台提前生成（推测执行），轮到它时直接使用结果
+      const dependencies = await analyzeStepDependencies(plans);
+      const completedSteps = new Set();
+      const speculative = new Map();
+      const speculate = (nextStepId) => {
+        for (let j = nextStepId + 1; j <= plans.length && speculative.size < MAX_SPECULATIVE_STEPS; j++) {
+          if (speculative.has(j) || !dependencies[j - 1].every((dep) => completedSteps.has(dep))) {
+            continue;
+          }
+          const promise = generateCurrentStepCode(task_prompt, plans[j - 1], j, previousCode, dataset_paths);
+          promise.catch(() => {});
+          speculative.set(j, promise);
+        }
+      };
+      speculate(1);
+
+      // 修正后仍未通过检查的步骤，会话状态无法继续使用
+      let failedStepId = null;
+
       // 步骤2: 逐步生成代码
       for (let i = 0; i < plans.length; i++) {
         const plan = plans[i];
@@ -115,12 +208,28 @@ io.on('connection', (socket) => {
 
         try {
           // 生成当前步骤的代码 - 只传递之前步骤的代码作为上下文
-          const currentStepCodeRaw = await generateCurrentStepCode(
-            task_prompt, 
-            stepName, 
-            stepId, 
-            previousCode
-          );
+          let currentStepCodeRaw = null;
+          if (speculative.has(stepId)) {
+            const prefetched = speculative.get(stepId);
+            speculative.delete(stepId);
+            currentStepCodeRaw = await prefetched.catch((error) => {
+              console.error(`Speculative generation of step ${stepId} failed:`, error);
+              return null;
+            });
+            if (currentStepCodeRaw !== null) {
+              socket.emit('step-delta', { sessionId, stepId, stage: 'generate', delta: currentStepCodeRaw });
+            }
+          }
+          if (currentStepCodeRaw === null) {
+            currentStepCodeRaw = await generateCurrentStepCode(
+              task_prompt, 
+              stepName, 
+              stepId, 
+              previousCode,
+              dataset_paths,
+              (delta) => socket.emit('step-delta', { sessionId, stepId, stage: 'generate', delta })
+            );
+          }
 
           // 新增：只保留当前步骤的代码
           function extractCurrentStepCode(stepId, code) {
@@ -132,6 +241,7 @@ io.on('connection', (socket) => {
             return code; // fallback
           }
           const currentStepCode = extractCurrentStepCode(stepId, currentStepCodeRaw);
+          const codeBeforeStep = allGeneratedCode;
 
           // 将当前步骤的代码添加到累积代码中
           allGeneratedCode += '\n\n' + currentStepCode;
@@ -156,7 +266,8 @@ io.on('connection', (socket) => {
             status: 'checking'
           });
 
-          const checkResult = await checkCode(allGeneratedCode);
+          // 增量检查：只在已保存的会话状态上执行当前步骤的代码
+          const checkResult = await checkStepCode(sessionId, currentStepCode, codeBeforeStep);
           
           if (!checkResult.success) {
             console.error('Code check failed. Stderr:', checkResult.stderr);
@@ -170,18 +281,51 @@ io.on('connection', (socket) => {
               status: 'error'
             });
 
-            const revisedCode = await reviseCode(task_prompt, allGeneratedCode, checkResult.stderr);
+            // 多个候选修正并行执行，取第一个执行通过的（见deepseek_agent/repair.py）
+            const repaired = await repairCode(task_prompt, allGeneratedCode, checkResult.stderr);
+            const revisedCode = repaired.code;
             
             socket.emit('step-revised', {
               sessionId,
               stepId,
               revisedCode: revisedCode,
-              message: `第 ${stepId} 步代码已修正`,
+              success: repaired.success,
+              rounds: repaired.rounds,
+              attempts: repaired.attempts,
+              winner: repaired.winner,
+              message: repaired.success
+                ? `第 ${stepId} 步代码已修正`
+                : `第 ${stepId} 步代码经过 ${repaired.rounds} 轮修正仍未通过检查`,
               status: 'revised'
             });
 
             allGeneratedCode = revisedCode;
             previousCode = revisedCode;
+
+            // 修正可能改动了之前步骤的代码，基于旧代码提前生成的结果作废
+            speculative.clear();
+
+            // 修正后的是整段代码，重置会话状态并以修正后的代码重建
+            const resetResult = await checkStepCode(sessionId, revisedCode, null, true);
+            if (!resetResult.success) {
+              // 会话状态已被重置，修正后的代码又没有执行通过，之后的步骤缺少之前定义的变量，不再继续生成
+              console.error('Revised code check failed. Stderr:', resetResult.stderr);
+              socket.emit('step-error', {
+                sessionId,
+                stepId,
+                error: resetResult.stderr,
+                message: `第 ${stepId} 步代码修正后仍未通过检查，已停止生成后续步骤`,
+                status: 'error'
+              });
+              failedStepId = stepId;
+              break;
+            }
+            socket.emit('step-checked', {
+              sessionId,
+              stepId,
+              message: `第 ${stepId} 步代码检查通过`,
+              status: 'checked'
+            });
           } else {
             socket.emit('step-checked', {
               sessionId,
@@ -190,6 +334,8 @@ io.on('connection', (socket) => {
               status: 'checked'
             });
           }
+          completedSteps.add(stepId);
+          speculate(stepId + 1);
         } catch (error) {
           console.error(`Error during step ${stepId}: ${stepName}`, error);
           socket.emit('step-error', {
@@ -202,6 +348,17 @@ io.on('connection', (socket) => {
         }
       }
 
+      if (failedStepId !== null) {
+        socket.emit('generation-error', {
+          sessionId,
+          error: `Step ${failedStepId} still fails after revision`,
+          code: allGeneratedCode,
+          message: `第 ${failedStepId} 步代码修正后仍未通过检查，代码生成已停止`,
+          status: 'error'
+        });
+        return;
+      }
+
       // 步骤4: 最终优化
       socket.emit('final-refining', {
         sessionId,
@@ -209,7 +366,11 @@ io.on('connection', (socket) => {
         status: 'refining'
       });
 
-      const refinedCode = await refineAllStepCode(task_prompt, allGeneratedCode);
+      const refinedCode = await refineAllStepCode(
+        task_prompt,
+        allGeneratedCode,
+        (delta) => socket.emit('step-delta', { sessionId, stepId: null, stage: 'refine', delta })
+      );
       
       // 发送最终结果
       socket.emit('generation-complete', {
@@ -226,6 +387,9 @@ io.on('connection', (socket) => {
         message: '代码生成过程中出现错误',
         status: 'error'
       });
+    } finally {
+      unpin();
+      closeCheckSession(sessionId);
     }
   });
 });
@@ -239,24 +403,85 @@ app.post('/api/datasets', upload.single('file'), async (req, res) => {
       return res.status(400).json({ message: 'No file uploaded. Please check the upload field name and file data.' });
     }
 
-    const dataset = new Dataset({
-      name: req.body.name,
-      description: req.body.description,
-      type: req.body.type,
-      filePath: req.file.path,
-      fileSize: req.file.size,
-      fileType: req.file.mimetype,
-      metadata: JSON.parse(req.body.metadata || '{}'),
-      userId: req.body.userId
-    });
-
-    await dataset.save();
+    // 内容已存在时丢弃刚写入的文件，只建立硬链接
+    const { objectPath } = await uploadStore.ingestFile(req.file.path);
+    const filePath = uploadStore.link(objectPath, uploadPath(req.file.originalname));
+    const dataset = await saveDataset(req.body, filePath, req.file.size, req.file.mimetype);
     res.status(201).json(dataset);
   } catch (error) {
     res.status(400).json({ message: error.message });
   }
 });
 
+// 分块上传：POST开始上传（body中除数据集字段外还有 filename、size、可选的 sha256），
+// 之后依次 PATCH /api/uploads/:id（请求头 Upload-Offset 为分块的起始偏移，请求体为分块内容），
+// 写完最后一块时创建数据集记录。中断后 GET /api/uploads/:id 取得已写入的偏移量继续上传。
+// 提供的sha256已在存储中时不需要上传内容，直接创建数据集记录。
+app.post('/api/uploads', async (req, res) => {
+  try {
+    const { filename, size, sha256, fileType } = req.body;
+    if (!filename) {
+      return res.status(400).json({ message: 'filename is required' });
+    }
+    const objectPath = await uploadStore.lookup(sha256);
+    if (objectPath) {
+      const filePath = uploadStore.link(objectPath, uploadPath(filename));
+      const dataset = await saveDataset(req.body, filePath, fs.statSync(objectPath).size, fileType || 'text/csv');
+      return res.status(201).json({ complete: true, sha256: sha256.toLowerCase(), dataset });
+    }
+
+    const { name, description, type, userId, metadata } = req.body;
+    const upload = uploadStore.create(filename, size, sha256, { name, description, type, userId, metadata, fileType });
+    if (upload.size === 0) {
+      return res.status(201).json(await finishUpload(upload.id));
+    }
+    res.set('Upload-Offset', String(upload.offset)).status(201).json({ ...upload, complete: false });
+  } catch (error) {
+    sendUploadError(res, error);
+  }
+});
+
+app.get('/api/uploads/:id', (req, res) => {
+  try {
+    const upload = uploadStore.status(req.params.id);
+    res.set('Upload-Offset', String(upload.offset)).json({ ...upload, complete: false });
+  } catch (error) {
+    sendUploadError(res, error);
+  }
+});
+
+app.patch('/api/uploads/:id', async (req, res) => {
+  const offset = parseInt(req.get('Upload-Offset'), 10);
+  if (Number.isNaN(offset)) {
+    return res.status(400).json({ message: 'Missing Upload-Offset header' });
+  }
+  try {
+    const upload = await uploadStore.writeChunk(req.params.id, offset, req);
+    if (upload.offset === upload.size) {
+      return res.status(201).json(await finishUpload(req.params.id));
+    }
+    res.set('Upload-Offset', String(upload.offset)).json({ ...upload, complete: false });
+  } catch (error) {
+    sendUploadError(res, error);
+  }
+});
+
+app.delete('/api/uploads/:id', (req, res) => {
+  try {
+    uploadStore.abort(req.params.id);
+    res.json({ id: req.params.id, aborted: true });
+  } catch (error) {
+    sendUploadError(res, error);
+  }
+});
+
+async function finishUpload(id) {
+  const { objectPath, sha256, meta } = await uploadStore.finish(id);
+  const filePath = uploadStore.link(objectPath, uploadPath(meta.filename));
+  const dataset = await saveDataset(meta.info, filePath, meta.size, meta.info.fileType || 'text/csv');
+  return { complete: true, sha256, dataset };
+}
+
 // 获取所有数据集
 app.get('/api/datasets', async (req, res) => {
   try {
@@ -288,44 +513,25 @@ app.get('/api/datasets/:id/preview', async (req, res) => {
       return res.status(404).json({ message: 'Dataset not found' });
     }
 
+    if (dataset.evictedAt) {
+      return res.status(410).json({ message: 'Dataset file has been removed by storage cleanup, please upload it again' });
+    }
+
     const filePath = path.resolve(dataset.filePath);
-    const results = [];
-    let headers = [];
-    let rowCount = 0;
 
     if (!fs.existsSync(filePath)) {
       return res.status(404).json({ message: `File not found on server at path: ${filePath}` });
     }
 
-    fs.createReadStream(filePath, { encoding: 'utf-8' })
-      .pipe(csv())
-      .on('headers', (headerList) => {
-        headers = headerList;
-      })
-      .on('data', (data) => {
-        if (rowCount < 5) { // 只读取前5行预览
-          results.push(data);
-        }
-        rowCount++;
-      })
-      .on('end', () => {
-        // 如果行数超过5，则不再继续读取
-        if (rowCount > 5) {
-          // 'end' 事件可能在 stream destroy 后触发，确保只发送一次响应
-          if (!res.headersSent) {
-            res.json({ headers, data: results, totalRows: rowCount });
-          }
-        } else {
-           if (!res.headersSent) {
-            res.json({ headers, data: results, totalRows: rowCount });
-          }
-        }
-      })
-      .on('error', (err) => {
-        if (!res.headersSent) {
-          res.status(500).json({ message: 'Error reading or parsing file', error: err.message });
-        }
-      });
+    // 预览来自上传时计算的画像，文件未变化时不重新读取整个文件
+    const profile = await datasetProfile(filePath);
+    if (!profile) {
+      return res.status(500).json({ message: 'Error reading or parsing file' });
+    }
+    const data = profile.head.map((row) =>
+      Object.fromEntries(profile.header.map((header, i) => [header, row[i]]))
+    );
+    res.json({ headers: profile.header, data, totalRows: profile.rows, columns: profile.column_profiles });
 
   } catch (error) {
     if (!res.headersSent) {
@@ -359,242 +565,245 @@ app.delete('/api/datasets/:id', async (req, res) => {
 
 // 保留原有的HTTP API用于兼容性
 app.post('/api/generate-code', async (req, res) => {
+  const unpin = pinDatasets([req.body.dataset_path].filter(Boolean));
   try {
     const { task_prompt, dataset_path } = req.body;
-    
-    // 调用 Python 脚本
-    const pythonProcess = spawn('python', [
-      path.join(__dirname, '../deepseek_agent/api.py'),
-      '--task', task_prompt,
-      '--dataset', dataset_path
-    ], {
-      env: {
-        ...process.env,
-        PYTHONIOENCODING: 'utf-8',
-      }
-    });
+    const saveFolder = path.dirname(dataset_path);
+    const pythonFileName = 'generated_code.py';
 
-    let output = '';
-    let error = '';
+    await pythonPool.call('run', [task_prompt, pythonFileName, saveFolder], { datasets: [path.resolve(dataset_path)] });
+    const code = fs.readFileSync(path.join(saveFolder, pythonFileName), 'utf-8');
 
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString('utf8');
+    res.json({
+      success: true,
+      output: 'Code generation completed successfully',
+      code: code
     });
-
-    pythonProcess.stderr.on('data', (data) => {
-      error += data.toString('utf8');
+  } catch (error) {
+    res.status(500).json({
+      error: 'Failed to generate code',
+      details: error.message
     });
+  } finally {
+    unpin();
+  }
+});
 
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        return res.status(500).json({ 
-          error: 'Failed to generate code',
-          details: error 
-        });
-      }
-      
-      res.json({ 
-        success: true,
-        output: output,
-        code: output
-      });
-    });
+// 立即清理一次Node的上传目录
+app.post('/api/storage/cleanup', async (req, res) => {
+  try {
+    res.json(await cleanUploads());
   } catch (error) {
     res.status(500).json({ message: error.message });
   }
 });
 
-// 辅助函数：调用Python模块
-async function planForMachineTask(task_prompt) {
-  return new Promise((resolve, reject) => {
-    const pythonProcess = spawn('python', [
-      '-c',
-      `from deepseek_agent.api import plan_for_machine_task; import sys; print(plan_for_machine_task(${JSON.stringify(task_prompt)}))`
-    ], {
-      cwd: path.join(__dirname, '..'),
-      env: {
-        ...process.env,
-        PYTHONIOENCODING: 'utf-8',
-      }
-    });
-
-    let output = '';
-    let error = '';
+// Python工作进程池状态
+app.get('/api/workers/health', async (req, res) => {
+  try {
+    res.json(await pythonPool.health());
+  } catch (error) {
+    res.status(500).json({ message: error.message });
+  }
+});
 
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString('utf8');
-    });
+// 各工作进程的LLM调用和流程阶段统计，Prometheus抓取接口；?format=json 时返回各进程的JSON快照
+app.get('/metrics', async (req, res) => {
+  try {
+    if (req.query.format === 'json') {
+      return res.json({ workers: await pythonPool.metrics('json') });
+    }
+    const workers = await pythonPool.metrics('prometheus');
+    res.type('text/plain; version=0.0.4').send(mergePrometheus(workers));
+  } catch (error) {
+    res.status(500).json({ message: error.message });
+  }
+});
 
-    pythonProcess.stderr.on('data', (data) => {
-      error += data.toString('utf8');
-    });
+// 各工作进程的LLM响应缓存统计
+app.get('/api/cache/stats', async (req, res) => {
+  try {
+    const workers = await pythonPool.metrics('json');
+    res.json({ workers: workers.map(({ index, pid, cache }) => ({ index, pid, ...(cache || { enabled: null }) })) });
+  } catch (error) {
+    res.status(500).json({ message: error.message });
+  }
+});
 
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(error));
-      } else {
-        try {
-          // 解析Python返回的列表
-          const plans = eval(output.trim());
-          resolve(plans);
-        } catch (e) {
-          reject(new Error('Failed to parse plans'));
+// 合并各工作进程的Prometheus文本：每个样本加上worker标签，同名指标的HELP/TYPE只输出一次、样本放在一起
+function mergePrometheus(workers) {
+  const families = new Map();
+  const family = (name) => {
+    if (!families.has(name)) {
+      families.set(name, { meta: [], samples: [] });
+    }
+    return families.get(name);
+  };
+
+  for (const worker of workers) {
+    const label = `worker="${worker.index}"`;
+    let current = null;
+    for (const line of (worker.metrics || '').split('\n')) {
+      const meta = line.match(/^# (HELP|TYPE) (\S+)/);
+      if (meta) {
+        current = family(meta[2]);
+        if (current.meta.length < 2 && !current.meta.some((m) => m.startsWith(`# ${meta[1]} `))) {
+          current.meta.push(line);
         }
+        continue;
       }
-    });
-  });
-}
-
-async function generateCurrentStepCode(task_prompt, current_step, step_id, previous_code) {
-  return new Promise((resolve, reject) => {
-    const pythonProcess = spawn('python', [
-      '-c',
-      `from deepseek_agent.api import generate_current_step_code; import sys; print(generate_current_step_code(${JSON.stringify(task_prompt)}, ${JSON.stringify(current_step)}, ${step_id}, ${JSON.stringify(previous_code)}))`
-    ], {
-      cwd: path.join(__dirname, '..'),
-      env: {
-        ...process.env,
-        PYTHONIOENCODING: 'utf-8',
+      const sample = line.match(/^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (.*)$/);
+      if (sample && current) {
+        const labels = sample[2] ? `${label},${sample[2]}` : label;
+        current.samples.push(`${sample[1]}{${labels}} ${sample[3]}`);
       }
-    });
-
-    let output = '';
-    let error = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString('utf8');
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      error += data.toString('utf8');
-    });
+    }
 
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(error));
-      } else {
-        resolve(output.trim());
+    if (worker.cache && worker.cache.enabled) {
+      const cache = family('deepseek_response_cache');
+      if (cache.meta.length === 0) {
+        cache.meta.push('# HELP deepseek_response_cache LLM response cache statistics (response_cache_stats)');
+        cache.meta.push('# TYPE deepseek_response_cache gauge');
       }
-    });
+      for (const [stat, value] of Object.entries(worker.cache)) {
+        if (typeof value === 'number') {
+          cache.samples.push(`deepseek_response_cache{${label},stat="${stat}"} ${value}`);
+        }
+      }
+    }
+  }
 
-    pythonProcess.on('error', (err) => {
-      console.error('Python process error in generateCurrentStepCode:', err);
-      reject(new Error(`Process error: ${err.message}`));
-    });
-  });
+  const lines = [];
+  for (const { meta, samples } of families.values()) {
+    lines.push(...meta, ...samples);
+  }
+  return lines.join('\n') + '\n';
 }
 
-async function refineAllStepCode(task_prompt, all_step_code) {
-  return new Promise((resolve, reject) => {
-    const pythonProcess = spawn('python', [
-      '-c',
-      `from deepseek_agent.api import refine_all_step_code; import sys; print(refine_all_step_code(${JSON.stringify(task_prompt)}, ${JSON.stringify(all_step_code)}))`
-    ], {
-      cwd: path.join(__dirname, '..'),
-      env: {
-        ...process.env,
-        PYTHONIOENCODING: 'utf-8',
-      }
-    });
-
-    let output = '';
-    let error = '';
+// 固定数据集直到调用返回的函数，期间清理上传目录时不删除它们
+function pinDatasets(dataset_paths) {
+  const id = nextPinId++;
+  pinnedDatasets.set(id, datasetPaths(dataset_paths));
+  return () => pinnedDatasets.delete(id);
+}
 
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString('utf8');
+// 清理一次上传目录，返回storage_janitor.py的清理结果和新标记的数据集记录数；同一时刻只有一次清理
+function cleanUploads() {
+  if (!janitorRunning) {
+    janitorRunning = runUploadJanitor().finally(() => {
+      janitorRunning = null;
     });
+  }
+  return janitorRunning;
+}
 
-    pythonProcess.stderr.on('data', (data) => {
-      error += data.toString('utf8');
+async function runUploadJanitor() {
+  uploadStore.cleanup();
+  const report = await new Promise((resolve, reject) => {
+    const child = spawn(process.env.PYTHON_BIN || 'python',
+      [path.join(__dirname, 'storage_janitor.py'), path.resolve(UPLOAD_DIR), '--pinned'],
+      { stdio: ['pipe', 'pipe', 'inherit'] });
+    let output = '';
+    child.stdout.on('data', (data) => {
+      output += data;
     });
-
-    pythonProcess.on('close', (code) => {
+    child.on('error', reject);
+    child.on('close', (code) => {
       if (code !== 0) {
-        reject(new Error(error));
-      } else {
-        resolve(output.trim());
+        return reject(new Error(`storage_janitor.py exited with code ${code}`));
+      }
+      try {
+        resolve(JSON.parse(output.trim().split('\n').pop()));
+      } catch (error) {
+        reject(error);
       }
     });
+    child.stdin.end(JSON.stringify([...pinnedDatasets.values()].flat()));
   });
+
+  // 文件已被清理（或以其他方式删除）的数据集记录标记evictedAt，不再当作可用的数据集
+  const datasets = await Dataset.find({ evictedAt: null }, { filePath: 1 });
+  const evicted = datasets
+    .filter((dataset) => !fs.existsSync(path.resolve(dataset.filePath)))
+    .map((dataset) => dataset._id);
+  if (evicted.length > 0) {
+    await Dataset.updateMany({ _id: { $in: evicted } }, { evictedAt: new Date() });
+  }
+  return { ...report, evictedDatasets: evicted.length };
 }
 
-async function checkCode(code) {
-  return new Promise((resolve) => {
-    const pythonProcess = spawn('python', [
-      '-c',
-      `from deepseek_agent.api import check_code; import sys, json; print(json.dumps(check_code(${JSON.stringify(code)})))`
-    ], {
-      cwd: path.join(__dirname, '..'),
-      env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
-    });
+if (STORAGE_JANITOR_INTERVAL > 0) {
+  setInterval(() => {
+    cleanUploads().catch((error) => console.error('Storage janitor failed:', error));
+  }, STORAGE_JANITOR_INTERVAL * 1000).unref();
+}
 
-    let output = '';
-    let error = '';
+// 辅助函数：调用Python模块
+// dataset_paths的结构摘要会附在规划和代码生成的提示词中
+async function planForMachineTask(task_prompt, dataset_paths) {
+  return pythonPool.call('plan_for_machine_task', [task_prompt, datasetPaths(dataset_paths)]);
+}
 
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString('utf8');
-    });
+function datasetPaths(dataset_paths) {
+  return (dataset_paths || []).map((datasetPath) => path.resolve(datasetPath));
+}
 
-    pythonProcess.stderr.on('data', (data) => {
-      // 实时捕获并打印错误
-      error += data.toString('utf8');
-      console.error(`Python Stderr (checkCode): ${data.toString('utf8')}`);
-    });
+async function analyzeStepDependencies(plans) {
+  try {
+    return await pythonPool.call('analyze_step_dependencies', [plans]);
+  } catch (error) {
+    // 分析失败时按顺序依赖处理，不做推测生成
+    console.error('Python worker error in analyzeStepDependencies:', error);
+    return plans.map((plan, i) => Array.from({ length: i }, (_, j) => j + 1));
+  }
+}
 
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        // 当进程以非0代码退出时，也认为是失败
-        resolve({ success: false, stderr: error });
-      } else {
-        try {
-          const result = JSON.parse(output.trim());
-          resolve(result);
-        } catch (e) {
-          // 如果JSON解析失败，说明有严重问题
-          resolve({ success: false, stderr: `Failed to parse checker output. Raw: ${output}. Error: ${error}` });
-        }
-      }
-    });
+// 传入onDelta时使用流式版本，模型输出的每个增量都会回调onDelta
+async function generateCurrentStepCode(task_prompt, current_step, step_id, previous_code, dataset_paths, onDelta) {
+  const method = onDelta ? 'generate_current_step_code_stream' : 'generate_current_step_code';
+  const args = [task_prompt, current_step, step_id, previous_code, datasetPaths(dataset_paths)];
+  const code = await pythonPool.call(method, args, {}, { onDelta });
+  return code.trim();
+}
 
-    pythonProcess.on('error', (err) => {
-      console.error('Python process error in checkCode:', err);
-      resolve({ success: false, stderr: `Process error: ${err.message}` });
-    });
-  });
+async function refineAllStepCode(task_prompt, all_step_code, onDelta) {
+  const method = onDelta ? 'refine_all_step_code_stream' : 'refine_all_step_code';
+  const code = await pythonPool.call(method, [task_prompt, all_step_code], {}, { onDelta });
+  return code.trim();
 }
 
-async function reviseCode(task_prompt, code, error_log) {
-  return new Promise((resolve, reject) => {
-    const pythonProcess = spawn('python', [
-      '-c',
-      `from deepseek_agent.api import revise_code; import sys; print(revise_code(${JSON.stringify(task_prompt)}, ${JSON.stringify(code)}, ${JSON.stringify(error_log)}))`
-    ], {
-      cwd: path.join(__dirname, '..'),
-      env: {
-        ...process.env,
-        PYTHONIOENCODING: 'utf-8',
-      }
-    });
+async function checkStepCode(sessionId, code, previous_code, reset = false) {
+  try {
+    return await pythonPool.call('check_step_code', [sessionId, code, previous_code, reset], {}, { affinity: sessionId });
+  } catch (error) {
+    console.error('Python worker error in checkStepCode:', error);
+    return { success: false, stderr: `Process error: ${error.message}` };
+  }
+}
 
-    let output = '';
-    let error = '';
+function closeCheckSession(sessionId) {
+  pythonPool.call('close_check_session', [sessionId], {}, { affinity: sessionId, unpin: true })
+    .catch((error) => console.error('Failed to close check session:', error));
+}
 
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString('utf8');
-    });
+async function reviseCode(task_prompt, code, error_log, onDelta) {
+  const method = onDelta ? 'revise_code_stream' : 'revise_code';
+  const revisedCode = await pythonPool.call(method, [task_prompt, code, error_log], {}, { onDelta });
+  return revisedCode.trim();
+}
 
-    pythonProcess.stderr.on('data', (data) => {
-      error += data.toString('utf8');
-    });
+async function datasetProfile(filePath) {
+  try {
+    return await pythonPool.call('dataset_profile', [path.resolve(filePath)]);
+  } catch (error) {
+    console.error('Failed to profile dataset:', error);
+    return null;
+  }
+}
 
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(error));
-      } else {
-        resolve(output.trim());
-      }
-    });
-  });
+async function repairCode(task_prompt, code, error_log) {
+  const result = await pythonPool.call('repair_code', [task_prompt, code, error_log]);
+  return { ...result, code: result.code.trim() };
 }
 
 // 添加指标分析API端点
@@ -614,59 +823,33 @@ app.post('/api/analyze-metrics', async (req, res) => {
   }
 });
 
-// 添加指标分析函数
-async function analyzeTaskMetrics(task_prompt) {
-  return new Promise((resolve, reject) => {
-    const pythonProcess = spawn('python', [
-      '-c',
-      `
-import sys
-if sys.stdout.encoding is None or sys.stdout.encoding.lower() != 'utf-8':
-    sys.stdout = open(sys.stdout.fileno(), mode='w', encoding='utf-8', buffering=1)
-import os
-sys.path.append(os.getcwd())
-from deepseek_agent.api import analyze_task_metrics
-import json
-
-try:
-    metrics_data = analyze_task_metrics('''${task_prompt}''')
-    print(json.dumps(metrics_data, ensure_ascii=False))
-except Exception as e:
-    print(json.dumps({"error": str(e)}))
-      `
-    ], {
-      cwd: path.join(__dirname, '..'),
-      env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
-    });
+// 批量指标分析：返回与task_prompts一一对应的 { success, result, error }，单个任务失败不影响其他任务
+app.post('/api/analyze-metrics/batch', async (req, res) => {
+  try {
+    const { task_prompts } = req.body;
 
-    let output = '';
-    let errorOutput = '';
+    if (!Array.isArray(task_prompts) || task_prompts.length === 0) {
+      return res.status(400).json({ error: 'task_prompts must be a non-empty array' });
+    }
+    if (task_prompts.length > METRICS_BATCH_MAX_TASKS) {
+      return res.status(413).json({ error: `At most ${METRICS_BATCH_MAX_TASKS} task prompts per request` });
+    }
 
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString('utf8');
-    });
+    const results = await analyzeTaskMetricsBatch(task_prompts);
+    res.json({ results });
+  } catch (error) {
+    console.error('Error analyzing metrics batch:', error);
+    res.status(500).json({ error: 'Failed to analyze metrics' });
+  }
+});
 
-    pythonProcess.stderr.on('data', (data) => {
-      errorOutput += data.toString('utf8');
-    });
+// 添加指标分析函数
+async function analyzeTaskMetrics(task_prompt) {
+  return pythonPool.call('analyze_task_metrics', [task_prompt]);
+}
 
-    pythonProcess.on('close', (code) => {
-      if (code === 0) {
-        try {
-          const metrics_data = JSON.parse(output.trim());
-          if (metrics_data.error) {
-            reject(new Error(metrics_data.error));
-          } else {
-            resolve(metrics_data);
-          }
-        } catch (parseError) {
-          reject(new Error('Failed to parse metrics data'));
-        }
-      } else {
-        reject(new Error(`Python process failed: ${errorOutput}`));
-      }
-    });
-  });
+async function analyzeTaskMetricsBatch(task_prompts) {
+  return pythonPool.call('analyze_task_metrics_batch', [task_prompts]);
 }
 
 // 基于用户反馈自动改进代码
@@ -676,28 +859,12 @@ app.post('/api/feedback', async (req, res) => {
     if (!code || !feedback || !task_prompt) {
       return res.status(400).json({ message: '缺少必要参数' });
     }
-    const { spawn } = require('child_process');
-    let output = '';
-    let error = '';
-    const pythonProcess = spawn('python', [
-      '-c',
-      `from deepseek_agent.api import revise_code; import sys; print(revise_code(${JSON.stringify(task_prompt)}, ${JSON.stringify(code)}, ${JSON.stringify(feedback)}))`
-    ], {
-      cwd: path.join(__dirname, '..'),
-      env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
-    });
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString('utf8');
-    });
-    pythonProcess.stderr.on('data', (data) => {
-      error += data.toString('utf8');
-    });
-    pythonProcess.on('close', (codeNum) => {
-      if (codeNum !== 0) {
-        return res.status(500).json({ message: 'Python revise code error', error });
-      }
-      res.json({ revised_code: output.trim() });
-    });
+    try {
+      const revisedCode = await reviseCode(task_prompt, code, feedback);
+      res.json({ revised_code: revisedCode });
+    } catch (error) {
+      res.status(500).json({ message: 'Python revise code error', error: error.message });
+    }
   } catch (err) {
     res.status(500).json({ message: 'Server error', error: err.message });
   }
@@ -710,26 +877,8 @@ app.post('/api/evaluate-instruction-following', async (req, res) => {
     return res.status(400).json({ error: 'solution and generated_code are required' });
   }
   try {
-    const pythonProcess = spawn('python', [
-      '-c',
-      `from deepseek_agent.api import evaluate_instruction_following; import json; print(json.dumps(evaluate_instruction_following(${JSON.stringify(solution)}, ${JSON.stringify(generated_code)})))`
-    ], {
-      cwd: path.join(__dirname, '..'),
-      env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
-    });
-
-    let output = '';
-    pythonProcess.stdout.on('data', (data) => { output += data.toString('utf8'); });
-    pythonProcess.stderr.on('data', (data) => { console.error('stderr:', data.toString('utf8')); });
-
-    pythonProcess.on('close', (code) => {
-      try {
-        const result = JSON.parse(output.trim());
-        res.json(result);
-      } catch (e) {
-        res.status(500).json({ error: 'Failed to parse python output', raw: output });
-      }
-    });
+    const result = await pythonPool.call('evaluate_instruction_following', [solution, generated_code]);
+    res.json(result);
   } catch (err) {
     res.status(500).json({ error: err.message });
   }
@@ -737,4 +886,9 @@ app.post('/api/evaluate-instruction-following', async (req, res) => {
 
 server.listen(port, () => {
   console.log(`Server is running on port ${port}`);
-}); 
\ No newline at end of file
+});
+
+process.on('SIGINT', () => {
+  pythonPool.close();
+  process.exit(0);
+});
\ No newline at end of file
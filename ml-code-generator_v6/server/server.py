@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
 import sys
@@ -6,12 +6,22 @@ import sys
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(current_dir)
 sys.path.append(project_root)
-from deepseek_agent.api import run, revise_code
+from deepseek_agent.api import run, revise_code, response_cache_stats, telemetry_metrics, GenerationCancelled, \
+    CHECK_SESSION_ROOT
+from deepseek_agent.dataset_profile import dataset_index
+from deepseek_agent.sampling import CHECK_SAMPLE_DIR
+from deepseek_agent.sandbox import sandbox_pool
 import tempfile
 import shutil
+import uuid
+import json
+import re
 from feedback_api import feedback_api
 from solution_api import solution_api
-from rerun_logic import rerun_task
+from rerun_logic import rerun_task, save_task, artifact_store
+from job_queue import JobQueue, QueueFull, SUCCEEDED, FAILED, CANCELLED, FINISHED_STATES
+from upload_store import ContentStore, UploadError
+import storage_janitor as janitor
 
 app = Flask(__name__)
 CORS(app)
@@ -20,9 +30,90 @@ CORS(app)
 UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'ml_code_generator')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# 上传的文件按内容哈希保存在 UPLOAD_FOLDER/.store 中，UPLOAD_FOLDER中的文件名是它的硬链接
+upload_store = ContentStore(os.path.join(UPLOAD_FOLDER, '.store'))
+
 app.register_blueprint(feedback_api)
 app.register_blueprint(solution_api)
 
+# 代码生成在后台任务队列中执行，不占用请求线程
+job_queue = JobQueue(cancelled_exceptions=(GenerationCancelled,))
+
+# 重跑请求先等待这么久（秒）：没有变化或变化很小的重跑直接返回结果，否则返回任务ID供轮询
+RERUN_INLINE_WAIT = float(os.getenv('RERUN_INLINE_WAIT', '1'))
+
+# SSE连接上没有新事件时发送保活注释的间隔（秒）
+SSE_KEEPALIVE_INTERVAL = float(os.getenv('SSE_KEEPALIVE_INTERVAL', '15'))
+
+# 排队或执行中的任务ID -> 任务使用的数据集，清理存储时不删除这些数据集
+_job_datasets = {}
+
+
+def _pinned_datasets():
+    pinned = []
+    for job_id, paths in list(_job_datasets.items()):
+        job = job_queue.get(job_id)
+        if job is None or job.status in FINISHED_STATES:
+            _job_datasets.pop(job_id, None)
+        else:
+            pinned.extend(paths)
+    return pinned
+
+
+def _submit_job(dataset_paths, func, *args):
+    # 提交前先记录一次访问，固定之前不会因为很久没有使用而被清理
+    dataset_paths = [path for path in dataset_paths if path]
+    for path in dataset_paths:
+        storage_janitor.touch(path)
+    job = job_queue.submit(func, *args)
+    _job_datasets[job.id] = dataset_paths
+    return job
+
+
+# 这里只清理Flask自己的上传目录；Node服务的上传目录由Node清理（它知道哪些数据集正在使用，并维护数据集记录）。
+# 样本、会话、画像和沙箱目录位于CHECK_ROOT下，与Node的Python工作进程共用，按访问时间和进程是否存活判断是否在使用
+storage_janitor = janitor.StorageJanitor([
+    janitor.Area('uploads', UPLOAD_FOLDER, janitor.FILES, janitor.STORAGE_UPLOAD_QUOTA, janitor.STORAGE_UPLOAD_TTL,
+                 store=os.path.join('.store', 'objects')),
+    janitor.Area('samples', CHECK_SAMPLE_DIR, janitor.FILES, janitor.STORAGE_CACHE_QUOTA, janitor.STORAGE_CACHE_TTL),
+    janitor.Area('sessions', CHECK_SESSION_ROOT, janitor.DIRECTORIES, ttl=janitor.STORAGE_SESSION_TTL),
+    janitor.Area('sandboxes', sandbox_pool.root, janitor.SANDBOXES),
+    janitor.Area('profiles', dataset_index.root, janitor.PROFILES),
+    janitor.Area('artifacts', artifact_store.root, janitor.FILES, ttl=janitor.STORAGE_ARTIFACT_TTL),
+], pinned=_pinned_datasets, hooks=[upload_store.cleanup])
+storage_janitor.start()
+
+def _dataset_metadata(profile):
+    candidates = profile['target_candidates']
+    return {
+        'rowCount': profile['rows'],
+        'columnCount': profile['columns'],
+        'features': profile['header'],
+        'hasHeader': profile['has_header'],
+        'targetVariable': candidates[0]['column'] if candidates else None,
+        'targetCandidates': candidates,
+        'contentHash': profile['sha256'],
+    }
+
+
+def _dataset_info(filename):
+    # 画像在上传时已经计算好，文件未变化时直接从索引读出；其他方式放进目录的文件在第一次列出时计算一次
+    file_path = os.path.join(UPLOAD_FOLDER, filename)
+    info = dataset_index.info(file_path)
+    if filename.lower().endswith(('.csv', '.tsv')):
+        metadata = _dataset_metadata(dataset_index.profile(file_path))
+    else:
+        metadata = {'rowCount': 0, 'columnCount': 0, 'features': []}
+    return {
+        'id': filename,
+        'name': filename,
+        'filePath': file_path,
+        'type': info.get('type', 'uploaded'),
+        'description': info.get('description', ''),
+        'metadata': metadata,
+    }
+
+
 @app.route('/api/datasets', methods=['POST', 'GET'])
 def datasets_route():
     if request.method == 'POST':
@@ -34,48 +125,161 @@ def datasets_route():
             if file.filename == '':
                 return jsonify({'error': 'No selected file'}), 400
 
-            # 保存文件
-            file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-            file.save(file_path)
+            filename = _upload_filename(file.filename)
+            if filename is None:
+                return jsonify({'error': 'Invalid filename'}), 400
+
+            # 边写边计算内容哈希，内容已存在时只建立硬链接
+            object_path, sha256 = upload_store.ingest(file.stream)
+            file_path = upload_store.link(object_path, os.path.join(UPLOAD_FOLDER, filename))
             print(f"File saved to: {file_path}")
 
-            return jsonify({
-                'id': file.filename,
-                'name': file.filename,
-                'filePath': file_path,
+            return jsonify(_save_dataset(filename, sha256, {
                 'type': request.form.get('type', 'training'),
                 'description': request.form.get('description', ''),
-                'metadata': {
-                    'rowCount': 0,  # 这里可以添加实际的行数统计
-                    'columnCount': 0,  # 这里可以添加实际的列数统计
-                    'features': []  # 这里可以添加实际的特征列表
-                }
-            })
+            }))
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
     elif request.method == 'GET':
         try:
             files_info = []
-            for filename in os.listdir(UPLOAD_FOLDER):
-                file_path = os.path.join(UPLOAD_FOLDER, filename)
-                if os.path.isfile(file_path):
-                    files_info.append({
-                        'id': filename,
-                        'name': filename,
-                        'filePath': file_path,
-                        'type': 'uploaded', # 可以根据需要设置类型
-                        'description': '', # 可以根据需要添加描述
-                        'metadata': { # 可以根据需要添加元数据
-                            'rowCount': 0,
-                            'columnCount': 0,
-                            'features': []
-                        }
-                    })
+            for entry in os.scandir(UPLOAD_FOLDER):
+                if entry.is_file():
+                    files_info.append(_dataset_info(entry.name))
             return jsonify(files_info)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+
+@app.route('/api/datasets/<name>/preview', methods=['GET'])
+def dataset_preview_route(name):
+    file_path = os.path.join(UPLOAD_FOLDER, os.path.basename(name))
+    if not os.path.isfile(file_path):
+        return jsonify({'error': 'Dataset not found'}), 404
+    storage_janitor.touch(file_path)
+    try:
+        profile = dataset_index.profile(file_path)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'headers': profile['header'],
+        'data': [dict(zip(profile['header'], row)) for row in profile['head']],
+        'totalRows': profile['rows'],
+        'columns': profile['column_profiles'],
+    })
+
+def _upload_filename(name):
+    # 只保留文件名部分，隐藏文件名（包括 .store）不允许使用
+    name = os.path.basename(name or '')
+    return name if name and not name.startswith('.') else None
+
+
+def _save_dataset(filename, sha256, info):
+    file_path = os.path.join(UPLOAD_FOLDER, filename)
+    dataset_index.set_info(file_path, **info)
+    # 相同内容之前上传过时直接使用已有的画像，不再读取文件
+    if filename.lower().endswith(('.csv', '.tsv')):
+        dataset_index.profile(file_path, sha256)
+    return _dataset_info(filename)
+
+
+def _upload_response(upload, status=200):
+    return jsonify({**upload, 'complete': False}), status, {'Upload-Offset': str(upload['offset'])}
+
+
+def _finish_upload(upload_id):
+    object_path, sha256, meta = upload_store.finish(upload_id)
+    upload_store.link(object_path, os.path.join(UPLOAD_FOLDER, meta['filename']))
+    return jsonify({'complete': True, 'sha256': sha256,
+                    'dataset': _save_dataset(meta['filename'], sha256, meta['info'])})
+
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload_route():
+    '''
+    开始分块上传：{"filename", "size", "sha256"(可选), "type", "description"}
+    提供的sha256已在存储中时不需要上传内容，直接返回数据集；否则返回上传ID，
+    之后用 PATCH /api/uploads/<id>（请求头 Upload-Offset 为分块的起始偏移，请求体为分块内容）依次上传
+    '''
+    data = request.get_json(silent=True) or {}
+    filename = _upload_filename(data.get('filename'))
+    if filename is None:
+        return jsonify({'error': 'Invalid filename'}), 400
+    info = {'type': data.get('type', 'training'), 'description': data.get('description', '')}
+
+    object_path = upload_store.lookup(data.get('sha256'))
+    if object_path is not None:
+        upload_store.link(object_path, os.path.join(UPLOAD_FOLDER, filename))
+        return jsonify({'complete': True, 'sha256': data['sha256'].lower(),
+                        'dataset': _save_dataset(filename, data['sha256'].lower(), info)})
+
+    try:
+        upload = upload_store.create(filename, data.get('size'), data.get('sha256'), info)
+        if upload['size'] == 0:
+            return _finish_upload(upload['id'])
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return _upload_response(upload, 201)
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'HEAD'])
+def upload_status_route(upload_id):
+    # 断点续传：从返回的offset继续上传
+    try:
+        return _upload_response(upload_store.status(upload_id))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def upload_chunk_route(upload_id):
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Missing Upload-Offset header'}), 400
+
+    try:
+        upload = upload_store.write_chunk(upload_id, offset, request.stream)
+        if upload['offset'] == upload['size']:
+            return _finish_upload(upload_id)
+    except UploadError as e:
+        headers = {'Upload-Offset': str(e.offset)} if e.offset is not None else {}
+        return jsonify({'error': str(e), 'offset': e.offset}), e.status, headers
+    return _upload_response(upload)
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload_route(upload_id):
+    try:
+        upload_store.abort(upload_id)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({'id': upload_id, 'aborted': True})
+
+
+def generate_code_job(task_id, task_prompt, dataset_path, cancel_event=None, observer=None):
+    python_file_name = 'generated_code.py'
+    save_folder = os.path.dirname(dataset_path)
+    
+    result = run(task_prompt, python_file_name, save_folder, cancel_event=cancel_event, observer=observer,
+                 datasets=[dataset_path])
+    # 保存规划、步骤代码和检查结果，之后可通过 /api/rerun 增量重跑
+    save_task(task_id, task_prompt, dataset_path, python_file_name, result)
+    
+    return {
+        'task_id': task_id,
+        'code': result['code'],
+        'success': result['success'],
+        'stderr': result['stderr'],
+        'steps': {
+            'step1': ['导入必要的库'],
+            'step2': ['数据处理'],
+            'errorDebug': ['错误处理'],
+            'finally': ['模型评估']
+        }
+    }
+
 @app.route('/api/generate-code', methods=['POST'])
 def generate_code():
     try:
@@ -89,35 +293,129 @@ def generate_code():
         if not task_prompt or not dataset_path:
             return jsonify({'error': 'Missing required parameters'}), 400
 
-        # 生成代码
-        python_file_name = 'generated_code.py'
-        save_folder = os.path.dirname(dataset_path)
-        
-        run(task_prompt, python_file_name, save_folder)
-        
-        # 读取生成的代码
-        with open(os.path.join(save_folder, python_file_name), 'r') as f:
-            generated_code = f.read()
+        # 提交到后台任务队列，立即返回任务ID
+        task_id = uuid.uuid4().hex
+        try:
+            job = _submit_job([dataset_path], generate_code_job, task_id, task_prompt, dataset_path)
+        except QueueFull as e:
+            return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
 
         return jsonify({
-            'code': generated_code,
-            'steps': {
-                'step1': ['导入必要的库'],
-                'step2': ['数据处理'],
-                'errorDebug': ['错误处理'],
-                'finally': ['模型评估']
-            }
-        })
+            **job.to_dict(),
+            'task_id': task_id,
+            'status_url': f'/api/jobs/{job.id}',
+            'result_url': f'/api/jobs/{job.id}/result',
+            'events_url': f'/api/jobs/{job.id}/events',
+        }), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs', methods=['GET'])
+def jobs_stats():
+    return jsonify(job_queue.stats())
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status == SUCCEEDED:
+        return jsonify(job.result)
+    if job.status == FAILED:
+        return jsonify({'error': job.error, **job.to_dict()}), 500
+    if job.status == CANCELLED:
+        return jsonify({'error': 'Job was cancelled', **job.to_dict()}), 409
+    # 尚未完成
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    '''
+    以Server-Sent Events推送任务进度，事件名与WebSocket接口一致；任务结束后以job-finished事件结束。
+    断线重连时浏览器会带上Last-Event-ID，从该事件之后继续推送
+    '''
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('after') or 0)
+
+    def stream():
+        after = last_event_id
+        while True:
+            events = job.wait_events(after, timeout=SSE_KEEPALIVE_INTERVAL)
+            for event_id, event, data in events:
+                yield f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n'
+                after = event_id
+            if job.done_event.is_set() and after >= len(job.events):
+                return
+            if not events:
+                # 注释行，防止代理因长时间没有数据而断开连接
+                yield ': keepalive\n\n'
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/api/rerun', methods=['POST'])
 def rerun():
     data = request.json
     task_id = data.get('task_id')
     params = data.get('params')
-    result = rerun_task(task_id, params)
-    return jsonify(result)
+    if not task_id:
+        return jsonify({'error': 'Missing required parameters'}), 400
+
+    record = artifact_store.load(task_id) if re.fullmatch(r'[A-Za-z0-9_-]+', str(task_id)) else None
+    dataset_paths = [(params or {}).get('dataset_path'), (record or {}).get('dataset_path')]
+    try:
+        job = _submit_job(dataset_paths, rerun_task, task_id, params)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
+
+    if not job.wait(RERUN_INLINE_WAIT):
+        # 需要重新生成的步骤较多，转为后台任务
+        return jsonify({
+            **job.to_dict(),
+            'status_url': f'/api/jobs/{job.id}',
+            'result_url': f'/api/jobs/{job.id}/result',
+            'events_url': f'/api/jobs/{job.id}/events',
+        }), 202
+    if job.status == SUCCEEDED:
+        return jsonify(job.result)
+    return jsonify({'status': 'error', 'message': job.error or job.status, 'result': None}), 500
+
+@app.route('/api/storage', methods=['GET'])
+def storage_usage():
+    # 各存储区域的占用、容量上限、过期时间、固定的数据集和上一次清理的结果
+    return jsonify(storage_janitor.usage())
+
+@app.route('/api/storage/cleanup', methods=['POST'])
+def storage_cleanup():
+    return jsonify(storage_janitor.run())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache_stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus抓取接口；?format=json 时返回JSON快照
+    if request.args.get('format') == 'json':
+        return jsonify(telemetry_metrics('json'))
+    return Response(telemetry_metrics('prometheus'), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/feedback', methods=['POST'])
 def feedback():
@@ -0,0 +1,375 @@
+"""
+存储清理
+
+上传目录、检查时的数据集样本、增量检查会话目录、沙箱目录和任务产物都只会增加，不会自动删除。
+后台线程定期扫描这些目录（区域），每个区域可以设置：
+- 过期时间：最后一次访问距今超过这么久的内容被删除
+- 容量上限：总大小超过上限时按最后一次访问时间从旧到新删除（LRU），直到低于上限
+
+最后一次访问时间取文件的访问、修改和状态变化时间中最晚的一个（noatime挂载时访问时间不会自动更新，
+使用数据集的地方调用touch显式更新）。正在执行的任务使用的数据集被固定（pinned），不会被删除；
+最近STORAGE_MIN_AGE秒内访问过的内容也不删除，避免删掉其他进程（如Node服务）正在使用的文件。
+
+上传目录中的文件是内容存储（见upload_store.py）中对象的硬链接：同一内容的文件名和对象作为一个整体统计大小和删除，
+没有任何文件名链接的对象直接删除。
+
+每个进程只清理自己的上传目录：Flask服务在后台线程中清理，Node服务定期以命令行方式运行本模块清理 server/uploads，
+固定的路径（进行中的会话使用的数据集）从标准输入传入，清理后由Node标记文件已被删除的数据集记录。
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+
+STORAGE_JANITOR_INTERVAL = float(os.getenv('STORAGE_JANITOR_INTERVAL', '600'))
+STORAGE_MIN_AGE = float(os.getenv('STORAGE_MIN_AGE', '3600'))
+STORAGE_UPLOAD_QUOTA = int(os.getenv('STORAGE_UPLOAD_QUOTA', str(10 * 1024 ** 3)))
+STORAGE_UPLOAD_TTL = float(os.getenv('STORAGE_UPLOAD_TTL', str(30 * 24 * 3600)))
+STORAGE_CACHE_QUOTA = int(os.getenv('STORAGE_CACHE_QUOTA', str(2 * 1024 ** 3)))
+STORAGE_CACHE_TTL = float(os.getenv('STORAGE_CACHE_TTL', str(7 * 24 * 3600)))
+STORAGE_SESSION_TTL = float(os.getenv('STORAGE_SESSION_TTL', str(24 * 3600)))
+STORAGE_ARTIFACT_TTL = float(os.getenv('STORAGE_ARTIFACT_TTL', str(30 * 24 * 3600)))
+
+# 区域类型
+FILES = 'files'              # 目录中的每个文件（硬链接到同一内容的文件算作一个）
+DIRECTORIES = 'directories'  # 目录中的每个子目录
+SANDBOXES = 'sandboxes'      # 沙箱目录，创建它的进程已退出时删除
+PROFILES = 'profiles'        # 数据集画像索引，删除已不存在的文件的记录和不再被引用的画像
+
+
+class Area:
+    '''
+    一个需要清理的目录
+
+    Params:
+        name: 区域名称（用于统计）
+        path: 目录
+        kind: FILES | DIRECTORIES | SANDBOXES | PROFILES
+        quota: 容量上限（字节），None表示不限
+        ttl: 过期时间（秒），None表示不过期
+        store: kind为FILES时，内容存储对象目录（相对于path），其中的对象与链接到它的文件一起统计
+    '''
+
+    def __init__(self, name, path, kind=FILES, quota=None, ttl=None, store=None):
+        self.name = name
+        self.path = path
+        self.kind = kind
+        self.quota = quota
+        self.ttl = ttl
+        self.store = store
+
+
+class StorageJanitor:
+    '''
+    后台存储清理
+
+    Params:
+        areas: 要清理的Area列表
+        pinned: 返回当前固定的路径的函数（如正在执行的任务使用的数据集）
+        interval: 两次清理的间隔（秒），不大于0时不启动后台线程
+        min_age: 最近这么多秒内访问过的内容不删除
+        hooks: 每次清理时额外调用的函数（如清理未完成的分块上传）
+    '''
+
+    def __init__(self, areas, pinned=None, interval=STORAGE_JANITOR_INTERVAL, min_age=STORAGE_MIN_AGE, hooks=()):
+        self.areas = list(areas)
+        self.pinned = pinned or (lambda: ())
+        self.interval = interval
+        self.min_age = min_age
+        self.hooks = list(hooks)
+        self.last_run = None
+        self._run_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='storage-janitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def touch(self, path):
+        '''
+        记录一次访问：把path的访问时间设为现在（修改时间不变）
+        '''
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            pass
+
+    def run(self):
+        '''
+        执行一次清理
+
+        Returns:
+            report: {"started_at", "duration", "areas": {区域名称: {"removed", "freed_bytes", "errors"}}}
+        '''
+        with self._run_lock:
+            started = time.time()
+            for hook in self.hooks:
+                try:
+                    hook()
+                except Exception as e:
+                    print(f'Storage janitor hook failed: {e}')
+
+            pinned = {os.path.realpath(path) for path in self.pinned() if path}
+            areas = {}
+            for area in self.areas:
+                stats = {'removed': 0, 'freed_bytes': 0, 'errors': 0}
+                if os.path.isdir(area.path):
+                    if area.kind == SANDBOXES:
+                        self._clean_sandboxes(area, stats)
+                    elif area.kind == PROFILES:
+                        self._clean_profiles(area, stats)
+                    else:
+                        self._evict(area, pinned, started, stats)
+                areas[area.name] = stats
+
+            self.last_run = {'started_at': started, 'duration': round(time.time() - started, 3), 'areas': areas}
+            return self.last_run
+
+    def usage(self):
+        '''
+        各区域的占用情况和上一次清理的结果
+        '''
+        pinned = {os.path.realpath(path) for path in self.pinned() if path}
+        areas = []
+        for area in self.areas:
+            units = self._units(area) if os.path.isdir(area.path) and area.kind in (FILES, DIRECTORIES) else []
+            usage = {
+                'name': area.name,
+                'path': os.path.abspath(area.path),
+                'kind': area.kind,
+                'quota': area.quota,
+                'ttl': area.ttl,
+                'bytes': sum(unit['size'] for unit in units) if units else _tree_size(area.path),
+                'entries': len(units),
+                'pinned': sum(1 for unit in units if _is_pinned(unit, pinned)),
+            }
+            if units:
+                usage['oldest_access'] = min(unit['accessed'] for unit in units)
+            if os.path.isdir(area.path):
+                disk = shutil.disk_usage(area.path)
+                usage['disk'] = {'total': disk.total, 'free': disk.free}
+            areas.append(usage)
+        return {'areas': areas, 'pinned': sorted(pinned), 'min_age': self.min_age,
+                'interval': self.interval, 'last_run': self.last_run}
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run()
+            except Exception as e:
+                print(f'Storage janitor failed: {e}')
+
+    def _evict(self, area, pinned, now, stats):
+        units = self._units(area)
+        total = sum(unit['size'] for unit in units)
+        candidates = sorted((unit for unit in units
+                             if not _is_pinned(unit, pinned) and now - unit['accessed'] >= self.min_age),
+                            key=lambda unit: unit['accessed'])
+
+        for unit in candidates:
+            expired = area.ttl is not None and now - unit['accessed'] > area.ttl
+            over_quota = area.quota is not None and total > area.quota
+            # 没有文件名链接的内容存储对象也直接删除
+            if not (expired or over_quota or unit.get('orphan')):
+                continue
+            if self._remove(unit['paths'], stats):
+                total -= unit['size']
+                stats['freed_bytes'] += unit['size']
+
+    def _units(self, area):
+        '''
+        区域中可以单独删除的内容：{"paths", "size", "accessed"}，按最后一次访问时间淘汰
+        '''
+        if area.kind == DIRECTORIES:
+            units = []
+            for entry in os.scandir(area.path):
+                if entry.is_dir(follow_symlinks=False):
+                    size, accessed = _tree_stats(entry.path)
+                    units.append({'paths': [entry.path], 'size': size, 'accessed': accessed})
+            return units
+
+        # 按inode合并：同一内容的多个硬链接和存储中的对象一起删除
+        inodes = {}
+        for entry in os.scandir(area.path):
+            if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                _add_file(inodes, entry.path, entry.stat(follow_symlinks=False), False)
+        if area.store:
+            for root, _, files in os.walk(os.path.join(area.path, area.store)):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        _add_file(inodes, path, os.stat(path, follow_symlinks=False), True)
+                    except FileNotFoundError:
+                        continue
+        units = list(inodes.values())
+        for unit in units:
+            links, objects = unit.pop('links'), unit.pop('objects')
+            unit['orphan'] = links == 1 and objects == 1
+        return units
+
+    def _remove(self, paths, stats):
+        try:
+            for path in paths:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f'Storage janitor could not remove {paths}: {e}')
+            stats['errors'] += 1
+            return False
+        stats['removed'] += 1
+        return True
+
+    def _clean_sandboxes(self, area, stats):
+        # 沙箱目录名为 sandbox_<进程ID>_<随机后缀>，进程已退出（崩溃、被杀掉）时没有机会删除自己的沙箱
+        for entry in os.scandir(area.path):
+            parts = entry.name.split('_')
+            if len(parts) < 3 or parts[0] != 'sandbox' or not parts[1].isdigit() or _pid_alive(int(parts[1])):
+                continue
+            size, _ = _tree_stats(entry.path)
+            if self._remove([entry.path], stats):
+                stats['freed_bytes'] += size
+
+    def _clean_profiles(self, area, stats):
+        # 文件已被删除的路径记录没有用了；不再被任何路径引用的画像在内容再次上传时会重新计算
+        referenced = set()
+        paths_dir = os.path.join(area.path, 'paths')
+        if os.path.isdir(paths_dir):
+            for entry in os.scandir(paths_dir):
+                record = _read_json(entry.path)
+                if record is None:
+                    continue
+                if os.path.exists(record.get('path', '')):
+                    referenced.add(record.get('sha256'))
+                    continue
+                size = entry.stat().st_size
+                if self._remove([entry.path], stats):
+                    stats['freed_bytes'] += size
+
+        now = time.time()
+        profiles_dir = os.path.join(area.path, 'profiles')
+        if os.path.isdir(profiles_dir):
+            for entry in os.scandir(profiles_dir):
+                stat = entry.stat()
+                if entry.name[:-len('.json')] in referenced or now - _accessed(stat) < self.min_age:
+                    continue
+                if self._remove([entry.path], stats):
+                    stats['freed_bytes'] += stat.st_size
+
+
+def _add_file(inodes, path, stat, is_object):
+    key = (stat.st_dev, stat.st_ino)
+    unit = inodes.get(key)
+    if unit is None:
+        unit = inodes[key] = {'paths': [], 'size': stat.st_size, 'accessed': _accessed(stat),
+                              'links': stat.st_nlink, 'objects': 0}
+    unit['paths'].append(path)
+    unit['objects'] += is_object
+
+
+def _accessed(stat):
+    return max(stat.st_atime, stat.st_mtime, stat.st_ctime)
+
+
+def _is_pinned(unit, pinned):
+    return any(os.path.realpath(path) in pinned for path in unit['paths'])
+
+
+def _tree_stats(path):
+    '''
+    目录下所有文件的总大小和最晚的访问时间
+    '''
+    size = 0
+    accessed = _accessed(os.stat(path))
+    for root, dirs, files in os.walk(path):
+        for names, is_file in ((dirs, False), (files, True)):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name), follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                accessed = max(accessed, _accessed(stat))
+                if is_file:
+                    size += stat.st_size
+    return size, accessed
+
+
+def _tree_size(path):
+    return _tree_stats(path)[0] if os.path.isdir(path) else 0
+
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        return _pid_alive_windows(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _pid_alive_windows(pid):
+    # Windows上os.kill(pid, 0)会向进程组发送CTRL_C_EVENT（可能包括本进程），不能用来探测，改为打开进程查询退出码
+    import ctypes
+    from ctypes import wintypes
+
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    ERROR_ACCESS_DENIED = 5
+    STILL_ACTIVE = 259
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = (wintypes.DWORD, wintypes.BOOL, wintypes.DWORD)
+    kernel32.GetExitCodeProcess.argtypes = (wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD))
+    kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        # 没有权限打开的进程仍然存在；其他错误（参数无效）表示进程已退出
+        return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+    try:
+        code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+            return True
+        return code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='清理一个上传目录一次，输出JSON格式的清理结果（Node服务用它清理自己的上传目录）')
+    parser.add_argument('folder')
+    parser.add_argument('--store', default=os.path.join('.store', 'objects'), help='内容存储对象目录（相对于folder）')
+    parser.add_argument('--quota', type=int, default=STORAGE_UPLOAD_QUOTA)
+    parser.add_argument('--ttl', type=float, default=STORAGE_UPLOAD_TTL)
+    parser.add_argument('--pinned', action='store_true', help='从标准输入读取固定的路径（JSON数组）')
+    args = parser.parse_args()
+
+    pinned = json.load(sys.stdin) if args.pinned else []
+    area = Area('uploads', args.folder, FILES, args.quota, args.ttl, store=args.store)
+    report = StorageJanitor([area], pinned=lambda: pinned, interval=0).run()
+    print(json.dumps(report))
@@ -0,0 +1,285 @@
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
+
+// 分块上传与按内容寻址的文件存储，目录结构与 server/upload_store.py 相同：
+// 分块写入 <root>/partial/<上传ID>.part，写入时顺序计算SHA-256，完成后移入 <root>/objects/<哈希前两位>/<哈希>，
+// 上传目录中的文件名是它的硬链接，同一内容上传多次只占用一份磁盘空间。
+// 已写入的偏移量以 .part 文件的大小为准，服务重启后可以继续上传（哈希在完成时重新计算）。
+// 所有文件名与对象共用一个inode：对象存入后设为只读，复用前再校验一次哈希（文件未变化时使用上次的结果），
+// 被改写过的对象从存储中移除，之后同一内容的上传重新传输并保存。
+const UPLOAD_CHUNK_SIZE = parseInt(process.env.UPLOAD_CHUNK_SIZE || String(8 * 1024 * 1024), 10);
+const UPLOAD_PARTIAL_TTL = parseFloat(process.env.UPLOAD_PARTIAL_TTL || String(24 * 3600));
+const OBJECT_MODE = 0o444;
+const SHA256_PATTERN = /^[0-9a-f]{64}$/;
+const UPLOAD_ID_PATTERN = /^[0-9a-f]{32}$/;
+
+class UploadError extends Error {
+  constructor(message, status = 400, offset = null) {
+    super(message);
+    this.status = status;
+    this.offset = offset;
+  }
+}
+
+class ContentStore {
+  constructor(root) {
+    this.root = root;
+    // 上传ID -> { offset, hash }，按顺序写入时增量计算哈希
+    this.hashers = new Map();
+    // 同一个上传的分块依次写入
+    this.busy = new Set();
+    // 对象路径 -> 校验通过时的 inode/大小/修改时间
+    this.verified = new Map();
+    fs.mkdirSync(path.join(root, 'objects'), { recursive: true });
+    fs.mkdirSync(path.join(root, 'partial'), { recursive: true });
+  }
+
+  objectPath(sha256) {
+    return path.join(this.root, 'objects', sha256.slice(0, 2), sha256);
+  }
+
+  // 已保存内容的路径，没有或内容已被改写时返回null
+  async lookup(sha256) {
+    sha256 = (sha256 || '').toLowerCase();
+    if (!SHA256_PATTERN.test(sha256)) {
+      return null;
+    }
+    const objectPath = this.objectPath(sha256);
+    return (await this.verify(objectPath, sha256)) ? objectPath : null;
+  }
+
+  create(filename, size, sha256, info) {
+    if (!Number.isInteger(size) || size < 0) {
+      throw new UploadError('size must be a non-negative integer');
+    }
+    if (sha256 && !SHA256_PATTERN.test(sha256.toLowerCase())) {
+      throw new UploadError('sha256 must be 64 hex characters');
+    }
+
+    this.cleanup();
+    const id = crypto.randomBytes(16).toString('hex');
+    const meta = { filename, size, sha256: sha256 ? sha256.toLowerCase() : null, info: info || {}, created_at: Date.now() / 1000 };
+    writeJson(this.metaPath(id), meta);
+    fs.writeFileSync(this.partPath(id), '');
+    this.hashers.set(id, { offset: 0, hash: crypto.createHash('sha256') });
+    return this.describe(id, meta);
+  }
+
+  status(id) {
+    return this.describe(id, this.meta(id));
+  }
+
+  // 从offset开始把可读流stream的内容写入上传，offset必须等于已写入的字节数
+  async writeChunk(id, offset, stream) {
+    const meta = this.meta(id);
+    if (this.busy.has(id)) {
+      throw new UploadError('Another chunk of this upload is being written', 409, this.size(id));
+    }
+    this.busy.add(id);
+    try {
+      const current = this.size(id);
+      if (offset !== current) {
+        throw new UploadError(`Upload offset is ${current}, got ${offset}`, 409, current);
+      }
+      const hasher = this.hashers.get(id);
+      // 服务重启或哈希与文件不一致时不再增量计算，完成时重新读取
+      const hash = hasher && hasher.offset === current ? hasher.hash : null;
+      this.hashers.delete(id);
+
+      const fd = fs.openSync(this.partPath(id), 'r+');
+      let written = current;
+      try {
+        for await (const data of stream) {
+          if (written + data.length > meta.size) {
+            fs.ftruncateSync(fd, current);
+            throw new UploadError('Chunk exceeds the declared upload size', 413, current);
+          }
+          fs.writeSync(fd, data, 0, data.length, written);
+          if (hash) {
+            hash.update(data);
+          }
+          written += data.length;
+        }
+      } finally {
+        fs.closeSync(fd);
+      }
+      if (hash) {
+        this.hashers.set(id, { offset: written, hash });
+      }
+      return this.describe(id, meta);
+    } finally {
+      this.busy.delete(id);
+    }
+  }
+
+  // 完成上传：校验哈希并移入存储，返回 { objectPath, sha256, meta }
+  async finish(id) {
+    const meta = this.meta(id);
+    const partPath = this.partPath(id);
+    const size = this.size(id);
+    if (size !== meta.size) {
+      throw new UploadError(`Upload is incomplete: ${size} of ${meta.size} bytes`, 409, size);
+    }
+
+    const hasher = this.hashers.get(id);
+    this.hashers.delete(id);
+    const sha256 = hasher && hasher.offset === size ? hasher.hash.digest('hex') : await fileSha256(partPath);
+    if (meta.sha256 && meta.sha256 !== sha256) {
+      this.abort(id);
+      throw new UploadError('Uploaded content does not match the declared sha256', 422);
+    }
+
+    const objectPath = await this.commit(partPath, sha256);
+    fs.rmSync(this.metaPath(id), { force: true });
+    return { objectPath, sha256, meta };
+  }
+
+  abort(id) {
+    this.meta(id);
+    fs.rmSync(this.partPath(id), { force: true });
+    fs.rmSync(this.metaPath(id), { force: true });
+    this.hashers.delete(id);
+  }
+
+  // 把已经完整写入磁盘的文件（如multer保存的上传）移入存储，返回 { objectPath, sha256 }
+  async ingestFile(filePath) {
+    const sha256 = await fileSha256(filePath);
+    return { objectPath: await this.commit(filePath, sha256), sha256 };
+  }
+
+  // 在dest建立指向objectPath的硬链接（已存在时原子地替换），不能建立硬链接时复制
+  link(objectPath, dest) {
+    fs.mkdirSync(path.dirname(path.resolve(dest)), { recursive: true });
+    const tmpPath = `${dest}.${crypto.randomBytes(8).toString('hex')}.tmp`;
+    try {
+      fs.linkSync(objectPath, tmpPath);
+    } catch (error) {
+      fs.copyFileSync(objectPath, tmpPath);
+    }
+    fs.renameSync(tmpPath, dest);
+    return dest;
+  }
+
+  // 删除超过UPLOAD_PARTIAL_TTL秒没有写入的未完成上传。.part 和 .json 作为整体过期：
+  // .json 只在创建时写入一次，以 .part 的修改时间（最后一次写入分块的时间）为准
+  cleanup() {
+    const deadline = Date.now() - UPLOAD_PARTIAL_TTL * 1000;
+    const partialDir = path.join(this.root, 'partial');
+    for (const name of fs.readdirSync(partialDir)) {
+      const filePath = path.join(partialDir, name);
+      const id = name.split('.')[0];
+      try {
+        const partPath = this.partPath(id);
+        const statPath = name === `${id}.json` && fs.existsSync(partPath) ? partPath : filePath;
+        if (fs.statSync(statPath).mtimeMs < deadline) {
+          fs.rmSync(filePath, { force: true });
+          this.hashers.delete(id);
+        }
+      } catch (error) {
+        // 同时被其他请求删除
+      }
+    }
+  }
+
+  async commit(filePath, sha256) {
+    const objectPath = this.objectPath(sha256);
+    fs.mkdirSync(path.dirname(objectPath), { recursive: true });
+    if (await this.verify(objectPath, sha256)) {
+      fs.rmSync(filePath, { force: true });
+    } else {
+      fs.renameSync(filePath, objectPath);
+      this.seal(objectPath);
+    }
+    return objectPath;
+  }
+
+  // 对象和链接到它的文件名共用inode，设为只读后原地写入任何一个文件名都会失败，而不是悄悄改变对象
+  seal(objectPath) {
+    fs.chmodSync(objectPath, OBJECT_MODE);
+    this.verified.set(objectPath, statKey(fs.statSync(objectPath)));
+  }
+
+  // 对象存在且内容与哈希一致时返回true；内容不一致的对象从存储中移除
+  async verify(objectPath, sha256) {
+    let stat;
+    try {
+      stat = fs.statSync(objectPath);
+    } catch (error) {
+      return false;
+    }
+    const key = statKey(stat);
+    if (this.verified.get(objectPath) === key) {
+      return true;
+    }
+    if ((await fileSha256(objectPath)) === sha256) {
+      this.verified.set(objectPath, key);
+      return true;
+    }
+
+    console.warn(`Content store object ${objectPath} does not match its hash, removing it`);
+    this.verified.delete(objectPath);
+    fs.rmSync(objectPath, { force: true });
+    return false;
+  }
+
+  describe(id, meta) {
+    return {
+      id,
+      filename: meta.filename,
+      size: meta.size,
+      offset: this.size(id),
+      sha256: meta.sha256,
+      chunk_size: UPLOAD_CHUNK_SIZE
+    };
+  }
+
+  meta(id) {
+    let meta = null;
+    if (UPLOAD_ID_PATTERN.test(id || '') && fs.existsSync(this.partPath(id))) {
+      try {
+        meta = JSON.parse(fs.readFileSync(this.metaPath(id), 'utf8'));
+      } catch (error) {
+        meta = null;
+      }
+    }
+    if (!meta) {
+      throw new UploadError('Upload not found', 404);
+    }
+    return meta;
+  }
+
+  size(id) {
+    return fs.statSync(this.partPath(id)).size;
+  }
+
+  partPath(id) {
+    return path.join(this.root, 'partial', `${id}.part`);
+  }
+
+  metaPath(id) {
+    return path.join(this.root, 'partial', `${id}.json`);
+  }
+}
+
+function statKey(stat) {
+  return `${stat.ino}:${stat.size}:${stat.mtimeMs}`;
+}
+
+function fileSha256(filePath) {
+  return new Promise((resolve, reject) => {
+    const hash = crypto.createHash('sha256');
+    fs.createReadStream(filePath)
+      .on('data', (data) => hash.update(data))
+      .on('end', () => resolve(hash.digest('hex')))
+      .on('error', reject);
+  });
+}
+
+function writeJson(filePath, data) {
+  const tmpPath = `${filePath}.${crypto.randomBytes(8).toString('hex')}.tmp`;
+  fs.writeFileSync(tmpPath, JSON.stringify(data));
+  fs.renameSync(tmpPath, filePath);
+}
+
+module.exports = { ContentStore, UploadError, UPLOAD_CHUNK_SIZE };
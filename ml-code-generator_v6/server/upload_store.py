@@ -0,0 +1,397 @@
+"""
+分块上传与按内容寻址的文件存储
+
+大文件分块上传，每块带有起始偏移，写入 <root>/partial/<上传ID>.part；连接中断后查询已写入的偏移量即可从断点继续。
+写入时顺序计算SHA-256，全部写完后文件移入 <root>/objects/<哈希前两位>/<哈希>，上传目录中的文件名是它的硬链接：
+同一内容上传多次只占用一份磁盘空间。客户端在开始上传前提供SHA-256时，已有的内容不需要再传输，直接建立链接。
+
+已写入的偏移量以磁盘上 .part 文件的大小为准，服务重启后仍可继续上传；重启前计算到一半的哈希无法恢复，
+此时在上传完成后重新读取一次文件计算。
+
+同一内容的所有文件名共用一个inode，对任何一个文件名的原地写入都会改变对象和其他文件名的内容。
+因此对象存入后设为只读（0444）；复用对象前（按哈希查找、内容已存在时）再校验一次哈希，
+文件没有变化（inode、大小、修改时间相同）时使用上一次的校验结果。被改写过的对象从存储中移除，
+链接到它的文件名保留改写后的内容，之后同一内容的上传重新传输并保存。
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+# 超过这个时间（秒）没有新分块的上传被清理
+UPLOAD_PARTIAL_TTL = float(os.getenv('UPLOAD_PARTIAL_TTL', str(24 * 3600)))
+
+COPY_BUFFER = 1024 * 1024
+OBJECT_MODE = 0o444
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    '''
+    分块上传请求无效
+
+    Params:
+        status: 对应的HTTP状态码
+        offset: 偏移量不一致时为服务端已写入的偏移量
+    '''
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class ContentStore:
+    '''
+    按内容哈希保存文件，并管理未完成的分块上传
+
+    Params:
+        root: 存储目录，需要与上传目录在同一个文件系统上才能建立硬链接（否则退化为复制）
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._upload_locks = {}
+        # 上传ID -> (已计算到的偏移量, hashlib对象)，按顺序写入时增量计算哈希
+        self._hashers = {}
+        # 对象路径 -> 校验通过时的 (inode, 大小, 修改时间)
+        self._verified = {}
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'partial'), exist_ok=True)
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, 'objects', sha256[:2], sha256)
+
+    def lookup(self, sha256):
+        '''
+        已保存内容的路径，没有或内容已被改写时返回None
+        '''
+        sha256 = (sha256 or '').lower()
+        if not SHA256_PATTERN.match(sha256):
+            return None
+        path = self.object_path(sha256)
+        return path if self._verify(path, sha256) else None
+
+    def create(self, filename, size, sha256=None, info=None):
+        '''
+        开始一个分块上传
+
+        Params:
+            filename: 上传完成后在上传目录中使用的文件名
+            size: 文件的总字节数
+            sha256: 客户端计算的内容哈希（可选），上传完成后校验
+            info: 上传完成时原样返回的附加信息（类型、描述等）
+
+        Returns:
+            upload: {"id", "filename", "size", "offset", "sha256", "chunk_size"}
+        '''
+        if not isinstance(size, int) or size < 0:
+            raise UploadError('size must be a non-negative integer')
+        if sha256 is not None and not SHA256_PATTERN.match(sha256.lower()):
+            raise UploadError('sha256 must be 64 hex characters')
+
+        self.cleanup()
+        upload_id = uuid.uuid4().hex
+        meta = {'filename': filename, 'size': size, 'sha256': sha256.lower() if sha256 else None,
+                'info': info or {}, 'created_at': time.time()}
+        _write_json(self._meta_path(upload_id), meta)
+        open(self._part_path(upload_id), 'wb').close()
+        with self._lock:
+            self._hashers[upload_id] = (0, hashlib.sha256())
+        return self._status(upload_id, meta)
+
+    def status(self, upload_id):
+        '''
+        上传的当前状态（用于断点续传），上传不存在时抛出UploadError(404)
+        '''
+        return self._status(upload_id, self._meta(upload_id))
+
+    def write_chunk(self, upload_id, offset, stream):
+        '''
+        从offset开始写入一个分块
+
+        Params:
+            offset: 分块的起始偏移，必须等于已写入的字节数（否则抛出409，附带服务端的偏移量）
+            stream: 有read(n)方法的分块内容
+
+        Returns:
+            upload: 写入后的状态
+        '''
+        meta = self._meta(upload_id)
+        with self._upload_lock(upload_id):
+            part_path = self._part_path(upload_id)
+            current = os.path.getsize(part_path)
+            if offset != current:
+                raise UploadError(f'Upload offset is {current}, got {offset}', status=409, offset=current)
+
+            with self._lock:
+                hashed, sha = self._hashers.get(upload_id, (None, None))
+            # 服务重启或哈希与文件不一致时不再增量计算，完成时重新读取
+            if hashed != current:
+                sha = None
+
+            written = current
+            try:
+                with open(part_path, 'r+b') as f:
+                    f.seek(current)
+                    while True:
+                        data = stream.read(COPY_BUFFER)
+                        if not data:
+                            break
+                        if written + len(data) > meta['size']:
+                            f.truncate(current)
+                            raise UploadError('Chunk exceeds the declared upload size', status=413, offset=current)
+                        f.write(data)
+                        if sha is not None:
+                            sha.update(data)
+                        written += len(data)
+            except BaseException:
+                # 分块只写入了一部分（连接中断等）：已写入的字节保留，哈希在完成时重新计算
+                with self._lock:
+                    self._hashers.pop(upload_id, None)
+                raise
+
+            with self._lock:
+                if sha is not None:
+                    self._hashers[upload_id] = (written, sha)
+                else:
+                    self._hashers.pop(upload_id, None)
+        return self._status(upload_id, meta)
+
+    def finish(self, upload_id):
+        '''
+        完成上传：校验哈希，把内容移入存储（内容已存在时丢弃本次上传的文件）
+
+        Returns:
+            (object_path, sha256, meta): meta中有创建时的filename和info
+        '''
+        meta = self._meta(upload_id)
+        with self._upload_lock(upload_id):
+            part_path = self._part_path(upload_id)
+            size = os.path.getsize(part_path)
+            if size != meta['size']:
+                raise UploadError(f'Upload is incomplete: {size} of {meta["size"]} bytes', status=409, offset=size)
+
+            with self._lock:
+                hashed, sha = self._hashers.pop(upload_id, (None, None))
+            sha256 = sha.hexdigest() if hashed == size else _file_sha256(part_path)
+            if meta['sha256'] and meta['sha256'] != sha256:
+                self._discard(upload_id)
+                raise UploadError('Uploaded content does not match the declared sha256', status=422)
+
+            object_path = self._commit(part_path, sha256)
+            os.remove(self._meta_path(upload_id))
+        with self._lock:
+            self._upload_locks.pop(upload_id, None)
+        return object_path, sha256, meta
+
+    def abort(self, upload_id):
+        self._meta(upload_id)
+        with self._upload_lock(upload_id):
+            self._discard(upload_id)
+        with self._lock:
+            self._upload_locks.pop(upload_id, None)
+
+    def ingest(self, stream):
+        '''
+        一次性保存stream的全部内容（普通的multipart上传），边写边计算哈希
+
+        Returns:
+            (object_path, sha256)
+        '''
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'partial'), suffix='.tmp')
+        sha = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    data = stream.read(COPY_BUFFER)
+                    if not data:
+                        break
+                    f.write(data)
+                    sha.update(data)
+            sha256 = sha.hexdigest()
+            return self._commit(tmp_path, sha256), sha256
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def link(self, object_path, dest):
+        '''
+        在dest建立指向object_path的硬链接，dest已存在时原子地替换；不能建立硬链接时复制
+        '''
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        if os.path.exists(dest) and os.path.samefile(object_path, dest):
+            return dest
+        tmp_path = f'{dest}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.link(object_path, tmp_path)
+        except OSError:
+            shutil.copyfile(object_path, tmp_path)
+        os.replace(tmp_path, dest)
+        return dest
+
+    def dedupe(self, folder):
+        '''
+        把folder中已有的普通文件移入存储并替换为硬链接，内容相同的文件只保留一份
+
+        Returns:
+            saved: 释放的字节数
+        '''
+        saved = 0
+        for entry in os.scandir(folder):
+            if not entry.is_file(follow_symlinks=False) or entry.name.endswith('.tmp'):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            sha256 = _file_sha256(entry.path)
+            object_path = self.lookup(sha256)
+            if object_path is None:
+                object_path = self.object_path(sha256)
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                try:
+                    os.link(entry.path, object_path)
+                except OSError:
+                    shutil.copyfile(entry.path, object_path)
+                self._seal(object_path)
+            elif not os.path.samefile(object_path, entry.path):
+                self.link(object_path, entry.path)
+                if stat.st_nlink == 1:
+                    saved += stat.st_size
+        return saved
+
+    def cleanup(self, ttl=UPLOAD_PARTIAL_TTL):
+        '''
+        删除超过ttl秒没有写入的未完成上传。一个上传的 .part 和 .json 作为整体过期：
+        .json 只在创建时写入一次，以 .part 的修改时间（最后一次写入分块的时间）为准
+        '''
+        deadline = time.time() - ttl
+        for entry in os.scandir(os.path.join(self.root, 'partial')):
+            upload_id, _, suffix = entry.name.partition('.')
+            part_path = self._part_path(upload_id)
+            try:
+                if suffix == 'json' and os.path.exists(part_path):
+                    modified = os.stat(part_path).st_mtime
+                else:
+                    modified = entry.stat().st_mtime
+                if modified >= deadline:
+                    continue
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                self._hashers.pop(upload_id, None)
+                self._upload_locks.pop(upload_id, None)
+
+    def _commit(self, path, sha256):
+        object_path = self.object_path(sha256)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        with self._lock:
+            if self._verify(object_path, sha256):
+                os.remove(path)
+            else:
+                os.replace(path, object_path)
+                self._seal(object_path)
+        return object_path
+
+    def _seal(self, object_path):
+        # 对象和链接到它的文件名共用inode，设为只读后原地写入任何一个文件名都会失败，而不是悄悄改变对象
+        os.chmod(object_path, OBJECT_MODE)
+        stat = os.stat(object_path)
+        self._verified[object_path] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _verify(self, object_path, sha256):
+        '''
+        对象存在且内容与哈希一致时返回True；内容不一致的对象从存储中移除
+        '''
+        try:
+            stat = os.stat(object_path)
+        except FileNotFoundError:
+            return False
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if self._verified.get(object_path) == key:
+            return True
+        if _file_sha256(object_path) == sha256:
+            self._verified[object_path] = key
+            return True
+
+        print(f'Content store object {object_path} does not match its hash, removing it')
+        self._verified.pop(object_path, None)
+        try:
+            os.remove(object_path)
+        except FileNotFoundError:
+            pass
+        return False
+
+    def _discard(self, upload_id):
+        for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+
+    def _status(self, upload_id, meta):
+        return {
+            'id': upload_id,
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'offset': os.path.getsize(self._part_path(upload_id)),
+            'sha256': meta['sha256'],
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+        }
+
+    def _meta(self, upload_id):
+        meta = _read_json(self._meta_path(upload_id)) if re.match(r'^[0-9a-f]{32}$', upload_id or '') else None
+        if meta is None or not os.path.exists(self._part_path(upload_id)):
+            raise UploadError('Upload not found', status=404)
+        return meta
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._upload_locks.setdefault(upload_id, threading.Lock())
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.root, 'partial', upload_id + '.part')
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.root, 'partial', upload_id + '.json')
+
+
+def _file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='把上传目录中已有的重复文件替换为指向内容存储的硬链接')
+    parser.add_argument('folder')
+    parser.add_argument('--store', help='存储目录，默认 <folder>/.store')
+    args = parser.parse_args()
+    saved = ContentStore(args.store or os.path.join(args.folder, '.store')).dedupe(args.folder)
+    print(f'Freed {saved} bytes')
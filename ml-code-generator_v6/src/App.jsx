@@ -662,7 +662,8 @@ ${solution ? `请严格按照下方参考解决方案的思路和结构进行代
             ...prev,
             currentStep: data.stepId,
             status: 'generating',
-            message: data.message
+            message: data.message,
+            currentStepCode: ''
           }));
           
           // 添加新的步骤到实时步骤列表
@@ -676,6 +677,20 @@ ${solution ? `请严格按照下方参考解决方案的思路和结构进行代
           }]);
         },
         
+        onStepDelta: (data) => {
+          // 流式输出：生成阶段的代码增量实时追加到当前步骤
+          if (data.stage !== 'generate') return;
+          setGenerationProgress(prev => ({
+            ...prev,
+            currentStepCode: (prev.currentStepCode || '') + data.delta
+          }));
+          setRealTimeSteps(prev => prev.map(step => 
+            step.id === data.stepId 
+              ? { ...step, code: (step.code || '') + data.delta }
+              : step
+          ));
+        },
+        
         onStepComplete: (data) => {
           console.log('Step complete:', data);
           setGenerationProgress(prev => ({
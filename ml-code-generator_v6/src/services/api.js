@@ -47,6 +47,10 @@ export const generateCodeRealtime = (taskPrompt, datasetPaths, callbacks) => {
     if (callbacks.onStepStarted) callbacks.onStepStarted(data);
   });
   
+  socket.on('step-delta', (data) => {
+    if (callbacks.onStepDelta) callbacks.onStepDelta(data);
+  });
+  
   socket.on('step-complete', (data) => {
     if (callbacks.onStepComplete) callbacks.onStepComplete(data);
   });
@@ -99,6 +103,7 @@ const cleanupEventListeners = (socket) => {
   socket.off('step-planning');
   socket.off('planning-complete');
   socket.off('step-started');
+  socket.off('step-delta');
   socket.off('step-complete');
   socket.off('step-checking');
   socket.off('step-error');
@@ -73,6 +73,40 @@ def test_metrics_analysis():
     except Exception as e:
         print(f"❌ 测试失败: {e}")
 
+def test_metrics_analysis_batch():
+    """测试批量指标分析功能"""
+    print("\n📦 测试批量指标分析功能")
+    print("=" * 50)
+    
+    try:
+        from deepseek_agent.api import analyze_task_metrics_batch
+        
+        # 重复的描述只分析一次，空描述作为该项的错误返回，不影响其他项
+        tasks = [
+            "使用随机森林模型对鸢尾花数据集进行分类，要求准确率达到95%以上，同时计算精确率和召回率",
+            "使用线性回归预测房价，需要计算MSE、MAE和R²指标，目标MSE小于0.1",
+            "使用随机森林模型对鸢尾花数据集进行分类，要求准确率达到95%以上，同时计算精确率和召回率",
+            "",
+        ]
+        
+        outcomes = analyze_task_metrics_batch(tasks)
+        
+        for i, (task, outcome) in enumerate(zip(tasks, outcomes), 1):
+            print(f"\n📋 批量项 {i}: {task or '(空描述)'}")
+            if outcome['success']:
+                names = [metric['name'] for metric in outcome['result'].get('metrics', [])]
+                print(f"✅ 分析成功: {names}")
+            else:
+                print(f"❌ 分析失败: {outcome['error']}")
+        
+        print("\n🎉 批量测试完成!")
+        
+    except ImportError as e:
+        print(f"❌ 导入错误: {e}")
+        print("请确保deepseek_agent模块正确安装")
+    except Exception as e:
+        print(f"❌ 批量测试失败: {e}")
+
 def test_metrics_agent_directly():
     """直接测试MetricsAnalyzerAgent"""
     print("\n🔧 直接测试MetricsAnalyzerAgent")
@@ -102,4 +136,5 @@ def test_metrics_agent_directly():
 
 if __name__ == "__main__":
     test_metrics_analysis()
+    test_metrics_analysis_batch()
     test_metrics_agent_directly() 
\ No newline at end of file